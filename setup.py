@@ -14,7 +14,7 @@ setup(
     packages = find_packages(),
     scripts = [],
 
-    install_requires = ['sphinxcontrib-plantuml'],
+    install_requires = ['sphinxcontrib-plantuml', 'numpy'],
 
     setup_requires = ['docutils', 'sphinxcontrib-plantuml'],
 
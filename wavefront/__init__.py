@@ -0,0 +1,25 @@
+"""
+Antelope waveform server.
+
+The Cython hot path, cbinner and ctimebuf, is built twice: unprofiled, and
+with profiling hooks as cbinner_prof and ctimebuf_prof. The hooks cost every
+Bin.add, TimeUtil.floor and TimeBuffer.update call, so the unprofiled build
+is used unless the WAVEFRONT_PROFILE environment variable is set when
+wavefront is first imported; then the profiled build is imported in its
+place, as wavefront.cbinner and wavefront.ctimebuf, and Cython functions
+show up in profiles, e.g. of a profiling.Session.
+"""
+
+import os
+import sys
+
+PROFILE_ENV = 'WAVEFRONT_PROFILE'
+
+PROFILED = bool(os.environ.get(PROFILE_ENV))
+
+if PROFILED:
+    # ctimebuf first; cbinner_prof imports modules importing ctimebuf
+    from wavefront import ctimebuf_prof as ctimebuf
+    sys.modules[__name__ + '.ctimebuf'] = ctimebuf
+    from wavefront import cbinner_prof as cbinner
+    sys.modules[__name__ + '.cbinner'] = cbinner
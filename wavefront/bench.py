@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+"""
+Ingest benchmarks on synthetic workloads.
+
+A workload is nchannels channels at samprate, in packets of pktlen seconds
+each, for duration seconds, with a fraction of packets dropped (gaps),
+delivered late, i.e. out of order, and delivered twice (dups). Workloads
+are generated from a seed, so runs are repeatable.
+
+Each layer of the ingest path is measured separately, for each of its
+implementations:
+
+timebuf
+    bin lookups and updates, as a binner does them; timebuf.TimeBuffer,
+    ctimebuf.TimeBuffer and ctimebuf.BinBuffer
+binner
+    Binner.update; binner.Binner over timebuf.TimeBuffer, and cbinner.Binner
+    over ctimebuf.TimeBuffer and BinBuffer
+orb
+    Orb._process, unstuffing through a replay.ReplaySource and binning with
+    a BinController, as in production less the reaping
+
+For each it reports samples/s, pkts/s, per packet latency percentiles and
+peak RSS. Peak RSS is the high water mark of the whole process, so it
+only grows; run one layer per process, with --layers, to compare memory.
+
+Example::
+
+    python -m wavefront.bench --channels 400 --late 0.05 --json results.json
+"""
+
+import argparse
+import json
+import platform
+import resource
+import sys
+from datetime import datetime
+from timeit import default_timer
+
+import numpy as np
+
+import logging
+
+from wavefront import binner, timebuf, cbinner, ctimebuf
+from wavefront.controller import Orb
+from wavefront.replay import ReplaySource, stuff
+
+log = logging.getLogger(__name__)
+
+
+LAYERS = ('timebuf', 'binner', 'orb')
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class Workload(object):
+    """Synthetic packets; see the module docs."""
+
+    def __init__(self, nchannels=50, samprate=40.0, pktlen=1.0,
+                 duration=300.0, gaps=0.0, late=0.0, dups=0.0, latency=30,
+                 twin=600.0, tbin=1.0, seed=0):
+        self.nchannels = nchannels
+        self.samprate = samprate
+        self.pktlen = pktlen
+        self.duration = duration
+        self.gaps = gaps
+        self.late = late
+        self.dups = dups
+        # how many packets later late packets arrive
+        self.latency = latency
+        self.twin = twin
+        self.tbin = tbin
+        self.seed = seed
+        self.packets = self._generate()
+        self.nsamples = sum(len(channel[6]) for packet in self.packets
+                            for channel in packet[3])
+
+    def params(self):
+        return dict((name, getattr(self, name)) for name in (
+                'nchannels', 'samprate', 'pktlen', 'duration', 'gaps', 'late',
+                'dups', 'latency', 'twin', 'tbin', 'seed'))
+
+    def srcnames(self):
+        return ['XX_S%04d_BHZ' % n for n in xrange(self.nchannels)]
+
+    def _generate(self):
+        """Return (pktid, srcname, time, channels) tuples in arrival order;
+        one channel per packet."""
+        random = np.random.RandomState(self.seed)
+        nsamp = int(round(self.pktlen * self.samprate))
+        t0 = 1.4e9
+        packets = []
+        for n in xrange(int(self.duration / self.pktlen)):
+            time = t0 + n * self.pktlen
+            for srcname in self.srcnames():
+                if random.random_sample() < self.gaps:
+                    continue
+                net, sta, chan = srcname.split('_')
+                data = random.randint(-1 << 20, 1 << 20, nsamp).astype(np.int32)
+                packets.append((len(packets), '%s_%s/MGENC' % (net, sta), time,
+                                [(net, sta, chan, '', time, self.samprate,
+                                  data)]))
+        delayed = []
+        arrivals = []
+        for packet in packets:
+            if random.random_sample() < self.late:
+                delayed.append((len(arrivals) + self.latency, packet))
+            else:
+                arrivals.append(packet)
+            if random.random_sample() < self.dups:
+                arrivals.append(packet)
+            while delayed and delayed[0][0] <= len(arrivals):
+                arrivals.append(delayed.pop(0)[1])
+        arrivals.extend(packet for due, packet in delayed)
+        return arrivals
+
+
+def measure(layer, implementation, workload, process):
+    """Call process(packet) for every packet of workload; return results
+    as a dict."""
+    latencies = np.empty(len(workload.packets))
+    start = default_timer()
+    for n, packet in enumerate(workload.packets):
+        before = default_timer()
+        process(packet)
+        latencies[n] = default_timer() - before
+    seconds = default_timer() - start
+    nsamples = workload.nsamples
+    result = dict(
+        layer=layer,
+        implementation=implementation,
+        pkts=len(workload.packets),
+        samples=nsamples,
+        seconds=seconds,
+        pkts_per_sec=len(workload.packets) / seconds,
+        samples_per_sec=nsamples / seconds,
+        maxrss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    )
+    for p in PERCENTILES:
+        result['latency_p%s_us' % p] = np.percentile(latencies, p) * 1e6
+    result['latency_max_us'] = latencies.max() * 1e6
+    log.info("%(layer)s %(implementation)s: %(samples_per_sec).0f samples/s "
+             "%(pkts_per_sec).0f pkts/s p99 %(latency_p99_us).0f us" % result)
+    return result
+
+
+def _bin_times(workload, packet):
+    pktid, srcname, time, channels = packet
+    for net, sta, chan, loc, time, samprate, data in channels:
+        for n in xrange(int(len(data) / (samprate * workload.tbin))):
+            yield time + n * workload.tbin
+
+
+def bench_timebuf(workload):
+    size = int(workload.twin / workload.tbin)
+    binsize = int(workload.tbin * workload.samprate)
+    implementations = [
+        ('timebuf.TimeBuffer', lambda: timebuf.TimeBuffer(size, 0, workload.tbin),
+         lambda store, ts: store.update([(ts, binner.Bin(binsize, ts))])),
+        ('ctimebuf.TimeBuffer',
+         lambda: ctimebuf.TimeBuffer(size, 0, workload.tbin),
+         lambda store, ts: store.update(ts, cbinner.Bin(ts, binsize))),
+        ('ctimebuf.BinBuffer', lambda: ctimebuf.BinBuffer(size, 0, workload.tbin),
+         lambda store, ts: store.update(ts, cbinner.Bin(ts, binsize))),
+    ]
+    results = []
+    for name, factory, create in implementations:
+        stores = dict((srcname, factory()) for srcname in
+                      set(packet[1] for packet in workload.packets))
+        def process(packet):
+            store = stores[packet[1]]
+            for ts in _bin_times(workload, packet):
+                if store.get(ts) is None:
+                    create(store, ts)
+        results.append(measure('timebuf', name, workload, process))
+    return results
+
+
+def bench_binner(workload):
+    size = int(workload.twin / workload.tbin)
+    implementations = [
+        ('binner.Binner/timebuf.TimeBuffer', binner.Binner,
+         lambda: timebuf.TimeBuffer(size, 0, workload.tbin)),
+        ('cbinner.Binner/ctimebuf.TimeBuffer', cbinner.Binner,
+         lambda: ctimebuf.TimeBuffer(size, 0, workload.tbin)),
+        ('cbinner.Binner/ctimebuf.BinBuffer', cbinner.Binner,
+         lambda: ctimebuf.BinBuffer(size, 0, workload.tbin)),
+    ]
+    results = []
+    for name, binner_class, factory in implementations:
+        binners = dict()
+        def process(packet):
+            for net, sta, chan, loc, time, samprate, data in packet[3]:
+                key = net, sta, chan
+                try:
+                    b = binners[key]
+                except KeyError:
+                    b = binners[key] = binner_class('_'.join(key),
+                                                    workload.twin,
+                                                    workload.tbin, factory())
+                b.update(time, data, samprate)
+        results.append(measure('binner', name, workload, process))
+    return results
+
+
+def bench_orb(workload):
+    # only the source's unstuff is used; there's no capture to replay
+    orb = Orb('bench', source=ReplaySource(None, speed=None))
+    orb.add_binner('.*', workload.twin, workload.tbin)
+    timestamp = datetime.utcnow()
+    packets = workload.packets
+    # stuffed up front; unstuffing is part of the path, stuffing isn't
+    workload.packets = [(pktid, srcname, time, stuff(channels))
+                        for pktid, srcname, time, channels in packets]
+    try:
+        return [measure('orb', 'Orb._process', workload,
+                        lambda packet: orb._process(packet, timestamp))]
+    finally:
+        workload.packets = packets
+
+
+def run(workload, layers=LAYERS):
+    """Run the benchmarks of the given layers; return a dict of the results
+    and what they ran on."""
+    results = []
+    for layer in layers:
+        results.extend(globals()['bench_' + layer](workload))
+    return dict(
+        workload=workload.params(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        numpy=np.__version__,
+        date=datetime.utcnow().isoformat(),
+        results=results,
+    )
+
+
+def report(run, f=sys.stdout):
+    columns = (('implementation', '%-36s'), ('samples_per_sec', '%12.0f'),
+               ('pkts_per_sec', '%10.0f'), ('latency_p50_us', '%8.1f'),
+               ('latency_p99_us', '%8.1f'), ('latency_max_us', '%9.1f'),
+               ('maxrss_kb', '%9d'))
+    f.write('%-36s %12s %10s %8s %8s %9s %9s\n' % (
+            'implementation', 'samples/s', 'pkts/s', 'p50 us', 'p99 us',
+            'max us', 'rss kB'))
+    for result in run['results']:
+        f.write(' '.join(fmt % result[name] for name, fmt in columns) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest benchmarks")
+    parser.add_argument('--channels', type=int, default=50)
+    parser.add_argument('--samprate', type=float, default=40.0)
+    parser.add_argument('--pktlen', type=float, default=1.0,
+                        help="seconds per packet")
+    parser.add_argument('--duration', type=float, default=300.0,
+                        help="seconds of data per channel")
+    parser.add_argument('--gaps', type=float, default=0.0,
+                        help="fraction of packets dropped")
+    parser.add_argument('--late', type=float, default=0.0,
+                        help="fraction of packets delivered late")
+    parser.add_argument('--dups', type=float, default=0.0,
+                        help="fraction of packets delivered twice")
+    parser.add_argument('--tbin', type=float, default=1.0)
+    parser.add_argument('--twin', type=float, default=600.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--layers', default=','.join(LAYERS),
+                        help="comma separated subset of %s" % ', '.join(LAYERS))
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args(argv)
+    layers = args.layers.split(',')
+    for layer in layers:
+        if layer not in LAYERS:
+            parser.error("Unknown layer %r" % layer)
+    workload = Workload(args.channels, args.samprate, args.pktlen,
+                        args.duration, args.gaps, args.late, args.dups,
+                        twin=args.twin, tbin=args.tbin, seed=args.seed)
+    results = run(workload, layers)
+    report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
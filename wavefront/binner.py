@@ -1,12 +1,10 @@
 #!/usr/bin/env python
 
-from contextlib import contextmanager
-
 import sys
 
 from wavefront.timebuf import TimeUtil
 
-from Queue import Queue
+from wavefront.fanout import Hub
 
 class Bin(object):
     __slots__ = """__init__ __eq__ __ne__ add __repr__ asdict size timestamp
@@ -66,7 +64,7 @@ class Binner(TimeUtil):
         self.store = store
         self.previous = None
         self.element_time = tbin
-        self._queues = set()
+        self.hub = Hub((srcname, tbin))
 
     def update(self, root_ts, samples, samprate):
         """Update bins from samples, return set of updated bins."""
@@ -96,34 +94,20 @@ class Binner(TimeUtil):
         self._publish(updated)
 
     def _publish(self, obj):
-        for queue in self._queues:
-            try:
-                queue.put(obj, block=False)
-            except Full:
-                log.warning("queue overflow")
-                # todo disconnect slow client
+        self.hub.publish(obj)
 
-    @contextmanager
-    def subscription(self, queue):
-        """Subscribe queue
+    def subscription(self, subscriber):
+        """Subscribe a fanout.Subscriber, or a queue
 
-        :param queue: The queue to which you would like packets to be published
-        :type queue: Instance of ``Queue`` or compatible
+        :param subscriber: Where updates should be published
+        :type subscriber: ``fanout.Subscriber``, or ``Queue`` or compatible
 
         Example::
 
-            queue = Queue()
-            with publisher.subscription(queue):
+            subscriber = Subscriber()
+            with binner.subscription(subscriber):
                 while True:
-                    pickledpacket = queue.get()
+                    bins = subscriber.get()
                     ...
         """
-        self._queues.add(queue)
-        try:
-            yield
-        finally:
-            # Stop publishing
-            self._queues.remove(queue)
-
-
-
+        return self.hub.subscription(subscriber)
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+"""
+In-process caches.
+
+LRUCache is a mapping bounded by the total size in bytes of its values,
+evicting least recently used items first.
+
+PacketCache is the orb packet cache of the design; raw orb packets keyed by
+(srcname, start time), with a per srcname time index for looking up the
+packets overlapping a window. It is filled from the reap loop and by fetch(),
+which goes to the orb, through a loader, only for windows it hasn't loaded
+yet.
+
+CacheBackend is the interface of the caches for query results; str keys and
+str values, fetched and stored many at a time. LocalCache keeps them in
+process; MemcacheCache in memcached, so they survive restarts and are shared
+by every server using the same memcached.
+"""
+
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from hashlib import sha1
+
+from gevent import socket
+from gevent.lock import Semaphore
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class LRUCache(object):
+    """Least recently used cache bounded by maxbytes.
+
+    :param sizeof: returns the size of a value in bytes; len by default
+    :param on_evict: optional, called with (key, value) for evicted items
+    """
+
+    def __init__(self, maxbytes, sizeof=len, on_evict=None):
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (value, nbytes), least recently used first
+        self._items = OrderedDict()
+
+    def __repr__(self):
+        return "<%s %d items, %d of %d bytes>" % (
+                self.__class__.__name__, len(self), self.nbytes, self.maxbytes)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __getitem__(self, key):
+        try:
+            value, nbytes = self._items.pop(key)
+        except KeyError:
+            self.misses += 1
+            raise
+        self._items[key] = value, nbytes
+        self.hits += 1
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        nbytes = self.sizeof(value)
+        self.discard(key)
+        if nbytes > self.maxbytes:
+            log.debug("Not caching %r; %d bytes" % (key, nbytes))
+            return
+        self._items[key] = value, nbytes
+        self.nbytes += nbytes
+        while self.nbytes > self.maxbytes:
+            old, (value, size) = self._items.popitem(last=False)
+            self.nbytes -= size
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(old, value)
+
+    def set(self, key, value):
+        self[key] = value
+
+    def discard(self, key):
+        """Remove key if present; not counted as an eviction."""
+        try:
+            value, nbytes = self._items.pop(key)
+        except KeyError:
+            return
+        self.nbytes -= nbytes
+
+    def clear(self):
+        self._items.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return dict(items=len(self), nbytes=self.nbytes,
+                    maxbytes=self.maxbytes, hits=self.hits,
+                    misses=self.misses, evictions=self.evictions)
+
+
+def channel_srcname(channel):
+    """Return the srcname of a channel of an unstuffed Packet, e.g.
+    'TA_109C_BHZ', with the loc code appended if there is one."""
+    parts = [channel.net, channel.sta, channel.chan]
+    if channel.loc is not '':
+            parts.append(channel.loc)
+    return '_'.join(parts)
+
+
+def packet_endtime(packet):
+    """Return the time just after the last sample of an unstuffed Packet."""
+    return max([channel.time + len(channel.data) / channel.samprate
+                for channel in packet.channels if channel.samprate] or
+               [packet.time])
+
+
+class PacketCache(object):
+    """Raw orb packets keyed by (srcname, start time), LRU bounded by bytes.
+
+    srcname is the orb packet srcname, e.g. 'TA_109C/MGENC'.
+    """
+
+    def __init__(self, maxbytes):
+        self._cache = LRUCache(maxbytes, lambda entry: len(entry[1]),
+                               self._evicted)
+        # srcname -> sorted start times of cached packets
+        self._times = dict()
+        # srcname -> longest cached packet duration; bounds range lookups
+        self._durations = dict()
+        # srcname -> [(tstart, tend)] windows fully loaded by fetch
+        self._loaded = dict()
+
+    def __repr__(self):
+        return "<PacketCache %r>" % self._cache
+
+    def __len__(self):
+        return len(self._cache)
+
+    @property
+    def nbytes(self):
+        return self._cache.nbytes
+
+    def stats(self):
+        return self._cache.stats()
+
+    def add(self, srcname, time, endtime, raw):
+        """Cache a raw packet spanning time up to endtime."""
+        key = srcname, time
+        if key not in self._cache:
+            insort(self._times.setdefault(srcname, []), time)
+        self._durations[srcname] = max(self._durations.get(srcname, 0),
+                                       endtime - time)
+        self._cache[key] = endtime, raw
+        if key not in self._cache:
+            # too big to cache
+            self._remove_time(srcname, time)
+            self._unload(srcname, time, endtime)
+
+    def add_packet(self, srcname, raw, packet):
+        """Cache a raw packet given its unstuffed Packet."""
+        self.add(srcname, packet.time, packet_endtime(packet), raw)
+
+    def _remove_time(self, srcname, time):
+        times = self._times[srcname]
+        del times[bisect_left(times, time)]
+        if not times:
+            del self._times[srcname]
+            self._durations.pop(srcname, None)
+
+    def _evicted(self, key, entry):
+        srcname, time = key
+        self._remove_time(srcname, time)
+        self._unload(srcname, time, entry[0])
+
+    def _unload(self, srcname, time, endtime):
+        """Windows overlapping a packet which isn't cached aren't complete
+        any more."""
+        loaded = self._loaded.get(srcname)
+        if loaded:
+            loaded[:] = [(t0, t1) for t0, t1 in loaded
+                         if t1 <= time or t0 >= endtime]
+
+    def lookup(self, srcname, tstart, tend):
+        """Return [(time, endtime, raw)] of cached packets overlapping
+        tstart up to tend, ordered by time."""
+        times = self._times.get(srcname)
+        if not times:
+            return []
+        lo = bisect_left(times, tstart - self._durations[srcname])
+        hi = bisect_left(times, tend)
+        result = []
+        for time in times[lo:hi]:
+            endtime, raw = self._cache[srcname, time]
+            if endtime > tstart:
+                result.append((time, endtime, raw))
+        return result
+
+    def loaded(self, srcname, tstart, tend):
+        """True if a fetch has loaded all packets from tstart up to tend."""
+        for t0, t1 in self._loaded.get(srcname, ()):
+            if t0 <= tstart and tend <= t1:
+                return True
+        return False
+
+    def fetch(self, srcname, tstart, tend, loader):
+        """Like lookup, but if the window isn't fully loaded yet, first call
+        loader(srcname, tstart, tend), which must return every packet in the
+        window as (time, endtime, raw) tuples, e.g. read from the orb, and
+        cache them. If the loader returns None, e.g. because the window is
+        older than the orb holds, so does fetch."""
+        if not self.loaded(srcname, tstart, tend):
+            packets = loader(srcname, tstart, tend)
+            if packets is None:
+                return None
+            # recorded first, so evictions while adding undo it
+            self._loaded.setdefault(srcname, []).append((tstart, tend))
+            for time, endtime, raw in packets:
+                self.add(srcname, time, endtime, raw)
+        return self.lookup(srcname, tstart, tend)
+
+
+class CacheBackend(object):
+    """Cache of str values by str key.
+
+    Backends are greenlet safe; any number of greenlets may call them at
+    the same time.
+    """
+
+    def get_multi(self, keys):
+        """Return a dict of the cached values of keys; missing keys are left
+        out."""
+        raise NotImplementedError
+
+    def set_multi(self, mapping):
+        """Cache every key and value of mapping."""
+        raise NotImplementedError
+
+    def get(self, key):
+        return self.get_multi([key]).get(key)
+
+    def set(self, key, value):
+        self.set_multi({key: value})
+
+
+class LocalCache(CacheBackend):
+    """In process backend; an LRUCache of maxbytes."""
+
+    def __init__(self, maxbytes):
+        self.lru = LRUCache(maxbytes)
+
+    def __repr__(self):
+        return "<LocalCache %r>" % self.lru
+
+    def get_multi(self, keys):
+        result = {}
+        for key in keys:
+            value = self.lru.get(key)
+            if value is not None:
+                result[key] = value
+        return result
+
+    def set_multi(self, mapping):
+        for key, value in mapping.iteritems():
+            self.lru[key] = value
+
+    def stats(self):
+        return self.lru.stats()
+
+
+class MemcacheCache(CacheBackend):
+    """memcached backend speaking the text protocol over one connection.
+
+    get_multi is a single multi-key get; set_multi pipelines noreply sets in
+    one write. Greenlets take turns on the connection, one request and its
+    response at a time. Connection errors are logged and treated as misses, so a down
+    memcached only costs recomputation; the next call reconnects.
+
+    :param expire: expiry time of stored values, seconds; 0 for never
+    :param prefix: prepended to every key, to share a memcached
+    """
+
+    MAXKEY = 250
+
+    def __init__(self, address=('127.0.0.1', 11211), timeout=5, expire=0,
+                 prefix='wf:'):
+        self.address = address
+        self.timeout = timeout
+        self.expire = expire
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._socket = None
+        self._file = None
+        # held for each request/response exchange on the connection
+        self._lock = Semaphore()
+
+    def __repr__(self):
+        return "<MemcacheCache %s:%s>" % self.address
+
+    def _connect(self):
+        if self._socket is None:
+            self._socket = socket.create_connection(self.address, self.timeout)
+            self._file = self._socket.makefile('rb')
+        return self._socket
+
+    def close(self):
+        if self._socket is not None:
+            self._file.close()
+            self._socket.close()
+        self._socket = self._file = None
+
+    def _key(self, key):
+        key = self.prefix + key
+        if len(key) > self.MAXKEY or len(key.split()) != 1:
+            key = self.prefix + sha1(key).hexdigest()
+        return key
+
+    def get_multi(self, keys):
+        if not keys:
+            return {}
+        keys = dict((self._key(key), key) for key in keys)
+        result = {}
+        with self._lock:
+            try:
+                self._connect().sendall('get %s\r\n' % ' '.join(keys))
+                while True:
+                    line = self._file.readline()
+                    if line == 'END\r\n':
+                        break
+                    parts = line.split()
+                    if len(parts) != 4 or parts[0] != 'VALUE':
+                        raise IOError("Unexpected response %r" % line)
+                    length = int(parts[3])
+                    value = self._file.read(length + 2)[:length]
+                    if len(value) != length:
+                        raise IOError("Connection closed")
+                    result[keys[parts[1]]] = value
+            except (IOError, socket.error), e:
+                self._failed(e)
+                return {}
+        self.hits += len(result)
+        self.misses += len(keys) - len(result)
+        return result
+
+    def set_multi(self, mapping):
+        if not mapping:
+            return
+        commands = []
+        for key, value in mapping.iteritems():
+            commands.append('set %s 0 %d %d noreply\r\n%s\r\n' % (
+                    self._key(key), self.expire, len(value), value))
+        with self._lock:
+            try:
+                self._connect().sendall(''.join(commands))
+            except (IOError, socket.error), e:
+                self._failed(e)
+
+    def _failed(self, e):
+        self.errors += 1
+        log.warning("memcached %s:%s failed: %s" % (self.address + (e,)))
+        self.close()
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, errors=self.errors)
@@ -0,0 +1,330 @@
+# Included by cbinner.pyx and cbinner_prof.pyx, which cimport TimeUtil and
+# import bins_to_array from the matching ctimebuf build.
+
+import cython
+from libc.math cimport ceil
+
+import sys
+
+import numpy as np
+
+from wavefront.fanout import Hub
+
+import logging
+log = logging.getLogger(__name__)
+
+
+cdef class Bin:
+    cdef public int size
+    cdef public double timestamp
+    cdef public double max
+    cdef public double min
+    cdef public double mean 
+    cdef public int nsamples
+
+    def __cinit__(self, double timestamp, int size):
+        self.size = size
+        self.timestamp = timestamp
+        self.mean = 0
+        self.nsamples = 0
+
+#    cpdef __eq__(self, o):
+#        return (self.timestamp, self.max, self.min, self.mean, self.nsamples ==
+#                o.timestamp, o.max, o.min, o.mean, o.nsamples)
+
+#    cpdef __ne__(self, o):
+#        return not (self == o)
+
+    cpdef add(self, double ts, double val):
+        # not >= b/c sometimes nsamples == size + 1 due to aliasing
+        if self.nsamples > self.size:
+            sys.stderr.write("Warning: Bin overflow; duplicate data? %s %s\n" %
+                                    (self.nsamples, self.size))
+        if self.nsamples == 0:
+            self.max = val
+            self.min = val
+        else:
+            self.max = max(self.max, val)
+            self.min = min(self.min, val)
+        with cython.cdivision(True):
+            self.mean += val / self.size
+        self.nsamples += 1
+
+    cpdef add_block(self, double max, double min, double total, int count):
+        """Add a run of count samples already reduced to max, min and sum."""
+        if self.nsamples + count - 1 > self.size:
+            sys.stderr.write("Warning: Bin overflow; duplicate data? %s %s\n" %
+                                    (self.nsamples + count, self.size))
+        if self.nsamples == 0:
+            self.max = max
+            self.min = min
+        else:
+            self.max = max if max > self.max else self.max
+            self.min = min if min < self.min else self.min
+        with cython.cdivision(True):
+            self.mean += total / self.size
+        self.nsamples += count
+
+    def __repr__(self):
+        return str((self.timestamp, self.max, self.min, self.mean,
+                        self.nsamples))
+
+    cpdef asdict(self):
+        return dict(
+            timestamp=self.timestamp,
+            max=self.max,
+            min=self.min,
+            mean=self.mean,
+            nsamples=self.nsamples)
+
+
+cpdef Bin detach(bin):
+    """Return a Bin copy of a Bin-like, e.g. a BinView, which later updates
+    of its store don't change."""
+    cdef Bin copy = Bin.__new__(Bin, bin.timestamp, bin.size)
+    copy.max = bin.max
+    copy.min = bin.min
+    copy.mean = bin.mean
+    copy.nsamples = bin.nsamples
+    return copy
+
+
+def reduce_block(double root_ts, samples, double samprate,
+                 double element_time):
+    """Reduce a block of samples starting at root_ts into bins of
+    element_time seconds.
+
+    Sample times are mapped to bin numbers, the block is split into runs of
+    equal bin number and max/min/sum/count are computed per run with
+    reduceat. Return arrays (binnums, run start times, maxes, mins, sums,
+    counts), one entry per run, in sample order.
+    """
+    cdef double period
+    data = np.asarray(samples, dtype=np.float64)
+    with cython.cdivision(True):
+        period = 1.0 / samprate
+    times = root_ts + period * np.arange(len(data))
+    binnums = (times / element_time).astype(np.int64)
+    starts = np.flatnonzero(np.diff(binnums)) + 1
+    starts = np.concatenate(([0], starts))
+    return (binnums[starts],
+            times[starts],
+            np.maximum.reduceat(data, starts),
+            np.minimum.reduceat(data, starts),
+            np.add.reduceat(data, starts),
+            np.diff(np.append(starts, len(data))))
+
+
+class Binner(TimeUtil):
+    def __init__(self, srcname, twin, tbin, store, encoder=None):
+        """
+        binsize = 1 / samprate * timebuf.tbin
+
+        If encoder is given, e.g. a wire.FrameEncoder, updates are encoded
+        once and subscribers get the encoded frames instead of lists of bins.
+        Updates are fanned out to subscribers through a fanout.Hub.
+        """
+        # won't know this until after we get the first packet
+        # don't need to know it until update
+        self.srcname = srcname
+        self.twin = twin
+        self.tbin = tbin
+        self.store = store
+        self.previous = None
+        self.element_time = tbin
+        self.encoder = encoder
+        self.hub = Hub((srcname, tbin), encoder)
+        # coarser pyramid levels derived from this one
+        self.children = []
+        # blocks dropped as older than the buffer, and blocks with late data
+        self.nstale = 0
+        self.nlate = 0
+        assert self.element_time != 0.0
+
+    def update(self, double root_ts, samples, double samprate):
+        """Update bins from a block of samples starting at root_ts.
+
+        The block is reduced in a single vectorized pass, see reduce_block.
+        Only the per-bin bookkeeping is done in Python.
+
+        Samples older than the buffer tail are dropped up front; a block
+        entirely older is dropped without looking at its samples. Samples
+        older than the bin being filled, i.e. late or out of order, are
+        merged into their bins in place without disturbing the completion
+        tracking of real time data, and every bin they touch is republished.
+        All updated bins of a block are published as one message.
+        """
+        cdef object current
+        cdef object previous
+        cdef object store
+        cdef int binsize
+        cdef int before
+        cdef int count
+        cdef int skip
+        cdef Py_ssize_t run
+        cdef Py_ssize_t nlate
+        cdef double period
+        cdef double tail
+
+        assert samprate != 0.0
+        if len(samples) == 0:
+            return
+        store = self.store
+        with cython.cdivision(True):
+            period = 1.0 / samprate
+        tail = store.tail_time()
+        if root_ts + period * (len(samples) - 1) < tail:
+            self.nstale += 1
+            return
+        if root_ts < tail:
+            skip = <int>ceil((tail - root_ts) * samprate)
+            samples = samples[skip:]
+            root_ts += skip * period
+        binsize = self.tbin * samprate
+        binnums, run_times, maxes, mins, sums, counts = reduce_block(
+                root_ts, samples, samprate, self.element_time)
+        floors = binnums * self.element_time
+        previous = self.previous
+        nlate = 0
+        if previous is not None:
+            nlate = np.count_nonzero(floors < previous.timestamp)
+        floors = floors.tolist()
+        run_times = run_times.tolist()
+        maxes = maxes.tolist()
+        mins = mins.tolist()
+        sums = sums.tolist()
+        counts = counts.tolist()
+
+        updated = []
+        if nlate:
+            self.nlate += 1
+            for run in xrange(nlate):
+                if floors[run] < tail:
+                    continue
+                current = self._bin(store, run_times[run], floors[run],
+                                    binsize)
+                current.add_block(maxes[run], mins[run], sums[run],
+                                  counts[run])
+                updated.append(current)
+        for run in xrange(nlate, len(counts)):
+            current = self._bin(store, run_times[run], floors[run], binsize)
+            before = current.nsamples
+            count = counts[run]
+            current.add_block(maxes[run], mins[run], sums[run], count)
+
+            # Same completion rules as adding the run one sample at a time:
+            # the first sample of a run may supersede the previous bin, and
+            # the bin is complete if any sample of the run fills it.
+            if previous is None:
+                previous = current
+            if before + 1 == binsize:
+                updated.append(current)
+            elif (previous.timestamp != current.timestamp and
+                  previous.nsamples < binsize):
+                updated.append(previous)
+            if before + 1 < binsize <= before + count:
+                updated.append(current)
+            previous = current
+        # a copy; the store may empty or reuse the slot, e.g. across a gap
+        self.previous = detach(previous)
+
+        if len(updated) > 0:
+            self._publish(updated)
+
+    def _bin(self, store, double run_time, double floor, int binsize):
+        """Return the bin of store holding run_time, creating it if need
+        be."""
+        current = store.get(run_time)
+        if current is None:
+            current = Bin.__new__(Bin, floor, binsize)
+            store.update(run_time, current)
+            # columnar stores copy the bin; keep adding to their copy
+            current = store.get(run_time, current)
+        return current
+
+    def _publish(self, bins):
+        # subscribers may read updates long after, once slots are reused
+        bins = [detach(bin) for bin in bins]
+        self.hub.publish(bins)
+        for child in self.children:
+            child.derive(bins)
+
+    def subscription(self, subscriber):
+        """Subscribe a fanout.Subscriber, or a queue
+
+        :param subscriber: Where updates should be published
+        :type subscriber: ``fanout.Subscriber``, or ``Queue`` or compatible
+
+        Example::
+
+            subscriber = Subscriber(maxsize=64, policy=COALESCE)
+            with binner.subscription(subscriber):
+                while True:
+                    frame = subscriber.get()
+                    ...
+        """
+        return self.hub.subscription(subscriber)
+
+
+def window(store, double start, double stop):
+    """Return the bins of store from start up to stop as a BIN_DTYPE array."""
+    return bins_to_array(store.get_range(start, stop))
+
+
+class DerivedBinner(Binner):
+    """A coarse level of a binning pyramid.
+
+    Instead of binning raw samples, coarse bins are recomputed from the bins
+    of the next finer level, the source, whenever it publishes: max of max,
+    min of min and summed nsamples. Bin.mean is the sample sum over the bin
+    size, so the coarse mean is the sum of the fine means over the tbin
+    ratio, i.e. their mean weighted by samples; exactly what binning the raw
+    samples would give. Recomputing rather than accumulating means
+    republished fine bins are never counted twice.
+
+    The source must keep at least one coarse bin's worth of bins, and tbin
+    must be a multiple of the source tbin.
+    """
+
+    def __init__(self, source, twin, tbin, store, encoder=None):
+        ratio = tbin / source.tbin
+        if abs(ratio - round(ratio)) > 1e-9 or ratio < 2:
+            raise ValueError("tbin %s is not a multiple of source tbin %s" %
+                             (tbin, source.tbin))
+        if source.twin < tbin:
+            raise ValueError("source twin %s shorter than tbin %s" %
+                             (source.twin, tbin))
+        super(DerivedBinner, self).__init__(source.srcname, twin, tbin, store,
+                                            encoder)
+        self.source = source
+        self.ratio = int(round(ratio))
+        source.children.append(self)
+
+    def update(self, double root_ts, samples, double samprate):
+        raise TypeError("DerivedBinner is fed by its source binner")
+
+    def derive(self, bins):
+        """Recompute and publish the coarse bins covering the given updated
+        source bins."""
+        cdef double ts
+        cdef int size
+        store = self.store
+        updated = []
+        timestamps = sorted(set((<TimeUtil>self).floor(bin.timestamp)
+                                for bin in bins))
+        size = bins[0].size * self.ratio
+        for ts in timestamps:
+            fine = window(self.source.store, ts, ts + self.tbin)
+            fine = fine[fine['nsamples'] > 0]
+            if len(fine) == 0:
+                continue
+            current = Bin.__new__(Bin, ts, size)
+            current.max = fine['max'].max()
+            current.min = fine['min'].min()
+            with cython.cdivision(True):
+                current.mean = fine['mean'].sum() / self.ratio
+            current.nsamples = fine['nsamples'].sum()
+            store.update(ts, current)
+            updated.append(store.get(ts, current))
+        if len(updated) > 0:
+            self._publish(updated)
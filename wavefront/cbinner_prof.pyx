@@ -0,0 +1,9 @@
+# cython: profile=True
+"""
+Binners; see cbinner.pxi. Built with profiling hooks; see wavefront.
+"""
+
+from wavefront.ctimebuf_prof cimport TimeUtil
+from wavefront.ctimebuf_prof import bins_to_array
+
+include "cbinner.pxi"
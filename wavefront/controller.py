@@ -8,34 +8,39 @@ release the GIL when entering Antelope C functions. E.g.
 
     export ANTELOPE_PYTHON_GILRELEASE=1
 
+Orbs may read from other packet sources, e.g. a replay.ReplaySource, which
+need neither Antelope nor the environment variable; see source.
 """
 
-class GilReleaseNotSetError(Exception): pass
-
 import os
-
-if 'ANTELOPE_PYTHON_GILRELEASE' not in os.environ:
-    raise GilReleaseNotSetError("ANTELOPE_PYTHON_GILRELEASE not in environment")
-
+import re
 
 import atexit
+from functools import partial
+from time import time
 
-from gevent import Greenlet, sleep, spawn
-from gevent.threadpool import ThreadPool, wrap_errors
-
-from antelope.brttpkt import OrbreapThr, Timeout, NoData
-from antelope.Pkt import Packet
+from gevent import Greenlet, sleep, spawn, get_hub
 
 import logging
 
 from datetime import datetime
 
-from wavefront.cbinner import Binner, Bin
-from wavefront.ctimebuf import TimeBuffer
+import numpy as np
+
+from wavefront.cbinner import Binner, Bin, DerivedBinner
+from wavefront.ctimebuf import BinBuffer, bins_to_array
+from wavefront import snapshot
+from wavefront.shmbuf import SharedBinStore
+from wavefront.shard import ShardPool
+from wavefront.reap import BatchReaper
+from wavefront.cache import channel_srcname
+from wavefront.monitor import MonitorIndex
+from wavefront.source import OrbSource
+from wavefront.metrics import Registry, LATENCY_BUCKETS, serve
+from wavefront.profiling import Profiler
 
 log = logging.getLogger(__name__)
 
-from collections import defaultdict
 
 
 class BinController(object):
@@ -54,19 +59,134 @@ class BinController(object):
     # I guess it will be memcache based.
     # Probably need a different bin controller class for that
 
-    def __init__(self):
-        self.binners = defaultdict(set)
+    def __init__(self, timebuf_class=BinBuffer, encoder_factory=None,
+                 metrics=None):
+        """If metrics, a metrics.Registry, is given, binner update times,
+        bins published, subscriber overflows and when each srcname was last
+        seen are recorded there."""
+        # srcname -> set of binners; also caches pattern matching results,
+        # including srcnames which matched nothing
+        self.binners = dict()
+        # (compiled srcname regex, ((twin, tbin), ...)); one (twin, tbin) per
+        # pyramid level, finest first
+        self.patterns = []
+        self.timebuf_class = timebuf_class
+        # e.g. wire.FrameEncoder; called with (srcname, tbin)
+        self.encoder_factory = encoder_factory
+        self.monitors = MonitorIndex()
+        # srcname -> wall clock time of its last packet
+        self.last_seen = dict()
+        self.metrics = metrics
+        # binner -> update time histogram
+        self._update_times = dict()
+        if metrics is not None:
+            metrics.add_collector(self._collect_metrics)
 
     def add_binner(self, srcname, twin, tbin):
-        """Add a new bin matching srcname, with size twin and tbin"""
+        """Add binners of size twin and tbin for srcnames matching srcname.
+
+        srcname is an Antelope style regex which must match the whole
+        srcname, e.g. 'TA_.*_BH[ZNE]'. Binners are created when a matching
+        srcname is first seen; a plain srcname gets its binner right away.
+        """
         # is binsize given in samples or seconds?
-        # print 'add_binner', srcname, twin, tbin
-        timebuf = TimeBuffer(int(twin / tbin), 0, tbin)
-        self.binners[srcname].add(Binner(srcname, twin, tbin, timebuf))
-        # print self.binners[srcname]
+        self._add_pattern(srcname, ((twin, tbin),))
+
+    def add_pyramid(self, srcname, twin, tbins):
+        """Add a pyramid of binners for srcnames matching srcname.
+
+        Only the finest level bins raw samples; each coarser level is a
+        DerivedBinner built from the bins of the level below, so raw samples
+        are touched once however many zoom levels there are. Each tbin must
+        be a multiple of the one below it. twin is the window of every
+        level, or a sequence of windows, one per tbin; every level must keep
+        at least one bin of the level above.
+        """
+        try:
+            twins = list(twin)
+        except TypeError:
+            twins = [twin] * len(tbins)
+        levels = tuple(sorted(zip(twins, tbins), key=lambda level: level[1]))
+        for (twin, tbin), (_, coarse) in zip(levels, levels[1:]):
+            ratio = coarse / tbin
+            if abs(ratio - round(ratio)) > 1e-9 or ratio < 2 or twin < coarse:
+                raise ValueError("Bad pyramid levels %r" % (levels,))
+        self._add_pattern(srcname, levels)
+
+    def _add_pattern(self, srcname, levels):
+        regex = re.compile('(?:%s)\\Z' % srcname)
+        self.patterns.append((regex, levels))
+        for name, binners in self.binners.iteritems():
+            if regex.match(name):
+                self._add(binners, name, levels)
+        if srcname == re.escape(srcname) and srcname not in self.binners:
+            self._match(srcname)
+
+    def _add(self, binners, srcname, levels):
+        twin, tbin = levels[0]
+        for source in binners:
+            if (source.twin, source.tbin) == (twin, tbin):
+                break
+        else:
+            source = Binner(srcname, twin, tbin,
+                            self._timebuf(srcname, twin, tbin),
+                            self._encoder(srcname, tbin))
+            self._attach(source)
+            binners.add(source)
+        for twin, tbin in levels[1:]:
+            for child in source.children:
+                if (child.twin, child.tbin) == (twin, tbin):
+                    source = child
+                    break
+            else:
+                source = DerivedBinner(source, twin, tbin,
+                                       self._timebuf(srcname, twin, tbin),
+                                       self._encoder(srcname, tbin))
+                self._attach(source)
+
+    def _attach(self, binner):
+        """Subscribe the monitor index to binner if any monitor wants it."""
+        if self.monitors.wants(binner.srcname, binner.tbin):
+            binner.hub.subscribe(self.monitors)
+
+    def _timebuf(self, srcname, twin, tbin):
+        return self.timebuf_class(int(twin / tbin), 0, tbin)
+
+    def _encoder(self, srcname, tbin):
+        if self.encoder_factory is None:
+            return None
+        return self.encoder_factory(srcname, tbin)
+
+    def _match(self, srcname):
+        """Create and cache the binners for a srcname seen for the first
+        time."""
+        binners = self.binners[srcname] = set()
+        for regex, levels in self.patterns:
+            if regex.match(srcname):
+                self._add(binners, srcname, levels)
+        if binners:
+            log.info("New srcname %s; %d binners" % (srcname, len(binners)))
+        return binners
+
+    def get_binners(self, srcname):
+        """Return the set of binners for srcname, creating them if srcname
+        is new."""
+        try:
+            return self.binners[srcname]
+        except KeyError:
+            return self._match(srcname)
+
+    def iter_binners(self, srcname):
+        """Iterate over all binners of srcname, including derived pyramid
+        levels."""
+        pending = list(self.binners.get(srcname, ()))
+        while pending:
+            binner = pending.pop()
+            pending.extend(binner.children)
+            yield binner
 
     def get_binner(self, srcname, twin, tbin):
-        for binner in self.binners[srcname]:
+        for binner in self.iter_binners(srcname):
             if (binner.twin, binner.tbin) == (twin, tbin):
                 return binner
         return None
@@ -75,11 +195,75 @@ class BinController(object):
     # def rm_binner
     # must be possible to remove stale ones later when we do regex matching
 
-    # TODO
-    # def query(self, srcname, binsize, tstart, tend):
-    #    timebuf = self.binners[srcname].timebuf
-    # Need this to support pre-filling the wf display, not just for unified
-    # query API.
+    def find_binner(self, srcname, tbin):
+        """Return the binner for srcname with bin size tbin and the longest
+        window, or None."""
+        found = None
+        for binner in self.iter_binners(srcname):
+            if binner.tbin == tbin and (found is None or binner.twin > found.twin):
+                found = binner
+        return found
+
+    def query(self, srcnames, tbin, tstart=None, tend=None):
+        """Return prebinned data for one or many srcnames.
+
+        Used to prefill the wf display. Returns a dict mapping each srcname
+        which has a binner of size tbin to a structured array of BIN_DTYPE
+        holding the contiguous window of bins from tstart up to tend, clipped
+        to what the buffer holds. Empty slots have nsamples == 0. Use
+        ``array.tostring()`` for a compact bytes payload.
+        """
+        if isinstance(srcnames, basestring):
+            srcnames = [srcnames]
+        result = {}
+        for srcname in srcnames:
+            binner = self.find_binner(srcname, tbin)
+            if binner is None:
+                continue
+            result[srcname] = bins_to_array(
+                    binner.store.get_range(tstart, tend))
+        return result
+
+    def monitor(self, monitor, history=False):
+        """Start routing bin updates to a monitor.Monitor; see
+        unmonitor.
+
+        With history, the monitor first gets the bins its window holds in
+        the buffers, one payload per srcname, as the monitor index would
+        encode them.
+        """
+        self.monitors.add(monitor)
+        for srcname in self.binners:
+            if not monitor.accepts(srcname):
+                continue
+            for binner in self.iter_binners(srcname):
+                if binner.tbin == monitor.tbin:
+                    binner.hub.subscribe(self.monitors)
+            if history:
+                lo, hi = monitor.window.bounds(self.monitors.clock())
+                bins = self.query(srcname, monitor.tbin, lo,
+                                  None if hi == np.inf else hi).get(srcname)
+                if bins is None:
+                    continue
+                bins = bins[(bins['nsamples'] > 0) &
+                            (bins['timestamp'] >= lo) & (bins['timestamp'] < hi)]
+                if len(bins):
+                    monitor.push(self.monitors.message(
+                            (srcname, monitor.tbin), bins))
+
+    def unmonitor(self, monitor):
+        """Stop routing bin updates to monitor. Binners no monitor wants
+        any more are unsubscribed from the index, so their hubs stop
+        building bin records for it."""
+        self.monitors.remove(monitor)
+        for srcname in self.binners:
+            if not monitor.accepts(srcname):
+                continue
+            if self.monitors.wants(srcname, monitor.tbin):
+                continue
+            for binner in self.iter_binners(srcname):
+                if binner.tbin == monitor.tbin:
+                    binner.hub.unsubscribe(self.monitors)
 
     def update(self, srcname, ts, samples, samprate):
         """Given some new data, dispatch it to the appropriate binners.
@@ -88,11 +272,94 @@ class BinController(object):
         """
 
         # send to all binners; let binners filter out any stale data
-        # todo: support dynamically creating new binners based on regex
-        # srcnames
-
-        for binner in self.binners[srcname]:
+        try:
+            binners = self.binners[srcname]
+        except KeyError:
+            binners = self._match(srcname)
+        if self.metrics is None:
+            for binner in binners:
+                binner.update(ts, samples, samprate)
+            return
+        for binner in binners:
+            start = time()
             binner.update(ts, samples, samprate)
+            try:
+                histogram = self._update_times[binner]
+            except KeyError:
+                histogram = self._update_times[binner] = \
+                        self.metrics.histogram(
+                                'wavefront_binner_update_seconds',
+                                "Time to bin a block, derived levels included",
+                                srcname=srcname, tbin=binner.tbin)
+            histogram.observe(time() - start)
+
+    def update_packet(self, packet):
+        """Dispatch every channel of an unstuffed Packet."""
+        now = time()
+        for channel in packet.channels:
+            srcname = channel_srcname(channel)
+            log.debug("srcname %s" % (srcname))
+            self.last_seen[srcname] = now
+            self.update(srcname, channel.time, channel.data, channel.samprate)
+
+    def _collect_metrics(self):
+        for srcname in self.binners:
+            for binner in self.iter_binners(srcname):
+                labels = dict(srcname=srcname, tbin=binner.tbin)
+                yield ('counter', 'wavefront_bins_published_total',
+                       "Bins published to subscribers", labels,
+                       binner.hub.nbins)
+                for subscriber, queued, overflows in binner.hub.stats():
+                    name = getattr(subscriber, 'name', None) or id(subscriber)
+                    labels = dict(srcname=srcname, tbin=binner.tbin,
+                                  subscriber=name)
+                    yield ('counter', 'wavefront_subscriber_overflows_total',
+                           "Subscriber buffer overflows", labels, overflows)
+                    yield ('gauge', 'wavefront_subscriber_queued',
+                           "Updates queued for a subscriber", labels, queued)
+        for monitor, queued, overflows in self.monitors.stats():
+            labels = dict(monitor=monitor.name or id(monitor))
+            yield ('counter', 'wavefront_monitor_overflows_total',
+                   "Monitor buffer overflows", labels, overflows)
+            yield ('gauge', 'wavefront_monitor_queued',
+                   "Updates queued for a monitor", labels, queued)
+        for srcname, seen in self.last_seen.iteritems():
+            yield ('gauge', 'wavefront_srcname_last_seen_seconds',
+                   "Wall clock time the last packet of a srcname was binned",
+                   dict(srcname=srcname), seen)
+
+
+class SharedBinController(BinController):
+    """BinController whose buffers live in a shmbuf.SharedBinStore, so other
+    processes can read them with a shmbuf.SharedBinReader.
+
+    Every update is bracketed by the seqlocks of the buffers it may touch,
+    including derived pyramid levels.
+    """
+
+    def __init__(self, path, nbytes, capacity=8192, encoder_factory=None,
+                 metrics=None):
+        super(SharedBinController, self).__init__(
+                encoder_factory=encoder_factory, metrics=metrics)
+        self.shared = SharedBinStore(path, nbytes, capacity)
+
+    def _timebuf(self, srcname, twin, tbin):
+        return self.shared.buffer(srcname, twin, tbin)
+
+    def update(self, srcname, ts, samples, samprate):
+        try:
+            self.binners[srcname]
+        except KeyError:
+            self._match(srcname)
+        stores = [binner.store for binner in self.iter_binners(srcname)]
+        for store in stores:
+            store.begin()
+        try:
+            super(SharedBinController, self).update(srcname, ts, samples,
+                                                    samprate)
+        finally:
+            for store in stores:
+                store.commit()
 
 
 class Orb(Greenlet):
@@ -109,18 +376,71 @@ class Orb(Greenlet):
     That seems logical to have here.
     """
 
-    def __init__(self, orbname, select=None, reject=None, tafter=None):
+    def __init__(self, orbname, select=None, reject=None, tafter=None,
+                 snapshot_path=None, snapshot_interval=600, shm_path=None,
+                 shm_size=1 << 30, reap_batchsize=64, reap_latency=0.1,
+                 packet_cache=None, source=None, metrics=None,
+                 metrics_address=None):
+        """If snapshot_path is given the prebinned buffers are saved there
+        every snapshot_interval seconds, and restored from there on startup;
+        reaping then resumes after the last packet in the snapshot.
+
+        If shm_path is given the buffers are kept in a shared memory-mapped
+        file of shm_size bytes there, e.g. under /dev/shm, for server
+        processes to read with shmbuf.SharedBinReader.
+
+        Packets are reaped up to reap_batchsize at a time, waiting at most
+        about reap_latency seconds to fill a batch; see reap.BatchReaper.
+
+        Reaped packets are added to packet_cache, a cache.PacketCache, if
+        given; it may be shared with other orbs and with queries.
+
+        Packets come from source, by default a source.OrbSource reading
+        orbname with select and reject; see source for other packet
+        sources.
+
+        Metrics go to metrics, a metrics.Registry, by default one of the
+        orb's own; if metrics_address is given they're served there as text,
+        see metrics.serve."""
         super(Orb, self).__init__()
-        self.binners = BinController()
+        if metrics is None:
+            metrics = Registry()
+        self.metrics = metrics
+        self.metrics_address = metrics_address
+        if shm_path is None:
+            self.binners = BinController(metrics=metrics)
+        else:
+            self.binners = SharedBinController(shm_path, shm_size,
+                                               metrics=metrics)
         self.orbname = orbname
         self.select = select
         self.reject = reject
+        if source is None:
+            source = OrbSource(orbname, select, reject)
+        self.source = source
         self.tafter = tafter
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.reap_batchsize = reap_batchsize
+        self.reap_latency = reap_latency
+        self.packet_cache = packet_cache
         self.npkts = 0
         self.last_pktid = None
         self.last_orbtime = None
         self.timeon = None
         self.timeoff = None
+        self._pkts = metrics.counter('wavefront_packets_total',
+                                     "Packets reaped", orb=orbname)
+        self._reap_waits = metrics.histogram(
+                'wavefront_reap_wait_seconds', "Time waiting for a batch",
+                orb=orbname)
+        self._unstuffs = metrics.histogram(
+                'wavefront_unstuff_seconds', "Time to unstuff a packet",
+                orb=orbname)
+        self._latencies = metrics.histogram(
+                'wavefront_orb_latency_seconds',
+                "Wall clock minus packet time, when processed",
+                LATENCY_BUCKETS, orb=orbname)
 
     def _janitor(self, src):
         log.debug("Janitor, cleanup aisle 12")
@@ -135,73 +455,96 @@ class Orb(Greenlet):
         self.last_pktid = pktid
         self.last_orbtime = orbtimestamp
         log.debug("Processing packet %s %s %s" % (pktid, srcname, orbtimestamp))
-        packet = Packet(srcname, orbtimestamp, raw_packet)
-
-        for channel in packet.channels:
-            # print channel
-            parts = [channel.net, channel.sta, channel.chan]
-            if channel.loc is not '':
-                    parts.append(channel.loc)
-            srcname = '_'.join(parts)
-            log.debug("srcname %s" % (srcname))
-            self.binners.update(srcname, channel.time,
-                                          channel.data, channel.samprate)
+        self._pkts.inc()
+        start = time()
+        self._latencies.observe(start - orbtimestamp)
+        packet = self.source.unstuff(srcname, orbtimestamp, raw_packet)
+        self._unstuffs.observe(time() - start)
+        if self.packet_cache is not None:
+            self.packet_cache.add_packet(srcname, raw_packet, packet)
+        self.binners.update_packet(packet)
         sleep(0)
 
-    def _status_printer(self):
+    def _restore(self):
+        """Load the snapshot, if any, and move tafter up to its last packet."""
+        if self.snapshot_path is None or not os.path.exists(self.snapshot_path):
+            return
         try:
+            pktid, orbtime = snapshot.load(self.binners, self.snapshot_path)
+        except Exception:
+            log.error("Can't restore snapshot %s" % self.snapshot_path,
+                      exc_info=True)
+            return
+        log.info("Restored snapshot at pktid %s orbtime %s" % (pktid, orbtime))
+        self.last_pktid, self.last_orbtime = pktid, orbtime
+        if orbtime is not None and (self.tafter is None or orbtime > self.tafter):
+            self.tafter = orbtime
+
+    def _snapshotter(self):
+        while True:
+            sleep(self.snapshot_interval)
+            try:
+                # buffers are copied on the hub, then written in a thread
+                n = snapshot.save(self.binners, self.snapshot_path,
+                                  self.last_pktid, self.last_orbtime,
+                                  get_hub().threadpool)
+            except Exception:
+                # e.g. a full disk; try again next interval
+                log.error("Can't save snapshot %s" % self.snapshot_path,
+                          exc_info=True)
+                continue
+            log.info("Saved %d buffers to %s at pktid %s" % (
+                    n, self.snapshot_path, self.last_pktid))
+
+    def _status_printer(self, interval=60):
+        """Log a summary of the metrics every interval seconds; see
+        _get_stats and metrics_address for the details."""
+        try:
+            then, npkts = time(), self._pkts.value
             while True:
-                now = datetime.utcnow()
-                log.info("%s pkts in %s at %s pkts/s" % (
-                        self.npkts,
-                        now - self.timeon,
-                        float(self.npkts) / ((now - self.timeon).total_seconds())
-                ))
-                log.info("on pktid %s orbtime %s" % (self.last_pktid,
-                                                        self.last_orbtime))
-                sleep(5)
+                sleep(interval)
+                now = time()
+                log.info("%s pkts at %.1f pkts/s; latency p50 %s s, reap wait "
+                         "p50 %s s, unstuff p99 %s s; on pktid %s orbtime %s" % (
+                        self._pkts.value,
+                        (self._pkts.value - npkts) / (now - then),
+                        self._latencies.quantile(0.5),
+                        self._reap_waits.quantile(0.5),
+                        self._unstuffs.quantile(0.99),
+                        self.last_pktid, self.last_orbtime))
+                then, npkts = now, self._pkts.value
         except Exception:
             log.error("_status_printer failure", exc_info=True)
 
     def _run(self):
         """Main loop; reap and process pkts"""
         try:
-            args = self.orbname, self.select, self.reject
-            print repr(self.orbname)
-            print repr(args)
-            with OrbreapThr(*args, timeout=1, queuesize=8, after=self.tafter) as orbreapthr:
-                log.info("Connected to ORB %s %s %s" % (self.orbname, self.select,
-                                                        self.reject))
+            self._restore()
+            if self.snapshot_path is not None:
+                spawn(self._snapshotter).link_exception(self._janitor)
+            if self.metrics_address is not None:
+                server = serve(self.metrics, self.metrics_address)
+                self.link(lambda orb: server.stop())
+            with self.source.open(self.reap_latency,
+                                  self.tafter) as orbreapthr:
+                log.info("Connected to %r" % self.source)
                 self.timeoff = self.timeon = datetime.utcnow()
                 spawn(self._status_printer).link_exception(self._janitor)
-                threadpool = ThreadPool(maxsize=1)
-                try:
+                with BatchReaper(orbreapthr, self.reap_batchsize,
+                                 self.reap_latency) as reaper:
                     while True:
-                        try:
-                            success, value = threadpool.spawn(
-                                    wrap_errors, (Exception,), orbreapthr.get, [], {}).get()
-                            timestamp = datetime.utcnow()
-                            if not success:
-                                raise value
-                        except (Timeout, NoData), e:
-                            log.debug("orbreapthr.get exception %r" % type(e))
-                            pass
-                        else:
-                            if value is None:
-                                raise Exception('Nothing to publish')
+                        start = time()
+                        batch = reaper.get()
+                        self._reap_waits.observe(time() - start)
+                        timestamp = datetime.utcnow()
+                        for value in batch:
                             self._process(value, timestamp)
-                finally:
-                    # This blocks until all threads in the pool return. That's
-                    # critical; if the orbreapthr dies before the get thread,
-                    # segfaults ensue.
-                    threadpool.kill()
         except Exception, e:
             log.error("OrbPktSrc terminating due to exception", exc_info=True)
             raise
         finally:
             self.timeoff = datetime.utcnow()
-            log.info("Disconnected from ORB %s %s %s" % (self.orbname, self.select,
-                                                         self.reject))
+            log.info("Disconnected from %r" % self.source)
             try:
                 log.info("%s pkts in %s at %s pkts/s" % (
                     self.npkts,
@@ -212,17 +555,127 @@ class Orb(Greenlet):
                 log.warning("Error printing stats")
 
     def _get_stats(self):
-        return (
-            )
+        """Return the orb's state and metrics.Registry.stats() of its
+        metrics."""
+        return dict(orbname=self.orbname, npkts=self.npkts,
+                    last_pktid=self.last_pktid,
+                    last_orbtime=self.last_orbtime, timeon=self.timeon,
+                    metrics=self.metrics.stats())
+
+
+def process_packet(unstuff, controller, value):
+    """Unstuff a reaped (pktid, srcname, orbtime, raw) packet and bin it;
+    runs in shard workers."""
+    pktid, srcname, orbtimestamp, raw_packet = value
+    controller.update_packet(unstuff(srcname, orbtimestamp, raw_packet))
+
+
+def _shard_controller(binners, shm_path, shm_size, index):
+    if shm_path is None:
+        controller = BinController()
+    else:
+        controller = SharedBinController('%s.%d' % (shm_path, index), shm_size)
+    for args in binners:
+        controller.add_binner(*args)
+    return controller
+
+
+class ShardedOrb(Orb):
+    """Orb which only reaps; packets are forwarded raw to nshards worker
+    processes, partitioned by srcname, which unstuff and bin them. See
+    shard.ShardPool.
+
+    Each worker owns its shard of the buffers. To serve them, give shm_path;
+    shard n then keeps its buffers in a shared file at shm_path.n.
+    Snapshots and the packet cache aren't supported.
+    """
+
+    def __init__(self, orbname, nshards, select=None, reject=None,
+                 tafter=None, shm_path=None, shm_size=1 << 30, queuesize=1024,
+                 reap_batchsize=64, reap_latency=0.1, source=None):
+        super(ShardedOrb, self).__init__(orbname, select, reject, tafter,
+                                         reap_batchsize=reap_batchsize,
+                                         reap_latency=reap_latency,
+                                         source=source)
+        self.binners = None
+        self.nshards = nshards
+        self.shm_path = shm_path
+        self.shm_size = shm_size
+        self.queuesize = queuesize
+        # (srcname, twin, tbin) for each add_binner call, replayed per shard
+        self.binner_args = []
+        self.pool = None
+
+    def add_binner(self, srcname, twin, tbin):
+        if self.pool is not None:
+            raise RuntimeError("Can't add binners after shards started")
+        self.binner_args.append((srcname, twin, tbin))
+
+    def _process(self, value, timestamp):
+        self.npkts += 1
+        pktid, srcname, orbtimestamp, raw_packet = value
+        self.last_pktid = pktid
+        self.last_orbtime = orbtimestamp
+        self._pkts.inc()
+        self._latencies.observe(time() - orbtimestamp)
+        self.pool.dispatch(srcname, value)
+        sleep(0)
+
+    def _shard_status_printer(self):
+        while True:
+            dead = self.pool.dead()
+            if dead:
+                raise Exception("Shard workers died: %s" % ', '.join(dead))
+            for stats in self.pool.stats():
+                log.info("shard %(shard)d: %(pkts)d pkts at %(pkts_per_sec).1f "
+                         "pkts/s, %(queued)s queued" % stats)
+            sleep(5)
+
+    def _run(self):
+        self.pool = ShardPool(self.nshards,
+                              partial(_shard_controller, self.binner_args,
+                                      self.shm_path, self.shm_size),
+                              partial(process_packet, self.source.unstuff),
+                              self.queuesize)
+        self.pool.start()
+        try:
+            spawn(self._shard_status_printer).link_exception(self._janitor)
+            super(ShardedOrb, self)._run()
+        finally:
+            self.pool.stop()
+
+    def _get_stats(self):
+        """Return Orb._get_stats(), plus the shard stats summed across
+        shards: pkts binned, binned_per_sec and queued; and per shard, in
+        shards. See shard.ShardPool.stats."""
+        stats = super(ShardedOrb, self)._get_stats()
+        shards = [] if self.pool is None else self.pool.stats()
+        queued = [shard['queued'] for shard in shards
+                  if shard['queued'] is not None]
+        stats.update(
+                shards=shards,
+                binned=sum(shard['pkts'] for shard in shards),
+                binned_per_sec=sum(shard['pkts_per_sec'] for shard in shards),
+                queued=sum(queued) if queued else None)
+        return stats
 
 
 class App(Greenlet):
     """Owns Orbs, OrbControllers, Binners, and BinControllers.
     Handles queries from clients."""
 
-    def __init__(self):
+    def __init__(self, profile_signal=None, profile_dir='.'):
+        """Given profile_signal, e.g. signal.SIGUSR2, the signal starts a
+        profiling session; see profiling."""
         super(App, self).__init__()
         self.orbs = set()
+        self.profile_signal = profile_signal
+        self.profiler = Profiler(profile_dir)
+
+    def profile(self, seconds=30.0, path=None):
+        """Profile the app for seconds; return the profiling.Session, which
+        returns the path of the profile once dumped."""
+        return self.profiler.start(seconds, path)
 
     def add_orb(self, *args, **kwargs):
         orb = Orb(*args, **kwargs)
@@ -235,9 +688,12 @@ class App(Greenlet):
         self.kill(src.exception)
 
     def _run(self):
+        if self.profile_signal is not None:
+            self.profiler.install(self.profile_signal)
         try:
             [orb.start() for orb in self.orbs]
             while True: sleep(10000)
         finally:
+            self.profiler.uninstall()
             [orb.kill() for orb in self.orbs]
 
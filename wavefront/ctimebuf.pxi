@@ -0,0 +1,564 @@
+# Included by ctimebuf.pyx and ctimebuf_prof.pyx.
+
+import logging
+
+log = logging.getLogger(__name__)
+
+import cython
+
+import numpy as np
+
+
+cdef class MagicList:
+    cdef list _list
+
+    def __init__(self, iterable=None):
+        self._list = list()
+        if iterable is not None:
+            self._list = list(iterable)
+
+    @cython.cdivision(True)
+    def __getitem__(self, int n):
+        return self._list[n % len(self)]
+
+    @cython.cdivision(True)
+    def __setitem__(self, int n, v):
+        self._list[n % len(self)] = v
+
+    def __len__(self):
+        return len(self._list)
+
+
+@cython.cdivision(True)
+cdef list _segments(int start, int stop, int size):
+    """Slot ranges of a circular buffer of size covering numbers start:stop;
+    at most two because of wraparound, the newest size numbers if there are
+    more."""
+    cdef int a, b
+    if stop <= start:
+        return []
+    if start < stop - size:
+        start = stop - size
+    a = start % size
+    b = stop % size
+    if a < 0:
+        a += size
+    if b < 0:
+        b += size
+    if a < b:
+        return [(a, b)]
+    if b == 0:
+        return [(a, size)]
+    return [(a, size), (0, b)]
+
+
+cdef class TimeUtil:
+#    cdef public double element_time
+
+    @cython.cdivision(True)
+    cpdef int index(self, double timestamp):
+        return <int>(timestamp / self.element_time)
+
+    cpdef double timestamp(self, int index):
+        return index * self.element_time
+
+    @cython.cdivision(True)
+    cpdef double floor(self, double timestamp):
+        return <int>(timestamp / self.element_time) * self.element_time
+
+
+cdef class TimeBuffer(TimeUtil):
+    """Associative circular time series buffer of timestamp/value pairs.
+
+    From tail to head timestamps are contiguous and monotonically increasing.
+
+    head_num and head_time are plus one's. I.e. head_num equals the index of
+    the newest element in the buffer plus 1. head_time equals the timestamp of
+    the newest element in the array plus element_time.
+
+    Ranges of values are read and written in bulk with get_range and
+    put_range.
+    """
+#    cdef public double element_time
+    cdef public int head_num
+    cdef public object item_factory
+    cdef public int size
+    cdef public object _buffer
+ 
+    filler = None
+
+    def __init__(self, size, head_time, element_time):
+        assert element_time != 0.0
+        self.element_time = element_time
+        self.head_num = int(head_time / element_time)
+        self.size = size
+        self._buffer = MagicList([self.filler,] * size)
+
+    cpdef int tail_num(self):
+        return self.head_num - self.size
+
+    cpdef double tail_time(self):
+        return self.tail_num() * self.element_time
+
+    cpdef double head_time(self):
+        return self.head_num * self.element_time
+
+    def __repr__(self):
+        return "<TimeBuffer %s: size=%s, head=%s>" % (id(self), self.size, self.head_num)
+
+    def __str__(self):
+        return str(dict(self.iteritems()))
+
+    cpdef append(self, item):
+        """Append exactly one item to the buffer. Item timestamp must be
+        equal to head_time.
+        """
+        self._buffer[self.head_num] = item
+        self.head_num += 1
+
+    cpdef advance(self, int num):
+        """Move the head so that slot number num is the newest, filling
+        every slot skipped over in bulk."""
+        cdef list buffer = (<MagicList>self._buffer)._list
+        if num < self.head_num:
+            return
+        for start, stop in _segments(self.head_num, num + 1, self.size):
+            buffer[start:stop] = [self.filler] * (stop - start)
+        self.head_num = num + 1
+
+    cpdef update(self, double k, v):
+        """Update
+
+        Values are put into the buffer. If a value is the newest, the head
+        advances, filling slots across any gap. Values older than the tail
+        are dropped.
+        """
+        cdef int num = self.index(k)
+        if num >= self.head_num:
+            self.advance(num)
+        elif num < self.tail_num():
+            return
+        self._buffer[num] = v
+
+    def __getitem__(self, double n):
+        if not self.has_key(n):
+            raise IndexError
+        return self._buffer[self.index(n)]
+
+    def __setitem__(self, double n, v):
+        if not self.has_key(n):
+            raise IndexError
+        self._buffer[self.index(n)] = v
+        
+    cpdef get(self, double key, default=None):
+        try:
+            return self[key]
+        except IndexError:
+            return default
+
+    cpdef has_key(self, double timestamp):
+        """True if timestamp is within the buffer boundaries."""
+        return (True if timestamp >= self.tail_time() and
+                    timestamp < self.head_time() else False)
+
+    def __contains__(self, double timestamp):
+        """True if timestamp is within the buffer boundaries."""
+        return (True if timestamp >= self.tail_time() and
+                    timestamp < self.head_time() else False)
+
+
+    def _bounds(self, start, stop):
+        start = self.tail_num() if start is None else self.index(start)
+        stop = self.head_num if stop is None else self.index(stop)
+        return max(start, self.tail_num()), min(stop, self.head_num)
+
+    def get_range(self, start=None, stop=None):
+        """Return the values from timestamp start up to stop as a list,
+        clipped to the buffer boundaries; a copy of at most two segments of
+        the buffer."""
+        cdef list buffer = (<MagicList>self._buffer)._list
+        result = []
+        start, stop = self._bounds(start, stop)
+        for a, b in _segments(start, stop, self.size):
+            result.extend(buffer[a:b])
+        return result
+
+    def put_range(self, double start, values):
+        """Put values into consecutive slots from timestamp start. Like
+        update, the head advances past the last of them and values older
+        than the tail are dropped."""
+        cdef list buffer = (<MagicList>self._buffer)._list
+        cdef int first = self.index(start)
+        cdef int stop = first + len(values)
+        cdef int n
+        if stop <= first:
+            return
+        self.advance(stop - 1)
+        n = max(self.tail_num() - first, 0)
+        for a, b in _segments(first + n, stop, self.size):
+            buffer[a:b] = values[n:n + b - a]
+            n += b - a
+
+    def iteritems(self, start=None, stop=None):
+        cdef int n
+        start = self.tail_num() if start is None else self.index(start)
+        stop = self.head_num if stop is None else self.index(stop)
+        for n in xrange(start, stop):
+            try:
+                k,v = self.timestamp(n), self._buffer[n]
+            except IndexError:
+                continue
+            yield k,v
+
+    def itervalues(self, start=None, stop=None):
+        cdef int n
+        start = self.tail_num() if start is None else self.index(start)
+        stop = self.head_num if stop is None else self.index(stop)
+        for n in xrange(start, stop):
+            try:
+                v = self._buffer[n]
+                yield v
+            except IndexError:
+                pass
+
+    def __iter__(self):
+        return (n * self.element_time for n in xrange(self.tail_num(), self.head_num))
+
+
+
+BIN_DTYPE = np.dtype([
+    ('timestamp', np.float64),
+    ('max', np.float64),
+    ('min', np.float64),
+    ('mean', np.float64),
+    ('nsamples', np.int32),
+])
+
+# BinBuffer column attributes and types
+COLUMNS = (
+    ('timestamps', np.float64),
+    ('maxes', np.float64),
+    ('mins', np.float64),
+    ('means', np.float64),
+    ('nsamples', np.int32),
+    ('sizes', np.int32),
+)
+
+
+def bins_to_array(bins):
+    """Convert an iterable of Bin-like objects to a structured array of
+    BIN_DTYPE. None entries become empty bins. Arrays of BIN_DTYPE are
+    returned as is."""
+    if isinstance(bins, np.ndarray) and bins.dtype == BIN_DTYPE:
+        return bins
+    bins = list(bins)
+    result = np.zeros(len(bins), BIN_DTYPE)
+    for field in 'timestamp', 'max', 'min':
+        result[field] = np.nan
+    for n, bin in enumerate(bins):
+        if bin is not None:
+            result[n] = (bin.timestamp, bin.max, bin.min, bin.mean,
+                         bin.nsamples)
+    return result
+
+
+cdef class BinBuffer(TimeUtil):
+    """Columnar circular buffer of bins.
+
+    Addressed exactly like TimeBuffer, but instead of holding one Bin object
+    per slot the bin fields live in preallocated contiguous arrays, one per
+    field. A slot costs 40 bytes and there are no per-bin heap objects.
+
+    Reads return BinView objects, which behave like cbinner.Bin but write
+    straight through to the arrays, or structured arrays of BIN_DTYPE from
+    get_range. Empty slots have a NaN timestamp and read as None.
+
+    update() copies the fields of any Bin-like object into the buffer; the
+    stored value is the view returned by get(), not the object passed in.
+    """
+    cdef public int head_num
+    cdef public int size
+    cdef public object timestamps
+    cdef public object maxes
+    cdef public object mins
+    cdef public object means
+    cdef public object nsamples
+    cdef public object sizes
+    cdef double[:] _timestamps
+    cdef double[:] _maxes
+    cdef double[:] _mins
+    cdef double[:] _means
+    cdef int[:] _nsamples
+    cdef int[:] _sizes
+
+    filler = None
+
+    def __init__(self, size, head_time, element_time):
+        assert element_time != 0.0
+        self.element_time = element_time
+        self.size = size
+        self.bind(int(head_time / element_time),
+                  *[np.empty(size, dtype) for name, dtype in COLUMNS])
+        self._clear(0, size)
+
+    def bind(self, head_num, timestamps, maxes, mins, means, nsamples, sizes):
+        """Use the given arrays, in COLUMNS order, as column storage, e.g.
+        to restore a snapshot. Arrays must have length size."""
+        for column in timestamps, maxes, mins, means, nsamples, sizes:
+            if len(column) != self.size:
+                raise ValueError("Column length %d != size %d" %
+                                 (len(column), self.size))
+        self.head_num = head_num
+        self.timestamps = self._timestamps = timestamps
+        self.maxes = self._maxes = maxes
+        self.mins = self._mins = mins
+        self.means = self._means = means
+        self.nsamples = self._nsamples = nsamples
+        self.sizes = self._sizes = sizes
+
+    cdef _clear(self, int start, int stop):
+        """Empty slots start:stop (slot indexes, not numbers)."""
+        self.timestamps[start:stop] = np.nan
+        self.maxes[start:stop] = np.nan
+        self.mins[start:stop] = np.nan
+        self.means[start:stop] = 0
+        self.nsamples[start:stop] = 0
+        self.sizes[start:stop] = 0
+
+    @cython.cdivision(True)
+    cdef int _slot(self, int num):
+        cdef int slot = num % self.size
+        return slot + self.size if slot < 0 else slot
+
+    cpdef int tail_num(self):
+        return self.head_num - self.size
+
+    cpdef double tail_time(self):
+        return self.tail_num() * self.element_time
+
+    cpdef double head_time(self):
+        return self.head_num * self.element_time
+
+    def __repr__(self):
+        return "<BinBuffer %s: size=%s, head=%s>" % (id(self), self.size, self.head_num)
+
+    def __str__(self):
+        return str(dict(self.iteritems()))
+
+    def __len__(self):
+        return self.size
+
+    cpdef advance(self, int num):
+        """Move the head so that slot number num is the newest, emptying
+        every slot skipped over in bulk."""
+        if num < self.head_num:
+            return
+        for start, stop in _segments(self.head_num, num + 1, self.size):
+            self._clear(start, stop)
+        self.head_num = num + 1
+
+    cpdef append(self, item):
+        """Append exactly one item to the buffer. Item timestamp must be
+        equal to head_time.
+        """
+        self.advance(self.head_num)
+        self._put(self.head_num - 1, item)
+
+    cdef _put(self, int num, item):
+        cdef int slot = self._slot(num)
+        if item is None:
+            self._clear(slot, slot + 1)
+            return
+        self._timestamps[slot] = item.timestamp
+        self._maxes[slot] = item.max
+        self._mins[slot] = item.min
+        self._means[slot] = item.mean
+        self._nsamples[slot] = item.nsamples
+        self._sizes[slot] = item.size
+
+    cpdef update(self, double k, v):
+        """Update
+
+        Copy the fields of bin v into the slot for timestamp k. If it's the
+        newest, the head advances, emptying slots across any gap. Values older
+        than the tail are dropped.
+        """
+        cdef int num = self.index(k)
+        if num >= self.head_num:
+            self.advance(num)
+        elif num < self.tail_num():
+            return
+        self._put(num, v)
+
+    def __getitem__(self, double n):
+        if not self.has_key(n):
+            raise IndexError
+        return self._view(self.index(n))
+
+    def __setitem__(self, double n, v):
+        if not self.has_key(n):
+            raise IndexError
+        self._put(self.index(n), v)
+
+    cdef _view(self, int num):
+        cdef int slot = self._slot(num)
+        if self._timestamps[slot] != self._timestamps[slot]:
+            # NaN timestamp; empty slot
+            return self.filler
+        return BinView(self, slot)
+
+    cpdef get(self, double key, default=None):
+        if not self.has_key(key):
+            return default
+        return self._view(self.index(key))
+
+    cpdef has_key(self, double timestamp):
+        """True if timestamp is within the buffer boundaries."""
+        return (True if timestamp >= self.tail_time() and
+                    timestamp < self.head_time() else False)
+
+    def __contains__(self, double timestamp):
+        """True if timestamp is within the buffer boundaries."""
+        return self.has_key(timestamp)
+
+    def _bounds(self, start, stop):
+        start = self.tail_num() if start is None else self.index(start)
+        stop = self.head_num if stop is None else self.index(stop)
+        return max(start, self.tail_num()), min(stop, self.head_num)
+
+    def get_range(self, start=None, stop=None):
+        """Return the slots from timestamp start up to stop as a structured
+        array of BIN_DTYPE, clipped to the buffer boundaries. Empty slots have
+        a NaN timestamp and nsamples == 0."""
+        start, stop = self._bounds(start, stop)
+        result = np.empty(max(stop - start, 0), BIN_DTYPE)
+        n = 0
+        for a, b in _segments(start, stop, self.size):
+            out = result[n:n + b - a]
+            out['timestamp'] = self.timestamps[a:b]
+            out['max'] = self.maxes[a:b]
+            out['min'] = self.mins[a:b]
+            out['mean'] = self.means[a:b]
+            out['nsamples'] = self.nsamples[a:b]
+            n += b - a
+        return result
+
+    def put_range(self, double start, values, sizes):
+        """Put bins into consecutive slots from timestamp start. values is a
+        structured array of BIN_DTYPE, or Bin-like objects and None; see
+        bins_to_array. BIN_DTYPE has no bin size, so sizes gives it, for
+        all bins or one per bin; binning may continue into the slots, so
+        bins with samples need a positive size. Bins with a NaN timestamp
+        empty their slots. Like update, the head advances past the last bin
+        and bins older than the tail are dropped."""
+        cdef int first
+        cdef int stop
+        cdef int n
+        values = bins_to_array(values)
+        first = self.index(start)
+        stop = first + len(values)
+        if stop <= first:
+            return
+        empty = np.isnan(values['timestamp'])
+        sizes = np.where(empty, 0, np.broadcast_to(sizes, len(values)))
+        if np.any(~empty & (values['nsamples'] > 0) & (sizes <= 0)):
+            raise ValueError("Bin size must be positive for bins with samples")
+        self.advance(stop - 1)
+        n = max(self.tail_num() - first, 0)
+        for a, b in _segments(first + n, stop, self.size):
+            bins = values[n:n + b - a]
+            self.timestamps[a:b] = bins['timestamp']
+            self.maxes[a:b] = bins['max']
+            self.mins[a:b] = bins['min']
+            self.means[a:b] = bins['mean']
+            self.nsamples[a:b] = bins['nsamples']
+            self.sizes[a:b] = sizes[n:n + b - a]
+            n += b - a
+
+    def iteritems(self, start=None, stop=None):
+        cdef int n
+        start, stop = self._bounds(start, stop)
+        for n in xrange(start, stop):
+            yield self.timestamp(n), self._view(n)
+
+    def itervalues(self, start=None, stop=None):
+        cdef int n
+        start, stop = self._bounds(start, stop)
+        for n in xrange(start, stop):
+            yield self._view(n)
+
+    def __iter__(self):
+        return (n * self.element_time for n in xrange(self.tail_num(), self.head_num))
+
+
+cdef class BinView:
+    """One occupied BinBuffer slot. Quacks like cbinner.Bin.
+
+    Views are cheap and meant to be short lived; a view of a slot which has
+    since been reused reads the new contents. Keep cbinner.detach copies of
+    bins which must outlive that; binners publish copies.
+    """
+    cdef BinBuffer _buffer
+    cdef int _slot
+
+    def __cinit__(self, BinBuffer buffer, int slot):
+        self._buffer = buffer
+        self._slot = slot
+
+    property timestamp:
+        def __get__(self):
+            return self._buffer._timestamps[self._slot]
+
+    property max:
+        def __get__(self):
+            return self._buffer._maxes[self._slot]
+
+    property min:
+        def __get__(self):
+            return self._buffer._mins[self._slot]
+
+    property mean:
+        def __get__(self):
+            return self._buffer._means[self._slot]
+
+    property nsamples:
+        def __get__(self):
+            return self._buffer._nsamples[self._slot]
+
+    property size:
+        def __get__(self):
+            return self._buffer._sizes[self._slot]
+
+    cpdef add(self, double ts, double val):
+        self.add_block(val, val, val, 1)
+
+    @cython.cdivision(True)
+    cpdef add_block(self, double max, double min, double total, int count):
+        """Add a run of count samples already reduced to max, min and sum."""
+        cdef BinBuffer b = self._buffer
+        cdef int slot = self._slot
+        if b._nsamples[slot] + count - 1 > b._sizes[slot]:
+            log.warning("Bin overflow; duplicate data? %s %s" %
+                        (b._nsamples[slot] + count, b._sizes[slot]))
+        if b._nsamples[slot] == 0:
+            b._maxes[slot] = max
+            b._mins[slot] = min
+        else:
+            if max > b._maxes[slot]:
+                b._maxes[slot] = max
+            if min < b._mins[slot]:
+                b._mins[slot] = min
+        b._means[slot] += total / b._sizes[slot]
+        b._nsamples[slot] += count
+
+    def __repr__(self):
+        return str((self.timestamp, self.max, self.min, self.mean,
+                        self.nsamples))
+
+    cpdef asdict(self):
+        return dict(
+            timestamp=self.timestamp,
+            max=self.max,
+            min=self.min,
+            mean=self.mean,
+            nsamples=self.nsamples)
@@ -0,0 +1 @@
+include "ctimebuf.pxd"
@@ -0,0 +1,6 @@
+# cython: profile=True
+"""
+Bin stores; see ctimebuf.pxi. Built with profiling hooks; see wavefront.
+"""
+
+include "ctimebuf.pxi"
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+"""
+Historical waveforms from a Datascope database.
+
+Reads the CSS3.0 wfdisc flat file of a database directly, so the Antelope
+datascope library isn't needed, along with snetsta, if present, for network
+codes. Waveform segments are read from the raw files the wfdisc points at;
+datatypes s2, s4, i2, i4, t4, t8, f4 and f8, plus miniSEED (sd) if obspy is
+installed.
+
+A Datascope is a query source: called with (srcname, tstart, tend) it returns
+(time, samples, samprate) blocks, e.g. for query.BinQuery.
+
+Segments are read in chunks of chunksamples samples, aligned to the start
+of the segment; miniSEED segments, which are parsed whole anyway, in one
+chunk. Reads of every chunk a query needs, of any segment and srcname, are
+fanned out over a thread pool; see read().
+
+Chunks go in their own cache, the datascope query cache of the design, so
+real time orb packets never displace them. They're keyed by (file, offset,
+chunk), so overlapping and shifted windows reuse them. Datascope is written
+outside of this system, so every query polls the wfdisc; if its mtime or
+size, i.e. row count, changed the index is reloaded and every cached chunk
+dropped.
+"""
+
+import os
+from bisect import bisect_left
+
+import numpy as np
+
+from gevent.threadpool import ThreadPool
+
+import logging
+
+from wavefront.cache import LRUCache
+
+try:
+    import obspy
+except ImportError:
+    obspy = None
+
+log = logging.getLogger(__name__)
+
+
+class DatascopeError(Exception): pass
+
+
+# name, first column, last column + 1, type; CSS3.0 wfdisc
+WFDISC = (
+    ('sta', 0, 6, str),
+    ('chan', 7, 15, str),
+    ('time', 16, 33, float),
+    ('wfid', 34, 42, int),
+    ('chanid', 43, 51, int),
+    ('jdate', 52, 60, int),
+    ('endtime', 61, 78, float),
+    ('nsamp', 79, 87, int),
+    ('samprate', 88, 99, float),
+    ('calib', 100, 116, float),
+    ('calper', 117, 133, float),
+    ('instype', 134, 140, str),
+    ('segtype', 141, 142, str),
+    ('datatype', 143, 145, str),
+    ('clip', 146, 147, str),
+    ('dir', 148, 212, str),
+    ('dfile', 213, 245, str),
+    ('foff', 246, 256, int),
+    ('commid', 257, 265, int),
+    ('lddate', 266, 283, float),
+)
+
+SNETSTA = (
+    ('snet', 0, 8, str),
+    ('fsta', 9, 15, str),
+    ('sta', 16, 22, str),
+)
+
+# wfdisc datatype -> numpy dtype
+DATATYPES = {
+    's2': '>i2', 's4': '>i4',
+    'i2': '<i2', 'i4': '<i4',
+    't4': '>f4', 't8': '>f8',
+    'f4': '<f4', 'f8': '<f8',
+}
+
+
+def parse(line, fields):
+    row = {}
+    for name, start, stop, kind in fields:
+        value = line[start:stop].strip()
+        row[name] = kind(value) if kind is not str else value
+    return row
+
+
+class Segment(object):
+    """One wfdisc row."""
+    __slots__ = ('time', 'endtime', 'nsamp', 'samprate', 'datatype', 'path',
+                 'foff', 'sta', 'chan')
+
+    def __init__(self, row, dbdir):
+        self.time = row['time']
+        self.endtime = row['endtime']
+        self.nsamp = row['nsamp']
+        self.samprate = row['samprate']
+        self.datatype = row['datatype']
+        self.path = os.path.join(dbdir, row['dir'], row['dfile'])
+        self.foff = row['foff']
+        self.sta = row['sta']
+        self.chan = row['chan']
+
+    @property
+    def key(self):
+        return self.path, self.foff
+
+    def span(self, tstart, tend):
+        """Return (first, last); the indexes of the samples from tstart up
+        to tend, or None if there are none."""
+        first = max(int(np.ceil((tstart - self.time) * self.samprate)), 0)
+        last = min(int(np.ceil((tend - self.time) * self.samprate)), self.nsamp)
+        if last <= first:
+            return None
+        return first, last
+
+    def read(self, tstart, tend):
+        """Return (time, samples) of the samples from tstart up to tend."""
+        span = self.span(tstart, tend)
+        if span is None:
+            return None
+        first, last = span
+        samples = self.read_samples(first, last)
+        first += _leading_gap(samples)
+        samples = samples[first - span[0]:]
+        if len(samples) == 0:
+            return None
+        return self.time + first / self.samprate, samples
+
+    def read_samples(self, first, last):
+        """Return samples first up to last as float64; miniSEED may have
+        fewer, or none, and NaN in place of those before its trace starts;
+        see _leading_gap."""
+        if self.datatype == 'sd':
+            return self._read_miniseed(first, last)
+        try:
+            dtype = np.dtype(DATATYPES[self.datatype])
+        except KeyError:
+            raise DatascopeError("Unsupported datatype %r in %s" % (
+                    self.datatype, self.path))
+        with open(self.path, 'rb') as f:
+            f.seek(self.foff + first * dtype.itemsize)
+            data = f.read((last - first) * dtype.itemsize)
+        if len(data) != (last - first) * dtype.itemsize:
+            raise DatascopeError("Short read from %s" % self.path)
+        return np.frombuffer(data, dtype).astype(np.float64)
+
+    def _read_miniseed(self, first, last):
+        if obspy is None:
+            raise DatascopeError("obspy is needed to read miniSEED %s" %
+                                 self.path)
+        chan = self.chan.split('_')[0]
+        stream = obspy.read(self.path, format='MSEED',
+                            sourcename='*.%s.*.%s' % (self.sta, chan))
+        stream.merge()
+        if len(stream) == 0:
+            log.warning("No %s %s data in %s" % (self.sta, chan, self.path))
+            return np.empty(0)
+        trace = stream[0]
+        offset = int(round((self.time - trace.stats.starttime.timestamp) *
+                           self.samprate))
+        samples = np.asarray(trace.data[max(offset + first, 0):
+                                        max(offset + last, 0)], np.float64)
+        if offset + first < 0:
+            # the trace starts late; pad, so samples stay indexed from first
+            samples = np.concatenate((np.full(min(-(offset + first),
+                                                  last - first), np.nan),
+                                      samples))
+        return samples
+
+
+def _leading_gap(samples):
+    """Return the number of leading NaN samples; those missing from the
+    start of a miniSEED trace."""
+    if len(samples) == 0 or not np.isnan(samples[0]):
+        return 0
+    present = np.flatnonzero(~np.isnan(samples))
+    return present[0] if len(present) else len(samples)
+
+
+class Datascope(object):
+    """Query source reading a Datascope database.
+
+    :param dbname: database path, without the .wfdisc extension
+    :param maxbytes: size of the chunk cache
+    :param threads: maximum number of concurrent chunk reads
+    :param chunksamples: samples per chunk of a segment
+    """
+
+    def __init__(self, dbname, maxbytes=256 << 20, threads=8,
+                 chunksamples=1 << 16):
+        self.dbname = dbname
+        self.dbdir = os.path.dirname(os.path.abspath(dbname))
+        self.cache = LRUCache(maxbytes, lambda samples: samples.nbytes)
+        self.pool = ThreadPool(threads)
+        self.chunksamples = chunksamples
+        self.reads = 0
+        self._version = None
+        # srcname -> segments sorted by time
+        self._segments = dict()
+        self._starts = dict()
+        # srcname -> longest segment duration; bounds lookups
+        self._durations = dict()
+        self.refresh()
+
+    def __repr__(self):
+        return "<Datascope %s>" % self.dbname
+
+    def _stat(self):
+        try:
+            st = os.stat(self.dbname + '.wfdisc')
+        except OSError, e:
+            raise DatascopeError("No wfdisc for %s: %s" % (self.dbname, e))
+        return st.st_mtime, st.st_size
+
+    def refresh(self):
+        """Reload the wfdisc if it has changed; return True if it had."""
+        mtime, size = self._stat()
+        if self._version == (mtime, size):
+            return False
+        nets = {}
+        if os.path.exists(self.dbname + '.snetsta'):
+            with open(self.dbname + '.snetsta') as f:
+                for line in f:
+                    row = parse(line, SNETSTA)
+                    nets[row['sta']] = row['snet']
+        segments = {}
+        nrows = 0
+        with open(self.dbname + '.wfdisc') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = parse(line, WFDISC)
+                nrows += 1
+                net = nets.get(row['sta'])
+                parts = [net, row['sta'], row['chan']] if net else \
+                        [row['sta'], row['chan']]
+                segments.setdefault('_'.join(parts), []).append(
+                        Segment(row, self.dbdir))
+        for srcname in segments:
+            segments[srcname].sort(key=lambda segment: segment.time)
+        self._segments = segments
+        self._starts = dict((srcname, [s.time for s in segs])
+                            for srcname, segs in segments.iteritems())
+        self._durations = dict(
+                (srcname, max(s.endtime - s.time for s in segs))
+                for srcname, segs in segments.iteritems())
+        self._version = mtime, size
+        self.cache.clear()
+        log.info("Loaded %d wfdisc rows of %s" % (nrows, self.dbname))
+        return True
+
+    def srcnames(self):
+        return sorted(self._segments)
+
+    def segments(self, srcname, tstart, tend):
+        """Return the segments of srcname overlapping tstart up to tend."""
+        starts = self._starts.get(srcname)
+        if not starts:
+            return []
+        lo = bisect_left(starts, tstart - self._durations[srcname])
+        hi = bisect_left(starts, tend)
+        return [segment for segment in self._segments[srcname][lo:hi]
+                if segment.endtime >= tstart]
+
+    def _chunks(self, segment, first, last):
+        """Return (chunk size, first chunk, last chunk + 1) covering samples
+        first up to last of segment."""
+        size = segment.nsamp if segment.datatype == 'sd' else \
+                self.chunksamples
+        return size, first // size, (last - 1) // size + 1
+
+    def _plan(self, srcnames, tstart, tend):
+        """Return {srcname: [(segment, first, last), ...]} and the keys of
+        the chunks needed, with their (segment, chunk size, chunk)."""
+        plan = {}
+        needed = {}
+        for srcname in srcnames:
+            spans = plan[srcname] = []
+            for segment in self.segments(srcname, tstart, tend):
+                span = segment.span(tstart, tend)
+                if span is None:
+                    continue
+                spans.append((segment,) + span)
+                size, lo, hi = self._chunks(segment, *span)
+                for n in xrange(lo, hi):
+                    needed[segment.key + (n,)] = segment, size, n
+        return plan, needed
+
+    def _assemble(self, plan, chunks):
+        """Return {srcname: blocks} from the planned spans and the chunks
+        they need."""
+        result = {}
+        for srcname, spans in plan.iteritems():
+            blocks = result[srcname] = []
+            for segment, first, last in spans:
+                size, lo, hi = self._chunks(segment, first, last)
+                data = [chunks[segment.key + (n,)] for n in xrange(lo, hi)]
+                data = data[0] if len(data) == 1 else np.concatenate(data)
+                samples = data[first - lo * size:last - lo * size]
+                gap = _leading_gap(samples)
+                first, samples = first + gap, samples[gap:]
+                if len(samples):
+                    blocks.append((segment.time + first / segment.samprate,
+                                   samples, segment.samprate))
+        return result
+
+    def _read_chunk(self, segment, size, n):
+        return segment.read_samples(n * size, min((n + 1) * size,
+                                                  segment.nsamp))
+
+    def read(self, srcnames, tstart, tend):
+        """Return {srcname: [(time, samples, samprate), ...]} for the window,
+        reading uncached chunks of every segment concurrently in the thread
+        pool. Samples may be views of cached chunks; don't modify them."""
+        self.refresh()
+        plan, needed = self._plan(srcnames, tstart, tend)
+        chunks = {}
+        pending = {}
+        for key, (segment, size, n) in needed.iteritems():
+            samples = self.cache.get(key)
+            if samples is not None:
+                chunks[key] = samples
+            else:
+                pending[key] = self.pool.spawn(self._read_chunk, segment, size,
+                                               n)
+        for key, reading in pending.iteritems():
+            chunks[key] = self.cache[key] = reading.get()
+            self.reads += 1
+        return self._assemble(plan, chunks)
+
+    def cached(self, srcname, tstart, tend):
+        """Return the blocks for the window if all of it is cached, or
+        None."""
+        self.refresh()
+        plan, needed = self._plan([srcname], tstart, tend)
+        chunks = {}
+        for key in needed:
+            chunks[key] = self.cache.get(key)
+            if chunks[key] is None:
+                return None
+        return self._assemble(plan, chunks)[srcname]
+
+    def __call__(self, srcname, tstart, tend):
+        return self.read([srcname], tstart, tend)[srcname]
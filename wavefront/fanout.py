@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+"""
+Fan-out of published updates to many subscribers.
+
+A Hub serializes each update once and pushes a reference to the same Message
+into every subscriber's bounded ring buffer, so publishing costs one encode
+plus one deque append per subscriber. What happens when a subscriber's
+buffer is full is up to its policy:
+
+DROP_OLDEST
+    Discard the oldest queued message. Later delta frames leave out bins a
+    dropped delta frame carried, so its bins are folded as for COALESCE and
+    handed out first as a full, non-delta frame.
+COALESCE
+    Fold the backlog into the latest state of each bin, keyed by (srcname,
+    tbin, bin timestamp). The folded state is handed out first, as freshly
+    encoded non-delta frames if the hub has an encoder.
+DISCONNECT
+    Drop everything and close the subscriber; get() raises
+    SlowConsumerError so the connection handler can hang up.
+
+Every overflow is counted per subscriber; see Hub.stats().
+
+A CoalescingSubscriber always folds, not just on overflow. It holds only the
+latest state of each pending bin, so a lagging client that drains gets the
+current state of every bin it missed, never a backlog of stale versions, and
+its memory is bounded by the number of distinct bins pending.
+
+Plain queues (anything with ``put(obj, block)``) may still subscribe; they
+get the encoded payload and overflow shows up as Full. Anything with a
+``push(message)`` method and a ``needs_records`` attribute gets the Message
+itself, like a Subscriber.
+"""
+
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from Queue import Empty, Full
+
+from gevent.event import Event
+
+import logging
+
+import numpy as np
+
+from wavefront.ctimebuf import BIN_DTYPE, bins_to_array
+from wavefront import wire
+
+log = logging.getLogger(__name__)
+
+
+DROP_OLDEST = 'drop-oldest'
+COALESCE = 'coalesce'
+DISCONNECT = 'disconnect'
+
+POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+
+class SlowConsumerError(Exception): pass
+
+
+class Message(object):
+    """One published update, shared by all subscribers.
+
+    key is (srcname, tbin) for bin updates, records a BIN_DTYPE array
+    snapshot of the updated bins (or None), payload what consumers get,
+    encoded whether payload is a wire frame and delta whether it's a delta
+    frame.
+    """
+    __slots__ = ('key', 'records', 'payload', 'encoded', 'delta')
+
+    def __init__(self, key, records, payload, encoded=False, delta=False):
+        self.key = key
+        self.records = records
+        self.payload = payload
+        self.encoded = encoded
+        self.delta = delta
+
+
+class Subscriber(object):
+    """Bounded buffer of messages for one consumer.
+
+    Usable wherever a Queue is expected by consumers: get() returns
+    payloads, blocking the calling greenlet if there are none.
+    """
+
+    def __init__(self, maxsize=64, policy=DROP_OLDEST, name=None):
+        if policy not in POLICIES:
+            raise ValueError("Unknown policy %r" % policy)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.name = name
+        self.overflows = 0
+        self.closed = False
+        self._messages = deque()
+        # (srcname, tbin, timestamp) -> record; backlog folded by COALESCE
+        self._folded = OrderedDict()
+        self._encoded = False
+        self._event = Event()
+
+    def __repr__(self):
+        return "<Subscriber %s: %s, %d queued, %d overflows>" % (
+                self.name or id(self), self.policy, len(self), self.overflows)
+
+    def __len__(self):
+        return len(self._messages) + len(self._folded)
+
+    def qsize(self):
+        return len(self)
+
+    def empty(self):
+        return len(self) == 0
+
+    @property
+    def needs_records(self):
+        """True if the hub must attach bin records to messages."""
+        return self.policy == COALESCE
+
+    def push(self, message):
+        """Queue a message; never blocks."""
+        if self.closed:
+            return
+        if len(self._messages) >= self.maxsize:
+            self.overflows += 1
+            self._overflow()
+            if self.closed:
+                return
+        self._messages.append(message)
+        self._event.set()
+
+    def _overflow(self):
+        if self.policy == DISCONNECT:
+            log.warning("%r too slow; disconnecting" % self)
+            self.closed = True
+            self._messages.clear()
+            self._folded.clear()
+            self._event.set()
+        elif self.policy == COALESCE:
+            self._fold()
+        else:
+            message = self._messages.popleft()
+            if message.delta and message.records is not None:
+                # resend its bins in full; later deltas may leave them out
+                self._fold_message(message)
+
+    def _fold(self):
+        """Fold queued messages into the latest state of each bin. Messages
+        without bin records can't be folded and are dropped oldest first."""
+        unfoldable = deque()
+        while self._messages:
+            message = self._messages.popleft()
+            if message.records is None:
+                unfoldable.append(message)
+            else:
+                self._fold_message(message)
+        if len(unfoldable) >= self.maxsize:
+            unfoldable.popleft()
+        self._messages = unfoldable
+
+    def _fold_message(self, message):
+        """Merge the bins of message into the folded state; last write
+        wins."""
+        srcname, tbin = message.key
+        self._encoded = message.encoded
+        for record in message.records:
+            key = srcname, tbin, float(record['timestamp'])
+            self._folded.pop(key, None)
+            self._folded[key] = record
+
+    def _drain_folded(self):
+        """Return the folded backlog of one channel as a payload; a frame
+        if the hub encodes, else a BIN_DTYPE array."""
+        srcname, tbin, ts = next(iter(self._folded))
+        keys = [k for k in self._folded if k[:2] == (srcname, tbin)]
+        records = np.array([self._folded.pop(k) for k in keys], BIN_DTYPE)
+        if self._encoded:
+            return wire.encode(srcname, tbin, records)
+        return records
+
+    def get(self, block=True, timeout=None):
+        while True:
+            if self.closed:
+                raise SlowConsumerError(repr(self))
+            if self._folded:
+                return self._drain_folded()
+            if self._messages:
+                return self._messages.popleft().payload
+            if not block:
+                raise Empty
+            self._event.clear()
+            if not self._event.wait(timeout):
+                raise Empty
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+
+class CoalescingSubscriber(Subscriber):
+    """Subscriber which keeps only the latest state of each pending bin,
+    keyed by (srcname, tbin, bin timestamp).
+
+    Each get() returns the pending bins of one channel. If more than maxbins
+    distinct bins are pending the oldest are dropped and counted as
+    overflows. Messages which aren't bin updates are queued as usual.
+    """
+
+    def __init__(self, maxbins=4096, maxsize=64, name=None):
+        super(CoalescingSubscriber, self).__init__(maxsize, COALESCE, name)
+        self.maxbins = maxbins
+
+    def push(self, message):
+        if message.records is None:
+            return super(CoalescingSubscriber, self).push(message)
+        if self.closed:
+            return
+        self._fold_message(message)
+        while len(self._folded) > self.maxbins:
+            self._folded.popitem(last=False)
+            self.overflows += 1
+        self._event.set()
+
+
+class Hub(object):
+    """Publishes updates to a set of subscribers.
+
+    :param key: (srcname, tbin) of the bins published through this hub, or
+        None if updates aren't bins
+    :param encoder: optional, e.g. wire.FrameEncoder; called once per update
+    """
+
+    def __init__(self, key=None, encoder=None):
+        self.key = key
+        self.encoder = encoder
+        self.npublished = 0
+        # bins published, subscribers or not, if updates are bins
+        self.nbins = 0
+        self._subscribers = set()
+        self._queues = set()
+        # number of subscribers which need bin records
+        self._folding = 0
+        # overflows of plain queues, by queue
+        self._queue_overflows = dict()
+
+    def __len__(self):
+        return len(self._subscribers) + len(self._queues)
+
+    def publish(self, obj, block=False):
+        """Encode obj once and hand it to every subscriber."""
+        if self.key is not None:
+            self.nbins += len(obj)
+        if not self._subscribers and not self._queues:
+            return
+        records = None
+        if self.key is not None and (self.encoder is not None or self._folding):
+            records = bins_to_array(obj)
+        payload = obj
+        if self.encoder is not None:
+            payload = self.encoder.encode(records if records is not None else obj)
+            if payload is None:
+                return
+        self.npublished += 1
+        message = Message(self.key, records, payload, self.encoder is not None,
+                          getattr(self.encoder, 'delta', False))
+        for subscriber in self._subscribers:
+            subscriber.push(message)
+        for queue in self._queues:
+            try:
+                queue.put(payload, block=block)
+            except Full:
+                self._queue_overflows[queue] = \
+                        self._queue_overflows.get(queue, 0) + 1
+                log.debug("queue overflow")
+
+    def subscribe(self, subscriber):
+        # Subscribers, and anything else taking messages, e.g.
+        # monitor.MonitorIndex
+        if hasattr(subscriber, 'push'):
+            if subscriber not in self._subscribers:
+                self._subscribers.add(subscriber)
+                self._folding += subscriber.needs_records
+        else:
+            self._queues.add(subscriber)
+
+    def unsubscribe(self, subscriber):
+        if subscriber in self._subscribers:
+            self._subscribers.remove(subscriber)
+            self._folding -= subscriber.needs_records
+        self._queues.discard(subscriber)
+        self._queue_overflows.pop(subscriber, None)
+
+    @contextmanager
+    def subscription(self, subscriber):
+        """Subscribe a Subscriber, or any queue with a put method, for the
+        duration of the with block."""
+        self.subscribe(subscriber)
+        try:
+            yield subscriber
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        """Return a list of (subscriber, queued, overflows) tuples."""
+        stats = [(s, len(s), s.overflows) for s in self._subscribers]
+        stats.extend((q, q.qsize(), self._queue_overflows.get(q, 0))
+                     for q in self._queues)
+        return stats
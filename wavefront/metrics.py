@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""
+Metrics; counters, gauges and histograms, and a text endpoint serving them.
+
+Metrics are cheap enough for the hot path: a counter increment is an
+attribute add, a histogram observation a bisect over its bucket bounds. Get
+a metric once from the Registry and keep it, rather than looking it up per
+event::
+
+    unstuffs = registry.histogram('wavefront_unstuff_seconds',
+                                  "Time to unstuff a packet")
+    ...
+    start = time()
+    packet = unstuff(raw)
+    unstuffs.observe(time() - start)
+
+Metrics are named and labelled, Prometheus style. State that already lives
+elsewhere, e.g. subscriber overflows, is read only when the metrics are, by
+collectors; see Registry.add_collector.
+
+Registry.stats() returns everything as a dict, for polling from Python, and
+Registry.render() in the Prometheus text format, as served by serve().
+"""
+
+from bisect import bisect_left
+
+from gevent.pywsgi import WSGIServer
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+# seconds; from 10 us, for the stages of the ingest path
+TIME_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+                0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# seconds; for data latency, which may be hours for backfilled data
+LATENCY_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0, 600.0,
+                   1800.0, 3600.0, 6 * 3600.0, 86400.0)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\')
+                                          .replace('"', '\\"'))
+                             for k, v in sorted(labels.iteritems()))
+
+
+def _value(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    kind = 'counter'
+    __slots__ = ('name', 'labels', 'value')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def stats(self):
+        return self.value
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram(object):
+    """Counts of observations per bucket, plus their count and sum.
+
+    Bucket n counts values up to bounds[n]; the last one those above all
+    bounds.
+    """
+    kind = 'histogram'
+    __slots__ = ('name', 'labels', 'bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, name, labels, bounds=TIME_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Return the upper bound of the bucket holding quantile q, None if
+        there are no observations, or inf if it's above all bounds."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+    def stats(self):
+        return dict(count=self.count, sum=self.sum,
+                    mean=self.sum / self.count if self.count else None,
+                    p50=self.quantile(0.5), p90=self.quantile(0.9),
+                    p99=self.quantile(0.99))
+
+    def samples(self):
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            labels = dict(self.labels, le=repr(bound))
+            yield self.name + '_bucket', labels, total
+        yield self.name + '_bucket', dict(self.labels, le='+Inf'), self.count
+        yield self.name + '_sum', self.labels, self.sum
+        yield self.name + '_count', self.labels, self.count
+
+
+class Registry(object):
+    """Named metrics, each with any number of label sets."""
+
+    def __init__(self):
+        # name -> (kind, help, {label items: metric})
+        self._families = dict()
+        self._collectors = []
+
+    def _get(self, cls, name, help, labels, *args):
+        try:
+            kind, _, metrics = self._families[name]
+        except KeyError:
+            kind, metrics = cls.kind, dict()
+            self._families[name] = kind, help, metrics
+        if kind != cls.kind:
+            raise ValueError("%s is a %s, not a %s" % (name, kind, cls.kind))
+        key = tuple(sorted(labels.iteritems()))
+        try:
+            return metrics[key]
+        except KeyError:
+            metric = metrics[key] = cls(name, labels, *args)
+            return metric
+
+    def counter(self, name, help='', **labels):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help='', **labels):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help='', bounds=TIME_BUCKETS, **labels):
+        return self._get(Histogram, name, help, labels, bounds)
+
+    def remove(self, name, **labels):
+        """Drop the metric of name with labels, e.g. of a binner gone."""
+        try:
+            del self._families[name][2][tuple(sorted(labels.iteritems()))]
+        except KeyError:
+            pass
+
+    def add_collector(self, collector):
+        """Add a callable returning metrics for state kept elsewhere, as
+        (kind, name, help, labels, value) tuples, kind 'counter' or 'gauge';
+        called whenever the metrics are read."""
+        self._collectors.append(collector)
+
+    def _collect(self):
+        """Return {name: (kind, help, [metric, ...])}, collected included."""
+        families = dict((name, (kind, help, metrics.values()))
+                        for name, (kind, help, metrics)
+                        in self._families.iteritems())
+        for collector in self._collectors:
+            try:
+                collected = list(collector())
+            except Exception:
+                log.error("Metrics collector %r failed" % collector,
+                          exc_info=True)
+                continue
+            for kind, name, help, labels, value in collected:
+                metric = (Counter if kind == 'counter' else Gauge)(name, labels)
+                metric.value = value
+                families.setdefault(name, (kind, help, []))[2].append(metric)
+        return families
+
+    def stats(self):
+        """Return {name: [(labels, value), ...]}; histogram values are dicts
+        of count, sum, mean and estimated p50, p90 and p99."""
+        return dict((name, [(metric.labels, metric.stats())
+                            for metric in metrics])
+                    for name, (kind, help, metrics)
+                    in self._collect().iteritems())
+
+    def render(self):
+        """Return all metrics in the Prometheus text format."""
+        lines = []
+        for name, (kind, help, metrics) in sorted(self._collect().iteritems()):
+            if help:
+                lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for metric in metrics:
+                for sample, labels, value in metric.samples():
+                    lines.append('%s%s %s' % (sample, _labels(labels),
+                                              _value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def serve(registry, address=('', 9102)):
+    """Start serving registry.render() over HTTP on address, at any path.
+    Return the server; stop() it when done."""
+    def application(environ, start_response):
+        body = registry.render()
+        start_response('200 OK', [
+                ('Content-Type', 'text/plain; version=0.0.4'),
+                ('Content-Length', str(len(body)))])
+        return [body]
+    server = WSGIServer(address, application, log=None)
+    server.start()
+    log.info("Serving metrics on %s:%s" % server.address)
+    return server
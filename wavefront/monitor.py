@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+"""
+Monitor subscriptions; the monitor(tstart, tend, binsize, accept, reject,
+history) of the design.
+
+A Monitor is a fanout.Subscriber which only wants the bins of one bin size,
+of srcnames matching its accept and not its reject regex, inside its time
+window. The window is fixed, open ended (no tend) or advancing, i.e. the
+last duration seconds before now.
+
+A MonitorIndex subscribes to the hubs of the binners and routes each update
+to the monitors wanting it. Per (srcname, tbin) it keeps the monitors
+accepting that srcname, with fixed windows indexed by time bucket of
+bucketbins bins and open and advancing windows sorted by their lower bound,
+so an update is only tested against monitors whose window may hold it.
+Bins outside a monitor's window are filtered out before encoding, and
+monitors receiving the same bins share one encoded payload.
+"""
+
+from bisect import bisect_right
+from contextlib import contextmanager
+from time import time
+
+import re
+
+import numpy as np
+
+import logging
+
+from wavefront.fanout import Subscriber, Message, DROP_OLDEST
+from wavefront import wire
+
+log = logging.getLogger(__name__)
+
+
+class Window(object):
+    """Time window of a monitor.
+
+    Fixed from tstart up to tend, open ended if tend is None, or, given
+    duration, advancing; the last duration seconds before now.
+    """
+
+    def __init__(self, tstart=None, tend=None, duration=None):
+        if duration is not None:
+            if tstart is not None or tend is not None:
+                raise ValueError("Advancing windows have no tstart or tend")
+        elif tstart is None:
+            raise ValueError("Need tstart or duration")
+        elif tend is not None and tend < tstart:
+            raise ValueError("tend %s before tstart %s" % (tend, tstart))
+        self.tstart = tstart
+        self.tend = tend
+        self.duration = duration
+
+    def __repr__(self):
+        if self.duration is not None:
+            return "<Window last %ss>" % self.duration
+        return "<Window %s to %s>" % (self.tstart, self.tend)
+
+    @property
+    def advancing(self):
+        return self.duration is not None
+
+    def bounds(self, now):
+        """Return (lo, hi); the window holds timestamps lo <= t < hi."""
+        if self.duration is not None:
+            return now - self.duration, np.inf
+        return self.tstart, np.inf if self.tend is None else self.tend
+
+
+class Monitor(Subscriber):
+    """Subscriber to the bins of size tbin of matching srcnames within a
+    window; see MonitorIndex.
+
+    :param accept: regex srcnames must match, whole; all if None
+    :param reject: regex matching srcnames to leave out
+    """
+
+    def __init__(self, tbin, window, accept=None, reject=None, maxsize=64,
+                 policy=DROP_OLDEST, name=None):
+        super(Monitor, self).__init__(maxsize, policy, name)
+        self.tbin = tbin
+        self.window = window
+        self.accept = accept
+        self.reject = reject
+        self._accept = None if accept is None else \
+                re.compile('(?:%s)\\Z' % accept)
+        self._reject = None if reject is None else \
+                re.compile('(?:%s)\\Z' % reject)
+
+    def __repr__(self):
+        return "<Monitor %s: %s %r accept %s reject %s, %d queued>" % (
+                self.name or id(self), self.tbin, self.window, self.accept,
+                self.reject, len(self))
+
+    def accepts(self, srcname):
+        if self._accept is not None and not self._accept.match(srcname):
+            return False
+        return self._reject is None or not self._reject.match(srcname)
+
+
+class _Routes(object):
+    """The monitors of one (srcname, tbin), indexed by window."""
+    __slots__ = ('width', 'buckets', 'wide', 'open', 'open_keys',
+                 'advancing', 'advancing_keys')
+
+    def __init__(self, width):
+        self.width = width
+        # bucket number -> set of fixed window monitors overlapping it
+        self.buckets = dict()
+        # fixed windows spanning too many buckets; always candidates
+        self.wide = set()
+        # open ended monitors, sorted by tstart
+        self.open = []
+        self.open_keys = []
+        # advancing monitors, sorted by -duration
+        self.advancing = []
+        self.advancing_keys = []
+
+    def __nonzero__(self):
+        return bool(self.wide or self.buckets or self.open or
+                    self.advancing)
+
+    def _span(self, window):
+        return (int(np.floor(window.tstart / self.width)),
+                int(np.ceil(window.tend / self.width)))
+
+    def add(self, monitor, maxbuckets):
+        window = monitor.window
+        if window.advancing:
+            self._insort(self.advancing_keys, self.advancing,
+                         -window.duration, monitor)
+        elif window.tend is None:
+            self._insort(self.open_keys, self.open, window.tstart, monitor)
+        else:
+            first, last = self._span(window)
+            if last - first > maxbuckets:
+                self.wide.add(monitor)
+            else:
+                for bucket in xrange(first, last):
+                    self.buckets.setdefault(bucket, set()).add(monitor)
+
+    def _insort(self, keys, monitors, key, monitor):
+        n = bisect_right(keys, key)
+        keys.insert(n, key)
+        monitors.insert(n, monitor)
+
+    def remove(self, monitor):
+        for keys, monitors in ((self.open_keys, self.open),
+                               (self.advancing_keys, self.advancing)):
+            if monitor in monitors:
+                n = monitors.index(monitor)
+                del keys[n], monitors[n]
+                return
+        if monitor in self.wide:
+            self.wide.remove(monitor)
+            return
+        first, last = self._span(monitor.window)
+        for bucket in xrange(first, last):
+            monitors = self.buckets.get(bucket)
+            if monitors is None:
+                continue
+            monitors.discard(monitor)
+            if not monitors:
+                del self.buckets[bucket]
+
+    def candidates(self, timestamps, now):
+        """Return the monitors whose window may hold any of timestamps."""
+        found = set(self.wide)
+        buckets = self.buckets
+        if buckets:
+            for bucket in np.unique(np.floor(timestamps / self.width)):
+                monitors = buckets.get(int(bucket))
+                if monitors:
+                    found.update(monitors)
+        latest = timestamps.max()
+        found.update(self.open[:bisect_right(self.open_keys, latest)])
+        found.update(self.advancing[:bisect_right(self.advancing_keys,
+                                                  latest - now)])
+        return found
+
+
+class MonitorIndex(object):
+    """Routes bin updates to Monitors.
+
+    Subscribe it to binner hubs like a fanout.Subscriber; BinController does
+    that for binners with monitors. Routed payloads are wire frames if
+    encode is set, else BIN_DTYPE arrays.
+
+    :param bucketbins: width of the time buckets fixed windows are indexed
+        by, in bins
+    :param maxbuckets: fixed windows spanning more buckets are tested
+        against every update of their srcnames
+    :param clock: returns now, for advancing windows
+    """
+
+    # hubs must attach bin records to messages
+    needs_records = True
+
+    def __init__(self, encode=True, bucketbins=256, maxbuckets=64,
+                 clock=time):
+        self.encode = encode
+        self.bucketbins = bucketbins
+        self.maxbuckets = maxbuckets
+        self.clock = clock
+        self.monitors = set()
+        # (srcname, tbin) -> _Routes, for every key seen
+        self._routes = dict()
+        self.nrouted = 0
+        self.ntested = 0
+
+    def __len__(self):
+        return len(self.monitors)
+
+    def wants(self, srcname, tbin):
+        """True if any monitor wants bins of (srcname, tbin)."""
+        return any(monitor.tbin == tbin and monitor.accepts(srcname)
+                   for monitor in self.monitors)
+
+    def add(self, monitor):
+        self.monitors.add(monitor)
+        for (srcname, tbin), routes in self._routes.iteritems():
+            if monitor.tbin == tbin and monitor.accepts(srcname):
+                routes.add(monitor, self.maxbuckets)
+
+    def remove(self, monitor):
+        if monitor not in self.monitors:
+            return
+        self.monitors.remove(monitor)
+        for (srcname, tbin), routes in self._routes.iteritems():
+            if monitor.tbin == tbin and monitor.accepts(srcname):
+                routes.remove(monitor)
+
+    @contextmanager
+    def monitoring(self, monitor):
+        """Add monitor for the duration of the with block."""
+        self.add(monitor)
+        try:
+            yield monitor
+        finally:
+            self.remove(monitor)
+
+    def _routes_of(self, key):
+        try:
+            return self._routes[key]
+        except KeyError:
+            srcname, tbin = key
+            routes = self._routes[key] = _Routes(tbin * self.bucketbins)
+            for monitor in self.monitors:
+                if monitor.tbin == tbin and monitor.accepts(srcname):
+                    routes.add(monitor, self.maxbuckets)
+            return routes
+
+    def push(self, message):
+        """Route a hub message to the monitors wanting its bins."""
+        records = message.records
+        if records is None or len(records) == 0 or not self.monitors:
+            return
+        routes = self._routes_of(message.key)
+        if not routes:
+            return
+        timestamps = records['timestamp']
+        now = self.clock()
+        candidates = routes.candidates(timestamps, now)
+        self.ntested += len(candidates)
+        # mask bytes -> message; monitors wanting the same bins share one
+        messages = dict()
+        for monitor in candidates:
+            lo, hi = monitor.window.bounds(now)
+            mask = (timestamps >= lo) & (timestamps < hi)
+            if not mask.any():
+                continue
+            selected = mask.tostring()
+            routed = messages.get(selected)
+            if routed is None:
+                routed = messages[selected] = self.message(
+                        message.key, records if mask.all() else records[mask])
+            monitor.push(routed)
+            self.nrouted += 1
+
+    def message(self, key, records):
+        """Return a Message carrying records as routed to monitors."""
+        if not self.encode:
+            return Message(key, records, records)
+        srcname, tbin = key
+        return Message(key, records, wire.encode(srcname, tbin, records),
+                       True)
+
+    def stats(self):
+        """Return a list of (monitor, queued, overflows) tuples."""
+        return [(m, len(m), m.overflows) for m in self.monitors]
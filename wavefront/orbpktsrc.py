@@ -8,34 +8,23 @@ release the GIL when entering Antelope C functions. E.g.
 
     export ANTELOPE_PYTHON_GILRELEASE=1
 
+Other packet sources, e.g. a replay.ReplaySource, need neither; see source.
 """
 
-from contextlib import contextmanager
-from cPickle import dumps
-import os
-
 from gevent import Greenlet
-from gevent.threadpool import ThreadPool, wrap_errors
-from gevent.queue import Queue, Empty, Full
-
-from antelope.brttpkt import OrbreapThr, Timeout, NoData
-from antelope.Pkt import Packet
 
 import logging
 
 from datetime import datetime
 
-
-if 'ANTELOPE_PYTHON_GILRELEASE' not in os.environ:
-    raise GilReleaseNotSetError("ANTELOPE_PYTHON_GILRELEASE not in environment")
+from wavefront.fanout import Hub
+from wavefront.reap import BatchReaper
+from wavefront.source import OrbSource
 
 
 log = logging.getLogger('wavefront.orbpktsrc')
 
 
-class GilReleaseNotSetError(Exception): pass
-
-
 class OrbPktSrc(Greenlet):
     """Gevent based orb packet publisher.
 
@@ -44,6 +33,12 @@ class OrbPktSrc(Greenlet):
 
     Gets packets from an orbreap thread in a non-blocking fashion using the
     gevent threadpool functionality, and publishes them to subscribers.
+    Packets are reaped in batches of up to reap_batchsize, waiting at most
+    about reap_latency seconds to fill one; see reap.BatchReaper. Raw
+    packets are added to packet_cache, a cache.PacketCache, if given.
+
+    Packets come from source, by default a source.OrbSource reading
+    orbname; e.g. a replay.ReplaySource replays a capture instead.
 
     The transformation function should take a single argument, the unstuffed Packet
     object. It's return value is placed into the queue.
@@ -57,86 +52,69 @@ class OrbPktSrc(Greenlet):
 
     """
     def __init__(self, orbname, select=None, reject=None, transformation=None,
-                    orbreapthr_queuesize=8, block_on_full=True):
+                    orbreapthr_queuesize=8, block_on_full=True,
+                    reap_batchsize=64, reap_latency=0.1, packet_cache=None,
+                    source=None):
         Greenlet.__init__(self)
         self.orbname = orbname
         self.select = select
         self.reject = reject
+        if source is None:
+            source = OrbSource(orbname, select, reject, orbreapthr_queuesize)
+        self.source = source
         self.transformation = transformation
         self.orbreapthr_queuesize=orbreapthr_queuesize
         self.block_on_full=block_on_full
-        self._queues = set()
+        self.reap_batchsize = reap_batchsize
+        self.reap_latency = reap_latency
+        self.packet_cache = packet_cache
+        self.hub = Hub()
 
     def _run(self):
         try:
-            args = self.orbname, self.select, self.reject
             # TODO Review this queue size
             # TODO Review reasoning behind using OrbreapThr vs. normal ORB API
             # I think it had something to do with orb.reap() blocking forever
             # on comms failures; maybe we could create our own orbreapthr
             # implementation?
-            with OrbreapThr(*args, timeout=1, queuesize=orbreapthr_queuesize) as orbreapthr:
-                log.info("Connected to ORB %s %s %s" % (self.orbname, self.select,
-                                                        self.reject))
-                threadpool = ThreadPool(maxsize=1)
-                try:
+            with self.source.open(self.reap_latency) as orbreapthr:
+                log.info("Connected to %r" % self.source)
+                with BatchReaper(orbreapthr, self.reap_batchsize,
+                                 self.reap_latency) as reaper:
                     while True:
-                        try:
-                            success, value = threadpool.spawn(
-                                    wrap_errors, (Exception,), orbreapthr.get, [], {}).get()
-                            timestamp = datetime.utcnow()
-                            if not success:
-                                raise value
-                        except (Timeout, NoData), e:
-                            log.debug("orbreapthr.get exception %r" % type(e))
-                            pass
-                        else:
-                            if value is None:
-                                raise Exception('Nothing to publish')
+                        batch = reaper.get()
+                        timestamp = datetime.utcnow()
+                        for value in batch:
                             self._publish(value, timestamp)
-                finally:
-                    # This blocks until all threads in the pool return. That's
-                    # critical; if the orbreapthr dies before the get thread,
-                    # segfaults ensue.
-                    threadpool.kill()
         except Exception, e:
             log.error("OrbPktSrc terminating due to exception", exc_info=True)
             raise
         finally:
-            log.info("Disconnected from ORB %s %s %s" % (self.orbname, self.select,
-                                                         self.reject))
+            log.info("Disconnected from %r" % self.source)
 
     def _publish(self, r, timestamp):
         pktid, srcname, orbtimestamp, raw_packet = r
-        packet = Packet(srcname, orbtimestamp, raw_packet)
+        packet = self.source.unstuff(srcname, orbtimestamp, raw_packet)
+        if self.packet_cache is not None:
+            self.packet_cache.add_packet(srcname, raw_packet, packet)
         if self.transformation is not None:
             packet = self.transformation(packet)
-        for queue in self._queues:
-            try:
-                queue.put((packet, timestamp), block=self.block_on_full)
-            except Full:
-                log.debug("queue overflow")
+        # transformed once, shared by all subscribers
+        self.hub.publish((packet, timestamp), block=self.block_on_full)
 
-    @contextmanager
-    def subscription(self, queue):
-        """This context manager returns a Queue object from which the
-        subscriber can get pickled orb packets.
+    def subscription(self, subscriber):
+        """This context manager subscribes a fanout.Subscriber or a Queue, from
+        which the subscriber can get (packet, timestamp) tuples.
 
-        :param queue: The queue to which you would like packets to be published
-        :type queue: Instance of ``Queue`` or compatible
+        :param subscriber: Where packets should be published
+        :type subscriber: ``fanout.Subscriber``, or ``Queue`` or compatible
 
         Example::
 
             queue = Queue()
             with orbpktsrc.subscription(queue):
                 while True:
-                    pickledpacket = queue.get()
+                    pickledpacket, timestamp = queue.get()
                     ...
         """
-        self._queues.add(queue)
-        try:
-            yield
-        finally:
-            # Stop publishing
-            self._queues.remove(queue)
-
+        return self.hub.subscription(subscriber)
@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+"""
+Tiered query planning.
+
+A QueryPlanner answers (srcnames, tstart, tend, tbin) queries from the
+cheapest tier holding each part of the window, in the order of the design:
+
+#. buffers; the real time prebinned buffers of a BinController
+#. binned; the custom bin size chunk cache of a query.BinQuery
+#. raw data tiers, tried in the order given; typically the orb packet cache,
+   the datascope query cache, the orb and datascope
+
+The part of the window the buffers hold bins for is answered straight away;
+chunks with empty buffer bins, e.g. after a restart without a snapshot or a
+telemetry gap, are left to the lower tiers. The rest is split into BinQuery
+chunks; cached chunks are answered from one get_multi, missing ones are
+binned from raw data, a few chunks per fetch, with the fetches running
+concurrently. Results are yielded in time order as
+soon as they and everything before them are done, so the first screenful of
+a wide historical query arrives before the slowest fetch finishes; stream()
+yields them as fixed size wire frames, ready to send.
+
+Raw tiers are callables (srcname, tstart, tend) returning (time, samples,
+samprate) blocks, or None if they can't answer for the window, which moves
+on to the next tier; see PacketSource and datascope.Datascope.
+
+Concurrent fetches store chunks while planning looks them up, all in the
+one BinQuery cache, so the cache backend must be greenlet safe; the
+cache.CacheBackend contract, which MemcacheCache meets by taking turns on
+its connection.
+
+Hits, misses and latency are recorded per tier; see QueryPlanner.stats().
+"""
+
+from collections import deque
+from time import time
+
+import numpy as np
+
+from gevent.pool import Pool
+
+import logging
+
+from wavefront.cache import channel_srcname
+from wavefront.ctimebuf import bins_to_array
+from wavefront.query import BinQuery
+from wavefront import wire
+
+log = logging.getLogger(__name__)
+
+
+BUFFERS = 'buffers'
+BINNED = 'binned'
+
+
+def unstuff(srcname, pktsrcname, time, raw):
+    """Return the (time, samples, samprate) blocks of srcname in a raw orb
+    packet. Needs Antelope."""
+    from antelope.Pkt import Packet
+    packet = Packet(pktsrcname, time, raw)
+    return [(channel.time, channel.data, channel.samprate)
+            for channel in packet.channels
+            if channel_srcname(channel) == srcname]
+
+
+class PacketSource(object):
+    """Raw data tier over a cache.PacketCache.
+
+    Without a loader this is the orb packet cache tier; it answers only
+    windows fully loaded before. With a loader, e.g. reading from the orb,
+    it's the orb tier; missing windows are loaded, and cached, first.
+
+    :param unpack: called as unpack(srcname, pktsrcname, time, raw); returns
+        the blocks of srcname in a cached packet
+    :param pktsrcname: maps a srcname to the orb packet srcname the packets
+        are cached under; by default they're the same
+    """
+
+    def __init__(self, packet_cache, loader=None, unpack=unstuff,
+                 pktsrcname=None):
+        self.packet_cache = packet_cache
+        self.loader = loader
+        self.unpack = unpack
+        self.pktsrcname = pktsrcname
+
+    def __call__(self, srcname, tstart, tend):
+        key = srcname if self.pktsrcname is None else self.pktsrcname(srcname)
+        if self.loader is None:
+            if not self.packet_cache.loaded(key, tstart, tend):
+                return None
+            packets = self.packet_cache.lookup(key, tstart, tend)
+        else:
+            packets = self.packet_cache.fetch(key, tstart, tend, self.loader)
+            if packets is None:
+                return None
+        blocks = []
+        for time, endtime, raw in packets:
+            blocks.extend(self.unpack(srcname, key, time, raw))
+        return blocks
+
+
+class TierStats(object):
+    __slots__ = ('hits', 'misses', 'calls', 'seconds')
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.calls = 0
+        self.seconds = 0.0
+
+    def record(self, hits, misses, seconds):
+        self.hits += hits
+        self.misses += misses
+        self.calls += 1
+        self.seconds += seconds
+
+    def asdict(self):
+        return dict(hits=self.hits, misses=self.misses, calls=self.calls,
+                    latency=self.seconds / self.calls if self.calls else None)
+
+
+class QueryPlanner(object):
+    """Answers queries from the cheapest tier holding the data.
+
+    :param controller: BinController with the real time buffers, or None
+    :param sources: raw data tiers; (name, source) pairs, cheapest first
+    :param cache: cache.CacheBackend for binned chunks, see query.BinQuery
+    :param concurrency: maximum number of concurrent fetches
+    :param maxchunks: chunks binned per fetch
+    """
+
+    def __init__(self, controller=None, sources=(), cache=None,
+                 chunkbins=256, settle=600, concurrency=8, maxchunks=4):
+        self.controller = controller
+        self.sources = list(sources)
+        self.binquery = BinQuery(self.raw, cache, chunkbins=chunkbins,
+                                 settle=settle)
+        self.concurrency = concurrency
+        self.maxchunks = maxchunks
+        self.tiers = dict((name, TierStats()) for name in
+                          [BUFFERS, BINNED] + [n for n, s in self.sources])
+
+    def stats(self):
+        """Return {tier: dict(hits, misses, calls, latency)}; latency is the
+        mean seconds per call."""
+        return dict((name, tier.asdict()) for name, tier in
+                    self.tiers.iteritems())
+
+    def raw(self, srcname, tstart, tend):
+        """Return raw blocks for the window from the cheapest raw tier."""
+        for name, source in self.sources:
+            start = time()
+            blocks = source(srcname, tstart, tend)
+            hit = blocks is not None
+            self.tiers[name].record(hit, not hit, time() - start)
+            if hit:
+                return blocks
+        log.debug("No raw data tier has %s %s %s" % (srcname, tstart, tend))
+        return []
+
+    def query(self, srcnames, tstart, tend, tbin):
+        """Generate (srcname, bins) pieces covering the bins of size tbin
+        from tstart up to tend, as BIN_DTYPE arrays. All pieces of a srcname
+        come together, in time order, and are contiguous.
+
+        Planning and fetching are lazy and run at most concurrency fetches
+        ahead of the consumer, so memory use doesn't grow with the window or
+        the number of srcnames, and a consumer which blocks, e.g. writing to
+        a slow socket, holds back production.
+        """
+        if isinstance(srcnames, basestring):
+            srcnames = [srcnames]
+        first = int(np.floor(tstart / tbin))
+        last = int(np.ceil(tend / tbin))
+        pool = Pool(self.concurrency)
+        # (srcname, greenlet or None, bins or None), in order
+        inflight = deque()
+        try:
+            for srcname in srcnames:
+                for task in self._plan(srcname, tbin, first, last):
+                    if isinstance(task, np.ndarray):
+                        inflight.append((srcname, None, task))
+                    else:
+                        while pool.full():
+                            yield self._next(inflight)
+                        inflight.append((srcname, pool.spawn(
+                                self._fetch, srcname, tbin, *task), None))
+                    while inflight and (inflight[0][1] is None or
+                                        inflight[0][1].ready()):
+                        yield self._next(inflight)
+            while inflight:
+                yield self._next(inflight)
+        finally:
+            pool.kill()
+
+    def _next(self, inflight):
+        """Pop the first piece, waiting for it if need be."""
+        srcname, greenlet, bins = inflight.popleft()
+        if greenlet is not None:
+            bins = greenlet.get()
+        return srcname, bins
+
+    def stream(self, srcnames, tstart, tend, tbin, framebins=1024):
+        """Like query, but generate wire frames of up to framebins bins each;
+        see wire.decode. Frames of a srcname cover consecutive framebins
+        windows, and only the last one is shorter. Being wire frames, empty
+        bins are left out.
+
+        Example::
+
+            for frame in planner.stream(srcnames, tstart, tend, tbin):
+                socket.sendall(frame)
+        """
+        current = None
+        pending = []
+        npending = 0
+        for srcname, bins in self.query(srcnames, tstart, tend, tbin):
+            if srcname != current:
+                if npending:
+                    yield wire.encode(current, tbin, np.concatenate(pending))
+                current, pending, npending = srcname, [], 0
+            pending.append(bins)
+            npending += len(bins)
+            while npending >= framebins:
+                bins = np.concatenate(pending)
+                yield wire.encode(current, tbin, bins[:framebins])
+                pending = [bins[framebins:]]
+                npending -= framebins
+        if npending:
+            yield wire.encode(current, tbin, np.concatenate(pending))
+
+    def _plan(self, srcname, tbin, first, last):
+        """Return the pieces of bins first up to last in time order; arrays
+        for pieces answered already, (chunk first, chunk last, bin first,
+        bin last, overlay) for those still to be fetched."""
+        tasks = []
+        split = last
+        store = self._buffer(srcname, tbin)
+        if store is not None:
+            tail = int(round(store.tail_time() / tbin))
+            head = int(round(store.head_time() / tbin))
+            if tail < last and head > first:
+                split = max(first, tail)
+        if split > first:
+            self._plan_binned(tasks, srcname, tbin, first, split)
+        if split < last:
+            start = time()
+            bins = self._from_buffer(store, tbin, split, last)
+            end = min(last, head)
+            filled = bins['nsamples'][:end - split] > 0
+            self.tiers[BUFFERS].record(int(filled.any()),
+                                       int(not filled.all()), time() - start)
+            self._plan_buffered(tasks, srcname, tbin, split, end, bins,
+                                filled)
+            if end < last:
+                # past the head
+                tasks.append(bins[end - split:])
+        elif self.controller is not None:
+            self.tiers[BUFFERS].record(0, 1, 0)
+        return tasks
+
+    def _plan_buffered(self, tasks, srcname, tbin, first, last, bins, filled):
+        """Plan bins first up to last of a real time buffer. Chunks the
+        buffer has empty bins in, e.g. after a restart or a telemetry gap,
+        are answered by the lower tiers, with the filled buffer bins laid
+        over them; the rest straight from the buffer."""
+        cb = self.binquery.chunkbins
+        n = first
+        while n < last:
+            stop = min(last, (n // cb + 1) * cb)
+            complete = filled[n - first:stop - first].all()
+            while stop < last:
+                after = min(last, (stop // cb + 1) * cb)
+                if filled[stop - first:after - first].all() != complete:
+                    break
+                stop = after
+            if complete:
+                tasks.append(bins[n - first:stop - first])
+            else:
+                self._plan_binned(tasks, srcname, tbin, n, stop,
+                                  bins[n - first:stop - first])
+            n = stop
+
+    def _plan_binned(self, tasks, srcname, tbin, first, last, overlay=None):
+        """Plan bins first up to last from the BinQuery chunks, cached or to
+        be fetched. Bins of overlay with samples take the place of theirs."""
+        start = time()
+        binquery = self.binquery
+        cfirst, clast = binquery.chunk_range(tbin, first * tbin, last * tbin)
+        chunks = binquery.cached_chunks(srcname, tbin, cfirst, clast)
+        misses = chunks.count(None)
+        self.tiers[BINNED].record(len(chunks) - misses, misses,
+                                  time() - start)
+        cb = binquery.chunkbins
+        n = 0
+        while n < len(chunks):
+            if chunks[n] is not None:
+                index = cfirst + n
+                lo = max(first, index * cb)
+                hi = min(last, (index + 1) * cb)
+                tasks.append(_lay_over(
+                        chunks[n][lo - index * cb:hi - index * cb],
+                        overlay, lo - first))
+                n += 1
+                continue
+            stop = n
+            while stop < len(chunks) and chunks[stop] is None and \
+                    stop - n < self.maxchunks:
+                stop += 1
+            lo = max(first, (cfirst + n) * cb)
+            hi = min(last, (cfirst + stop) * cb)
+            tasks.append((cfirst + n, cfirst + stop, lo, hi,
+                          None if overlay is None else
+                          overlay[lo - first:hi - first]))
+            n = stop
+
+    def _buffer(self, srcname, tbin):
+        if self.controller is None:
+            return None
+        binner = self.controller.find_binner(srcname, tbin)
+        return None if binner is None else binner.store
+
+    def _from_buffer(self, store, tbin, first, last):
+        """Return bins first up to last of a real time buffer, padded with
+        empty bins past its head."""
+        bins = bins_to_array(store.get_range(first * tbin, last * tbin))
+        if len(bins) < last - first:
+            bins = np.concatenate(
+                    (bins, bins_to_array([None] * (last - first - len(bins)))))
+        return bins
+
+    def _fetch(self, srcname, tbin, cfirst, clast, first, last, overlay):
+        chunks = self.binquery.compute(srcname, tbin, cfirst, clast)
+        offset = cfirst * self.binquery.chunkbins
+        return _lay_over(np.concatenate(chunks)[first - offset:last - offset],
+                         overlay)
+
+
+def _lay_over(bins, overlay, offset=0):
+    """Return bins with those of overlay from offset on which have samples
+    in their place."""
+    if overlay is None:
+        return bins
+    overlay = overlay[offset:offset + len(bins)]
+    filled = overlay['nsamples'] > 0
+    if filled.any():
+        bins = bins.copy()
+        bins[filled] = overlay[filled]
+    return bins
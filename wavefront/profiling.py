@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Profiling sessions of a running process, triggered by signal or API.
+
+A session profiles everything the process runs, every greenlet, for a
+number of seconds, then dumps the profile to a file for pstats, snakeviz
+etc. Nothing is profiled outside sessions. E.g. from a shell::
+
+    kill -USR2 <pid>
+
+with a Profiler installed on SIGUSR2, as App does given profile_signal, or
+from Python::
+
+    app.profile(60)
+
+Cython functions of the hot path only show up if the profiled build was
+imported, i.e. WAVEFRONT_PROFILE was set; see wavefront. Otherwise their
+time is counted in their Python callers.
+"""
+
+import os
+from cProfile import Profile
+from time import strftime
+
+import gevent
+from gevent import Greenlet, sleep
+
+import logging
+
+import wavefront
+
+log = logging.getLogger(__name__)
+
+
+class Session(Greenlet):
+    """Profiles the process for seconds, then dumps the profile to path."""
+
+    def __init__(self, seconds, path):
+        super(Session, self).__init__()
+        self.seconds = seconds
+        self.path = path
+
+    def __repr__(self):
+        return "<Session %ss to %s>" % (self.seconds, self.path)
+
+    def _run(self):
+        if not wavefront.PROFILED:
+            log.warning("Profiling without the profiled Cython build; set %s "
+                        "to see Cython functions" % wavefront.PROFILE_ENV)
+        log.info("Profiling for %ss to %s" % (self.seconds, self.path))
+        profile = Profile()
+        profile.enable()
+        try:
+            sleep(self.seconds)
+        finally:
+            profile.disable()
+            profile.dump_stats(self.path)
+            log.info("Dumped profile to %s" % self.path)
+        return self.path
+
+
+class Profiler(object):
+    """Starts profiling sessions, one at a time.
+
+    :param directory: where session profiles go, unless given a path
+    :param seconds: default session length
+    """
+
+    def __init__(self, directory='.', seconds=30.0):
+        self.directory = directory
+        self.seconds = seconds
+        self.session = None
+        self._handler = None
+
+    def start(self, seconds=None, path=None):
+        """Start a session and return it, or return the one running.
+        Profiles are dumped to path, by default wavefront-<pid>-<time>.prof
+        in directory."""
+        if self.session is not None and not self.session.ready():
+            log.warning("Already profiling; %r" % self.session)
+            return self.session
+        if path is None:
+            path = os.path.join(self.directory, 'wavefront-%d-%s.prof' % (
+                    os.getpid(), strftime('%Y%m%dT%H%M%S')))
+        self.session = Session(self.seconds if seconds is None else seconds,
+                               path)
+        self.session.start()
+        return self.session
+
+    def install(self, signum):
+        """Start a session of the default length on signal signum."""
+        self.uninstall()
+        self._handler = gevent.signal(signum, self.start)
+
+    def uninstall(self):
+        if self._handler is not None:
+            self._handler.cancel()
+            self._handler = None
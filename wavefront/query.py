@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+Queries for bin sizes which aren't prebinned.
+
+A BinQuery bins raw samples on demand for any tbin, with the same reduction
+as the real time binners (cbinner.reduce_block), and caches the results in
+their own cache, the user specified binned data cache of the design; raw
+data never evicts them. The cache is any cache.CacheBackend; by default an
+in process LocalCache, or e.g. a MemcacheCache shared by several servers.
+
+Results are cached in chunks of chunkbins bins aligned to multiples of
+chunkbins * tbin, keyed by (srcname, tbin, chunk index), as packed BIN_DTYPE
+records. Overlapping and panned queries reuse cached chunks, all fetched in
+one get_multi, and only the missing ones are computed, each contiguous run
+of missing chunks from one read of raw data.
+"""
+
+from time import time
+
+import numpy as np
+
+import logging
+
+from wavefront.cache import LocalCache
+from wavefront.cbinner import reduce_block
+from wavefront.ctimebuf import BIN_DTYPE
+
+log = logging.getLogger(__name__)
+
+
+class BinQuery(object):
+    """Custom bin size query engine.
+
+    :param source: called as source(srcname, tstart, tend); returns an
+        iterable of (time, samples, samprate) blocks covering at least that
+        window, e.g. unstuffed from the orb packet cache
+    :param cache: a cache.CacheBackend for chunks; by default a LocalCache
+        of maxbytes. BinQuery doesn't serialize cache access; concurrent
+        queries rely on the backend being greenlet safe
+    :param chunkbins: bins per cached chunk
+    :param settle: chunks ending less than settle seconds ago aren't cached,
+        as late data may still arrive for them
+    """
+
+    def __init__(self, source, cache=None, maxbytes=64 << 20, chunkbins=256,
+                 settle=600):
+        self.source = source
+        self.chunkbins = chunkbins
+        self.settle = settle
+        if cache is None:
+            cache = LocalCache(maxbytes)
+        self.cache = cache
+
+    def _key(self, srcname, tbin, index):
+        return '%s:%r:%d:%d' % (srcname, tbin, self.chunkbins, index)
+
+    def _unpack(self, value):
+        if value is None or len(value) != self.chunkbins * BIN_DTYPE.itemsize:
+            return None
+        return np.frombuffer(value, BIN_DTYPE)
+
+    def query(self, srcname, tbin, tstart, tend):
+        """Return the bins of size tbin from tstart up to tend as a
+        structured array of BIN_DTYPE. Empty bins have nsamples == 0."""
+        first, last = self.chunk_range(tbin, tstart, tend)
+        chunks = self.cached_chunks(srcname, tbin, first, last)
+        n = 0
+        while n < len(chunks):
+            if chunks[n] is not None:
+                n += 1
+                continue
+            stop = n
+            while stop < len(chunks) and chunks[stop] is None:
+                stop += 1
+            chunks[n:stop] = self.compute(srcname, tbin, first + n,
+                                          first + stop)
+            n = stop
+        if not chunks:
+            return np.empty(0, BIN_DTYPE)
+        bins = np.concatenate(chunks)
+        base = first * self.chunkbins
+        return bins[int(np.floor(tstart / tbin)) - base:
+                    int(np.ceil(tend / tbin)) - base]
+
+    def chunk_range(self, tbin, tstart, tend):
+        """Return (first, last) index of the chunks covering tstart up to
+        tend."""
+        chunk = tbin * self.chunkbins
+        return int(np.floor(tstart / chunk)), int(np.ceil(tend / chunk))
+
+    def cached_chunks(self, srcname, tbin, first, last):
+        """Return the chunks first up to last from the cache, None for those
+        which aren't cached."""
+        keys = [self._key(srcname, tbin, index)
+                for index in xrange(first, last)]
+        cached = self.cache.get_multi(keys)
+        return [self._unpack(cached.get(key)) for key in keys]
+
+    def compute(self, srcname, tbin, first, last):
+        """Bin raw data for chunks first up to last; cache settled chunks
+        and return them all."""
+        chunk = tbin * self.chunkbins
+        base = first * self.chunkbins
+        size = (last - first) * self.chunkbins
+        maxes = np.empty(size)
+        maxes.fill(-np.inf)
+        mins = np.empty(size)
+        mins.fill(np.inf)
+        sums = np.zeros(size)
+        counts = np.zeros(size, np.int64)
+        sizes = np.ones(size)
+        log.debug("Binning %s %s chunks %d to %d" % (srcname, tbin, first,
+                                                     last))
+        for root_ts, samples, samprate in self.source(srcname, first * chunk,
+                                                      last * chunk):
+            if len(samples) == 0 or not samprate:
+                continue
+            binnums, run_times, rmaxes, rmins, rsums, rcounts = reduce_block(
+                    root_ts, samples, samprate, tbin)
+            index = binnums - base
+            keep = (index >= 0) & (index < size)
+            index = index[keep]
+            np.maximum.at(maxes, index, rmaxes[keep])
+            np.minimum.at(mins, index, rmins[keep])
+            np.add.at(sums, index, rsums[keep])
+            np.add.at(counts, index, rcounts[keep])
+            # Bin.mean is the sum over the expected number of samples
+            sizes[index] = int(tbin * samprate) or 1
+        filled = counts > 0
+        bins = np.empty(size, BIN_DTYPE)
+        bins['timestamp'] = np.where(filled, (base + np.arange(size)) * tbin,
+                                     np.nan)
+        bins['max'] = np.where(filled, maxes, np.nan)
+        bins['min'] = np.where(filled, mins, np.nan)
+        bins['mean'] = np.where(filled, sums / sizes, 0)
+        bins['nsamples'] = counts
+        settled = time() - self.settle
+        chunks = []
+        packed = {}
+        for index in xrange(first, last):
+            offset = (index - first) * self.chunkbins
+            chunks.append(bins[offset:offset + self.chunkbins])
+            if (index + 1) * chunk <= settled:
+                packed[self._key(srcname, tbin, index)] = \
+                        chunks[-1].tostring()
+        self.cache.set_multi(packed)
+        return chunks
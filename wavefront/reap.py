@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Batched reaping from an orbreap thread.
+
+Getting one packet per threadpool round trip costs a thread handoff and a
+hub switch per packet. A BatchReaper instead has its background thread pull
+up to batchsize packets, or whatever arrives within latency seconds of the
+first one, and hands the whole batch over in one transfer.
+
+Reaping from an orb requires the `ANTELOPE_PYTHON_GILRELEASE` environment
+variable to be set; see controller. Any packet source's reaper will do, see
+source; without Antelope, Timeout and NoData are defined here.
+"""
+
+from time import time
+
+from gevent.threadpool import ThreadPool, wrap_errors
+
+try:
+    from antelope.brttpkt import Timeout, NoData
+except ImportError:
+    # for packet sources other than the orb, e.g. replay.ReplaySource
+    class Timeout(Exception): pass
+    class NoData(Exception): pass
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class BatchReaper(object):
+    """Gets batches of packets from an OrbreapThr, or the reaper of any
+    packet source (see source), without blocking the hub.
+
+    The OrbreapThr should be opened with a timeout of about latency, as that
+    bounds how long get() waits for the next packet of a batch.
+
+    Example::
+
+        with OrbreapThr(orbname, timeout=latency) as orbreapthr:
+            with BatchReaper(orbreapthr, batchsize, latency) as reaper:
+                while True:
+                    for pktid, srcname, orbtime, raw in reaper.get():
+                        ...
+    """
+
+    def __init__(self, orbreapthr, batchsize=64, latency=0.1):
+        if batchsize < 1:
+            raise ValueError("batchsize must be at least 1")
+        self.orbreapthr = orbreapthr
+        self.batchsize = batchsize
+        self.latency = latency
+        self.threadpool = ThreadPool(maxsize=1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        # This blocks until all threads in the pool return. That's critical;
+        # if the orbreapthr dies before the get thread, segfaults ensue.
+        self.threadpool.kill()
+
+    def _reap(self):
+        """Runs in the pool thread."""
+        batch = []
+        deadline = None
+        while len(batch) < self.batchsize:
+            try:
+                value = self.orbreapthr.get()
+            except (Timeout, NoData), e:
+                log.debug("orbreapthr.get exception %r" % type(e))
+                if batch:
+                    break
+                return batch
+            if value is None:
+                raise Exception('Nothing to publish')
+            batch.append(value)
+            if deadline is None:
+                deadline = time() + self.latency
+            elif time() >= deadline:
+                break
+        return batch
+
+    def get(self):
+        """Return the next batch of (pktid, srcname, orbtime, raw packet)
+        tuples; empty if nothing arrived before the orbreapthr timed out."""
+        success, value = self.threadpool.spawn(
+                wrap_errors, (Exception,), self._reap, [], {}).get()
+        if not success:
+            raise value
+        return value
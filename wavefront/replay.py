@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""
+Recorded packet captures, and a packet source replaying them.
+
+A capture file is a stream of pickles, one (pktid, srcname, time, raw) tuple
+per packet, as reaped. raw is itself a pickle of the unstuffed channels,
+(net, sta, chan, loc, time, samprate, data) tuples with data a numpy array,
+so captures need no Antelope to replay and raw packets are still strings,
+e.g. for the packet cache.
+
+Record a capture from an orb with record(), or write one directly with a
+Recorder. A ReplaySource replays it at speed times real time, by packet
+time, or as fast as possible if speed is None; see source for the packet
+source interface.
+"""
+
+from cPickle import dump, dumps, load, loads, HIGHEST_PROTOCOL
+from time import time, sleep
+
+import numpy as np
+
+import logging
+
+from wavefront.reap import Timeout, NoData
+
+log = logging.getLogger(__name__)
+
+
+class ReplayChannel(object):
+    __slots__ = ('net', 'sta', 'chan', 'loc', 'time', 'samprate', 'data')
+
+    def __init__(self, net, sta, chan, loc, time, samprate, data):
+        self.net = net
+        self.sta = sta
+        self.chan = chan
+        self.loc = loc
+        self.time = time
+        self.samprate = samprate
+        self.data = data
+
+
+class ReplayPacket(object):
+    """Unstuffed replayed packet; quacks like an Antelope Pkt.Packet."""
+    __slots__ = ('srcname', 'time', 'channels')
+
+    def __init__(self, srcname, time, channels):
+        self.srcname = srcname
+        self.time = time
+        self.channels = channels
+
+
+def stuff(channels):
+    """Return raw packet contents for (net, sta, chan, loc, time, samprate,
+    data) tuples, or objects with those attributes, e.g. Packet channels."""
+    return dumps([channel if isinstance(channel, tuple) else
+                  (channel.net, channel.sta, channel.chan, channel.loc,
+                   channel.time, channel.samprate, np.asarray(channel.data))
+                  for channel in channels], HIGHEST_PROTOCOL)
+
+
+def unstuff(srcname, time, raw):
+    return ReplayPacket(srcname, time,
+                        [ReplayChannel(*channel) for channel in loads(raw)])
+
+
+class Recorder(object):
+    """Writes a capture file.
+
+    Example::
+
+        with Recorder(path) as recorder:
+            recorder.add(pktid, srcname, time, channels)
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.npkts = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def add(self, pktid, srcname, time, channels):
+        """Add a packet given its channels; see stuff()."""
+        self.add_raw((pktid, srcname, time, stuff(channels)))
+
+    def add_raw(self, value):
+        """Add a reaped (pktid, srcname, time, raw) tuple of a capture."""
+        dump(value, self.file, HIGHEST_PROTOCOL)
+        self.npkts += 1
+
+
+def record(source, path, npkts, after=None, timeout=1.0):
+    """Record npkts packets from a packet source, e.g. a source.OrbSource,
+    to a capture file at path. Return the number recorded."""
+    with Recorder(path) as recorder:
+        with source.open(timeout, after) as reaper:
+            while recorder.npkts < npkts:
+                try:
+                    pktid, srcname, time, raw = reaper.get()
+                except Timeout:
+                    continue
+                packet = source.unstuff(srcname, time, raw)
+                recorder.add(pktid, srcname, time, packet.channels)
+        return recorder.npkts
+
+
+def read(path):
+    """Generate the (pktid, srcname, time, raw) tuples of a capture."""
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield load(f)
+            except EOFError:
+                return
+
+
+class Replay(object):
+    """Reaper over a capture; see ReplaySource.open."""
+
+    def __init__(self, path, speed, timeout, after=None, loop=False):
+        self.path = path
+        self.speed = speed
+        self.timeout = timeout
+        self.after = after
+        self.loop = loop
+        self.npkts = 0
+        self.exhausted = False
+        self._values = self._read()
+        # read but not due yet
+        self._pending = None
+        # (wall clock, packet time) replay started at
+        self._start = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._values.close()
+
+    def _read(self):
+        while True:
+            for value in read(self.path):
+                if self.after is None or value[2] > self.after:
+                    yield value
+            if not self.loop:
+                return
+            # timestamps start over
+            self._start = None
+
+    def get(self):
+        """Return the next packet when it's due, or raise Timeout if it
+        isn't due within timeout, or NoData at the end of the capture."""
+        if self.exhausted:
+            sleep(self.timeout)
+            raise NoData()
+        value, self._pending = self._pending, None
+        if value is None:
+            try:
+                value = next(self._values)
+            except StopIteration:
+                self.exhausted = True
+                log.info("Replayed %d packets of %s" % (self.npkts,
+                                                        self.path))
+                raise NoData()
+        if self.speed is not None:
+            now = time()
+            if self._start is None:
+                self._start = now, value[2]
+            wait = (value[2] - self._start[1]) / self.speed - \
+                    (now - self._start[0])
+            if wait > self.timeout:
+                self._pending = value
+                sleep(self.timeout)
+                raise Timeout()
+            if wait > 0:
+                sleep(wait)
+        self.npkts += 1
+        return value
+
+
+class ReplaySource(object):
+    """Packet source replaying a capture file.
+
+    :param speed: replay rate relative to real time, by packet time; None
+        for as fast as possible
+    :param loop: start over at the end of the capture, rather than raising
+        NoData
+    """
+
+    def __init__(self, path, speed=1.0, loop=False):
+        if speed is not None and speed <= 0:
+            raise ValueError("speed must be positive, or None")
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.replay = None
+
+    def __repr__(self):
+        return "<ReplaySource %s at %sx>" % (self.path, self.speed or 'max')
+
+    def open(self, timeout, after=None):
+        self.replay = Replay(self.path, self.speed, timeout, after, self.loop)
+        return self.replay
+
+    def unstuff(self, srcname, time, raw):
+        return unstuff(srcname, time, raw)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+Ingest sharded across worker processes.
+
+A ShardPool runs one worker process per shard. Each worker owns a
+BinController holding its shard of the srcnames. Items are routed by a
+hash of their srcname, so every srcname always lands on the same worker
+and is binned in the order it was dispatched. Nothing else crosses
+process boundaries: a worker's bins are served from its own shared
+buffers, see shmbuf.
+
+Packet counts are kept per shard in shared memory; see ShardPool.stats().
+"""
+
+import multiprocessing
+import time
+import zlib
+from multiprocessing.sharedctypes import RawArray
+from Queue import Full
+
+from gevent import sleep, get_hub
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def shard_of(srcname, nshards):
+    """Return the shard of srcname; stable across processes and runs."""
+    return (zlib.crc32(srcname) & 0xffffffff) % nshards
+
+
+def _work(index, queue, counts, controller_factory, process):
+    controller = controller_factory(index)
+    while True:
+        item = queue.get()
+        if item is None:
+            break
+        try:
+            process(controller, item)
+        except Exception:
+            log.error("shard %d failed to process %r" % (index, item[:2]),
+                      exc_info=True)
+        counts[index] += 1
+
+
+class ShardPool(object):
+    """Worker processes, each binning one shard of the srcnames.
+
+    :param controller_factory: called in the worker with the shard index;
+        returns that shard's configured BinController
+    :param process: called in the worker as process(controller, item) for
+        every dispatched item
+    :param queuesize: items queued per worker before dispatch waits
+    """
+
+    def __init__(self, nshards, controller_factory, process, queuesize=1024):
+        if nshards < 1:
+            raise ValueError("nshards must be at least 1")
+        self.nshards = nshards
+        self.controller_factory = controller_factory
+        self.process = process
+        self.queues = [multiprocessing.Queue(queuesize) for n in xrange(nshards)]
+        self.counts = RawArray('L', nshards)
+        self.workers = []
+        self._last = time.time(), [0] * nshards
+
+    def start(self):
+        for index, queue in enumerate(self.queues):
+            worker = multiprocessing.Process(
+                    target=_work, name='shard-%d' % index,
+                    args=(index, queue, self.counts, self.controller_factory,
+                          self.process))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        log.info("Started %d shard workers" % self.nshards)
+
+    def dispatch(self, srcname, item):
+        """Queue item for the worker owning srcname. Waits, letting other
+        greenlets run, while that worker's queue is full."""
+        queue = self.queues[shard_of(srcname, self.nshards)]
+        while True:
+            try:
+                queue.put_nowait(item)
+                return
+            except Full:
+                sleep(0.01)
+
+    def stop(self, timeout=10):
+        """Let workers finish what's queued, then stop them. Waits for room
+        in full queues in the hub threadpool, so other greenlets run."""
+        threadpool = get_hub().threadpool
+        for queue in self.queues:
+            try:
+                threadpool.apply(queue.put, (None, True, timeout))
+            except Full:
+                pass
+        for worker in self.workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                log.warning("Terminating %s" % worker.name)
+                worker.terminate()
+        self.workers = []
+
+    def dead(self):
+        """Return the names of workers which have exited."""
+        return [worker.name for worker in self.workers if not worker.is_alive()]
+
+    def stats(self):
+        """Return a list of per shard dicts: shard, pkts, pkts_per_sec since
+        the previous call, and queued."""
+        now = time.time()
+        counts = list(self.counts)
+        then, last = self._last
+        self._last = now, counts
+        elapsed = max(now - then, 1e-9)
+        stats = []
+        for index, queue in enumerate(self.queues):
+            try:
+                queued = queue.qsize()
+            except NotImplementedError:
+                queued = None
+            stats.append(dict(shard=index, pkts=counts[index],
+                              pkts_per_sec=(counts[index] - last[index]) / elapsed,
+                              queued=queued))
+        return stats
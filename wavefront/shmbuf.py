@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+"""
+Prebinned buffers in a shared memory-mapped file.
+
+One ingest process writes with a SharedBinStore; any number of server
+processes read the same file with SharedBinReader, so queries and streams
+can be served on other cores without reaping or binning anything.
+
+The file has a fixed size and a fixed layout::
+
+    header      HEADER_DTYPE; magic, version, capacity, nentries, end
+    directory   capacity x DIR_DTYPE; srcname, twin, tbin, size, offset
+    regions     page aligned; one per buffer at its offset:
+                control     CONTROL_DTYPE; seq, head_num
+                columns     each ctimebuf.COLUMNS array in turn
+
+A directory entry is written completely before nentries is bumped, so
+readers never see half an entry.
+
+Each region is guarded by a seqlock. The writer makes seq odd before
+touching the buffer and even again after storing head_num; a reader copies
+what it needs and retries if seq was odd or changed meanwhile, giving up
+with SharedBufferError after a timeout, e.g. if the writer died mid-update.
+Readers never block the writer. Comparing seq between polls also tells a reader which
+channels changed, see SharedBinReader.generations().
+
+The writer builds a new file under a temporary name and renames it into
+place, so readers mapping an earlier file keep reading that one, and never
+see a file half set up.
+
+Like the rest of the system this assumes one writer; stores are ordered as
+issued, which holds on x86.
+"""
+
+import os
+from time import time
+
+import numpy as np
+
+from gevent import sleep
+
+import logging
+
+from wavefront.ctimebuf import BinBuffer, COLUMNS, BIN_DTYPE
+
+log = logging.getLogger(__name__)
+
+
+MAGIC = 'WFSHM1'
+VERSION = 1
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('capacity', '<u4'),
+    ('nentries', '<u4'),
+    ('pad', '<u4'),
+    ('end', '<u8'),
+])
+
+DIR_DTYPE = np.dtype([
+    ('srcname', 'S64'),
+    ('twin', '<f8'),
+    ('tbin', '<f8'),
+    ('size', '<i8'),
+    ('offset', '<i8'),
+])
+
+CONTROL_DTYPE = np.dtype([
+    ('seq', '<u8'),
+    ('head_num', '<i8'),
+    ('pad', '<u8', 6),
+])
+
+PAGE = 4096
+
+
+class SharedBufferError(Exception): pass
+
+
+def _align(n, alignment=64):
+    return (n + alignment - 1) // alignment * alignment
+
+
+def _data_start(capacity):
+    return _align(HEADER_DTYPE.itemsize + capacity * DIR_DTYPE.itemsize, PAGE)
+
+
+def _directory(mapped, capacity):
+    start = HEADER_DTYPE.itemsize
+    return mapped[start:start + capacity * DIR_DTYPE.itemsize].view(DIR_DTYPE)
+
+
+def region_size(size):
+    """Bytes needed for a buffer of size slots."""
+    return CONTROL_DTYPE.itemsize + sum(
+            _align(size * np.dtype(dtype).itemsize) for name, dtype in COLUMNS)
+
+
+def _columns(mapped, offset, size):
+    """Return (control record, column arrays) of the region at offset."""
+    control = mapped[offset:offset + CONTROL_DTYPE.itemsize].view(CONTROL_DTYPE)
+    offset += CONTROL_DTYPE.itemsize
+    columns = []
+    for name, dtype in COLUMNS:
+        nbytes = size * np.dtype(dtype).itemsize
+        columns.append(mapped[offset:offset + nbytes].view(dtype))
+        offset += _align(nbytes)
+    return control, columns
+
+
+class SharedBinBuffer(BinBuffer):
+    """A BinBuffer whose columns live in a SharedBinStore region.
+
+    Writers must bracket changes with begin() and commit().
+    """
+
+    def __init__(self, size, head_time, element_time, control, columns):
+        # not shared until the region is bound
+        self.control = None
+        BinBuffer.__init__(self, size, head_time, element_time)
+        BinBuffer.bind(self, self.head_num, *columns)
+        self.control = control
+        control['head_num'] = self.head_num
+
+    def bind(self, head_num, *columns):
+        """Copy columns, e.g. from a snapshot, into shared memory."""
+        if self.control is None:
+            return BinBuffer.bind(self, head_num, *columns)
+        if len(columns) != len(COLUMNS):
+            raise ValueError("Expected %d columns" % len(COLUMNS))
+        self.begin()
+        for (name, dtype), column in zip(COLUMNS, columns):
+            getattr(self, name)[:] = column
+        self.head_num = head_num
+        self.commit()
+
+    def begin(self):
+        self.control['seq'] += 1
+
+    def commit(self):
+        self.control['head_num'] = self.head_num
+        self.control['seq'] += 1
+
+
+class SharedBinStore(object):
+    """Writer side; creates the file and hands out SharedBinBuffers.
+
+    :param nbytes: file size; fixed, so it must fit every buffer
+    :param capacity: maximum number of buffers
+    """
+
+    def __init__(self, path, nbytes, capacity=8192):
+        self.path = path
+        start = _data_start(capacity)
+        if nbytes < start:
+            raise SharedBufferError("%d bytes is too small" % nbytes)
+        # never truncate a file readers may have mapped
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.truncate(nbytes)
+        try:
+            self._mapped = np.memmap(tmp, np.uint8, 'r+')
+            self.header = self._mapped[:HEADER_DTYPE.itemsize].view(
+                    HEADER_DTYPE)
+            self.directory = _directory(self._mapped, capacity)
+            self.header['magic'] = MAGIC
+            self.header['version'] = VERSION
+            self.header['capacity'] = capacity
+            self.header['nentries'] = 0
+            self.header['end'] = start
+            os.rename(tmp, path)
+        except:
+            os.unlink(tmp)
+            raise
+
+    def __repr__(self):
+        return "<SharedBinStore %s: %d buffers>" % (self.path,
+                                                    self.header['nentries'])
+
+    def buffer(self, srcname, twin, tbin):
+        """Allocate a region and return a SharedBinBuffer for it."""
+        size = int(twin / tbin)
+        n = int(self.header['nentries'])
+        if n >= len(self.directory):
+            raise SharedBufferError("Directory full")
+        offset = int(self.header['end'])
+        end = offset + region_size(size)
+        if end > len(self._mapped):
+            raise SharedBufferError("%s full" % self.path)
+        if len(srcname) > DIR_DTYPE['srcname'].itemsize:
+            raise SharedBufferError("srcname %s too long" % srcname)
+        control, columns = _columns(self._mapped, offset, size)
+        for column, (name, dtype) in zip(columns, COLUMNS):
+            column[:] = np.nan if name in ('timestamps', 'maxes', 'mins') else 0
+        buf = SharedBinBuffer(size, 0, tbin, control, columns)
+        self.directory[n] = (srcname, twin, tbin, size, offset)
+        self.header['end'] = end
+        # publish the entry last
+        self.header['nentries'] = n + 1
+        return buf
+
+    def flush(self):
+        self._mapped.flush()
+
+
+class SharedBinReader(object):
+    """Read only view of a SharedBinStore file, for server processes.
+
+    :param timeout: seconds to retry reading a buffer the writer is updating
+        before giving up
+    """
+
+    def __init__(self, path, timeout=1.0):
+        self.path = path
+        self.timeout = timeout
+        self._mapped = np.memmap(path, np.uint8, 'r')
+        self.header = self._mapped[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)
+        if self.header['magic'][0] != MAGIC:
+            raise SharedBufferError("%s is not a shared bin store" % path)
+        capacity = int(self.header['capacity'])
+        self.directory = _directory(self._mapped, capacity)
+        self._nentries = 0
+        # (srcname, tbin) -> [(twin, size, element_time, control, columns)]
+        self._entries = dict()
+        self._controls = []
+        self.refresh()
+
+    def refresh(self):
+        """Pick up buffers the writer has added since the last call."""
+        n = int(self.header['nentries'])
+        for entry in self.directory[self._nentries:n]:
+            srcname, twin, tbin, size, offset = entry.tolist()
+            control, columns = _columns(self._mapped, offset, size)
+            self._entries.setdefault((srcname, tbin), []).append(
+                    (twin, size, tbin, control, columns))
+            self._controls.append(((srcname, tbin), control))
+        self._nentries = n
+
+    def srcnames(self):
+        self.refresh()
+        return sorted(set(srcname for srcname, tbin in self._entries))
+
+    def generations(self):
+        """Return {(srcname, tbin): seq}; compare with an earlier result to
+        find the channels which changed."""
+        self.refresh()
+        return dict((key, int(control['seq'][0]))
+                    for key, control in self._controls)
+
+    def get_range(self, srcname, tbin, start=None, stop=None):
+        """Return a consistent copy of the bins from start up to stop, as a
+        structured array of BIN_DTYPE, or None if there's no such buffer.
+        Same semantics as BinBuffer.get_range. Raises SharedBufferError if
+        no consistent copy could be made within timeout."""
+        entries = self._entries.get((srcname, tbin))
+        if entries is None:
+            self.refresh()
+            entries = self._entries.get((srcname, tbin))
+            if entries is None:
+                return None
+        twin, size, element_time, control, columns = max(entries)
+        deadline = time() + self.timeout
+        while True:
+            seq = int(control['seq'][0])
+            if not seq % 2:
+                result = self._copy(int(control['head_num'][0]), size,
+                                    element_time, columns, start, stop)
+                if int(control['seq'][0]) == seq:
+                    return result
+            if time() > deadline:
+                raise SharedBufferError(
+                        "%s %s in %s stuck mid-update; writer died?" %
+                        (srcname, tbin, self.path))
+            sleep(0)
+
+    def _copy(self, head_num, size, element_time, columns, start, stop):
+        tail_num = head_num - size
+        start = tail_num if start is None else int(start / element_time)
+        stop = head_num if stop is None else int(stop / element_time)
+        start, stop = max(start, tail_num), min(stop, head_num)
+        result = np.empty(max(stop - start, 0), BIN_DTYPE)
+        if stop <= start:
+            return result
+        slots = np.arange(start, stop) % size
+        timestamps, maxes, mins, means, nsamples, sizes = columns
+        result['timestamp'] = timestamps[slots]
+        result['max'] = maxes[slots]
+        result['min'] = mins[slots]
+        result['mean'] = means[slots]
+        result['nsamples'] = nsamples[slots]
+        return result
+
+    def query(self, srcnames, tbin, tstart=None, tend=None):
+        """Same as BinController.query, from shared memory."""
+        if isinstance(srcnames, basestring):
+            srcnames = [srcnames]
+        result = {}
+        for srcname in srcnames:
+            bins = self.get_range(srcname, tbin, tstart, tend)
+            if bins is not None:
+                result[srcname] = bins
+        return result
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""
+Snapshots of prebinned buffers, to avoid replaying the orb on restart.
+
+A snapshot file holds every BinBuffer of a BinController plus the pktid and
+orb time of the last packet binned::
+
+    MAGIC               8 bytes
+    header length       uint32, little-endian
+    header              JSON; pktid, orbtime and one entry per buffer
+    padding             to a multiple of 8 bytes
+    columns             per buffer, each ctimebuf.COLUMNS array in turn
+
+Loading maps the columns copy-on-write with numpy.memmap, so it takes about
+the same time however big the buffers are; pages are read in as they are
+touched and changes never reach the file.
+
+Snapshots are written to a temporary file which is then renamed over the
+old one, so a crash while saving leaves the previous snapshot intact. The
+buffers are copied first and may be written from a thread pool, so saving
+doesn't stall other greenlets; see save().
+"""
+
+import json
+import os
+import struct
+
+import numpy as np
+
+import logging
+
+from wavefront.ctimebuf import BinBuffer, COLUMNS
+
+log = logging.getLogger(__name__)
+
+
+MAGIC = 'WFSNAP1\n'
+
+LENGTH = struct.Struct('<I')
+
+
+class SnapshotError(Exception): pass
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def save(controller, path, pktid=None, orbtime=None, threadpool=None):
+    """Write all BinBuffers of controller to path. Return the number of
+    buffers written.
+
+    The buffers are copied on the calling greenlet, without yielding, so
+    the snapshot is consistent. Given a threadpool, e.g.
+    gevent.get_hub().threadpool, the copies are then written and synced in
+    it while other greenlets run on; the copies take as much memory as the
+    buffers until then.
+    """
+    header, columns = _capture(controller, pktid, orbtime)
+    if threadpool is None:
+        _write(path, header, columns)
+    else:
+        threadpool.apply(_write, (path, header, columns))
+    return len(columns)
+
+
+def _capture(controller, pktid, orbtime):
+    """Return the header and, per buffer, a list of copies of its columns
+    as padded strings."""
+    entries = []
+    stores = []
+    offset = 0
+    for srcname in sorted(controller.binners):
+        for binner in controller.iter_binners(srcname):
+            store = binner.store
+            if not isinstance(store, BinBuffer):
+                log.warning("Can't snapshot %r of %s" % (store, srcname))
+                continue
+            entries.append(dict(srcname=srcname, twin=binner.twin,
+                                tbin=binner.tbin, size=store.size,
+                                head_num=store.head_num, offset=offset))
+            stores.append(store)
+            offset += sum(_align(store.size * np.dtype(dtype).itemsize)
+                          for name, dtype in COLUMNS)
+    header = json.dumps(dict(pktid=pktid, orbtime=orbtime, buffers=entries))
+    columns = []
+    for store in stores:
+        copies = []
+        for name, dtype in COLUMNS:
+            data = np.ascontiguousarray(getattr(store, name), dtype)
+            copies.append(data.tostring() +
+                          '\0' * (_align(data.nbytes) - data.nbytes))
+        columns.append(copies)
+    return header, columns
+
+
+def _write(path, header, columns):
+    """Write a captured snapshot; touches no buffers, so it may run in a
+    thread."""
+    start = _align(len(MAGIC) + LENGTH.size + len(header))
+    tmppath = path + '.tmp'
+    with open(tmppath, 'wb') as f:
+        f.write(MAGIC)
+        f.write(LENGTH.pack(len(header)))
+        f.write(header)
+        f.write('\0' * (start - f.tell()))
+        for copies in columns:
+            for data in copies:
+                f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmppath, path)
+
+
+def read_header(path):
+    """Return (header dict, byte offset of the first column)."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise SnapshotError("%s is not a snapshot" % path)
+        try:
+            length, = LENGTH.unpack(f.read(LENGTH.size))
+        except struct.error, e:
+            raise SnapshotError("Truncated snapshot %s: %s" % (path, e))
+        header = json.loads(f.read(length))
+    return header, _align(len(MAGIC) + LENGTH.size + length)
+
+
+def load(controller, path):
+    """Restore the buffers in the snapshot at path into controller.
+
+    Binners are created through the controller's patterns, so only buffers
+    which are still configured, with the same size, are restored. Return
+    (pktid, orbtime) of the last packet binned before the snapshot.
+    """
+    header, start = read_header(path)
+    # one mapping for the whole file; columns are views into it
+    mapped = np.memmap(path, np.uint8, 'c')
+    restored = 0
+    for entry in header['buffers']:
+        srcname = entry['srcname']
+        controller.get_binners(srcname)
+        binner = controller.get_binner(srcname, entry['twin'], entry['tbin'])
+        if binner is None or not isinstance(binner.store, BinBuffer) or \
+                binner.store.size != entry['size']:
+            log.info("Not restoring %s %s %s" % (srcname, entry['twin'],
+                                                 entry['tbin']))
+            continue
+        offset = start + entry['offset']
+        columns = []
+        for name, dtype in COLUMNS:
+            nbytes = entry['size'] * np.dtype(dtype).itemsize
+            columns.append(mapped[offset:offset + nbytes].view(dtype))
+            offset += _align(nbytes)
+        binner.store.bind(entry['head_num'], *columns)
+        restored += 1
+    log.info("Restored %d of %d buffers from %s" % (restored,
+                                                   len(header['buffers']), path))
+    return header['pktid'], header['orbtime']
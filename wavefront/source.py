@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Packet sources for the reap loop.
+
+A packet source opens reapers and unstuffs the raw packets they return:
+
+``open(timeout, after=None)``
+    Return a context manager with a ``get()`` method, like an OrbreapThr;
+    get() returns (pktid, srcname, time, raw) tuples, or raises reap.Timeout
+    if nothing arrived within timeout seconds, or reap.NoData. after skips
+    packets up to that time.
+``unstuff(srcname, time, raw)``
+    Return the packet as an object with ``time`` and ``channels``, like an
+    Antelope Pkt.Packet; channels have net, sta, chan, loc, time, samprate
+    and data.
+
+OrbSource reads an Antelope orb. replay.ReplaySource replays a recorded
+capture, so the reap loop can run without Antelope or an orb.
+"""
+
+import os
+
+
+class GilReleaseNotSetError(Exception): pass
+
+
+class OrbSource(object):
+    """Packets from an Antelope orb, through an OrbreapThr.
+
+    Correct use of this class requires the `ANTELOPE_PYTHON_GILRELEASE`
+    environment variable to be set; see controller.
+    """
+
+    def __init__(self, orbname, select=None, reject=None, queuesize=8):
+        if 'ANTELOPE_PYTHON_GILRELEASE' not in os.environ:
+            raise GilReleaseNotSetError(
+                    "ANTELOPE_PYTHON_GILRELEASE not in environment")
+        self.orbname = orbname
+        self.select = select
+        self.reject = reject
+        self.queuesize = queuesize
+
+    def __repr__(self):
+        return "<OrbSource %s %s %s>" % (self.orbname, self.select,
+                                         self.reject)
+
+    def open(self, timeout, after=None):
+        from antelope.brttpkt import OrbreapThr
+        kwargs = dict(timeout=timeout, queuesize=self.queuesize)
+        if after is not None:
+            kwargs['after'] = after
+        return OrbreapThr(self.orbname, self.select, self.reject, **kwargs)
+
+    def unstuff(self, srcname, time, raw):
+        from antelope.Pkt import Packet
+        return Packet(srcname, time, raw)
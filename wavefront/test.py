@@ -1,5 +1,9 @@
 #!/usr/bin/env python
 
+import os
+import shutil
+import tempfile
+import time
 from types import MethodType
 
 from nose.tools import *
@@ -10,7 +14,13 @@ import gevent
 
 from antelope import brttpkt
 
-from wavefront.controller import Orb
+from wavefront.controller import Orb, BinController, SharedBinController
+from wavefront.ctimebuf import TimeBuffer, BinBuffer
+from wavefront import snapshot
+from wavefront.shmbuf import SharedBinReader
+from wavefront.reap import BatchReaper
+from wavefront.monitor import Monitor, Window
+from wavefront import wire
 
 class Dummy(object): pass
 
@@ -65,6 +75,168 @@ def test_app():
 
     ok_(app.successful())
 
+def test_query():
+    for timebuf_class in TimeBuffer, BinBuffer:
+        controller = BinController(timebuf_class)
+        controller.add_binner('NET_STA_CHAN', twin=20.0, tbin=5.0)
+        controller.add_binner('NET_STA_CHAN', twin=10.0, tbin=5.0)
+        controller.update('NET_STA_CHAN', 0, range(20), 1)
+        result = controller.query(['NET_STA_CHAN', 'NET_STA_NONE'], 5.0, 5, 15)
+        eq_(result.keys(), ['NET_STA_CHAN'])
+        bins = result['NET_STA_CHAN']
+        eq_(list(bins['timestamp']), [5.0, 10.0])
+        eq_(list(bins['max']), [9.0, 14.0])
+        eq_(list(bins['nsamples']), [5, 5])
+        eq_(len(controller.query('NET_STA_CHAN', 5.0)['NET_STA_CHAN']), 4)
+        eq_(controller.query('NET_STA_CHAN', 1.0), {})
+
+def test_patterns():
+    controller = BinController()
+    controller.add_binner('NET_STA_BH[ZNE]', twin=20.0, tbin=5.0)
+    controller.add_binner('NET_.*', twin=60.0, tbin=10.0)
+    eq_(controller.binners, {})
+    controller.update('NET_STA_BHZ', 0, range(20), 1)
+    controller.update('NET_STA_LHZ', 0, range(20), 1)
+    controller.update('XX_STA_BHZ', 0, range(20), 1)
+    eq_(sorted((b.twin, b.tbin) for b in controller.binners['NET_STA_BHZ']),
+        [(20.0, 5.0), (60.0, 10.0)])
+    eq_([(b.twin, b.tbin) for b in controller.binners['NET_STA_LHZ']],
+        [(60.0, 10.0)])
+    eq_(controller.binners['XX_STA_BHZ'], set())
+    eq_(list(controller.query('NET_STA_BHZ', 5.0)['NET_STA_BHZ']['max']),
+        [4.0, 9.0, 14.0, 19.0])
+    # new patterns apply to srcnames already seen
+    controller.add_binner('XX_STA_BHZ', twin=20.0, tbin=5.0)
+    ok_(controller.get_binner('XX_STA_BHZ', 20.0, 5.0) is not None)
+
+def test_pyramid():
+    controller = BinController()
+    controller.add_pyramid('NET_.*', twin=[80.0, 20.0, 40.0],
+                           tbins=[8.0, 2.0, 4.0])
+    assert_raises(ValueError, controller.add_pyramid, 'X', 10.0, [2.0, 3.0])
+    controller.update('NET_STA_CHAN', 0, range(20), 1)
+    eq_(len(controller.binners['NET_STA_CHAN']), 1)
+    eq_(sorted((b.twin, b.tbin)
+               for b in controller.iter_binners('NET_STA_CHAN')),
+        [(20.0, 2.0), (40.0, 4.0), (80.0, 8.0)])
+    bins = controller.query('NET_STA_CHAN', 8.0)['NET_STA_CHAN']
+    eq_(list(bins['max'][-3:]), [7.0, 15.0, 19.0])
+    eq_(list(bins['nsamples'][-3:]), [8, 8, 4])
+
+def test_snapshot():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'snapshot')
+        controller = BinController()
+        controller.add_pyramid('NET_.*', twin=40.0, tbins=[2.0, 4.0])
+        controller.update('NET_STA_BHZ', 0, range(20), 1)
+        controller.update('NET_STA_BHN', 4, range(20), 2)
+        eq_(snapshot.save(controller, path, pktid=42, orbtime=1234.5), 4)
+
+        restored = BinController()
+        restored.add_pyramid('NET_.*', twin=40.0, tbins=[2.0, 4.0])
+        eq_(snapshot.load(restored, path), (42, 1234.5))
+        for srcname in 'NET_STA_BHZ', 'NET_STA_BHN':
+            for tbin in 2.0, 4.0:
+                before = controller.query(srcname, tbin)[srcname]
+                after = restored.query(srcname, tbin)[srcname]
+                eq_(before.tostring(), after.tostring())
+                eq_(controller.get_binner(srcname, 40.0, tbin).store.head_num,
+                    restored.get_binner(srcname, 40.0, tbin).store.head_num)
+        # restored buffers keep binning; copy-on-write leaves the file alone
+        restored.update('NET_STA_BHZ', 20, range(20), 1)
+        eq_(restored.query('NET_STA_BHZ', 2.0)['NET_STA_BHZ']['max'][-1], 19)
+        eq_(snapshot.load(BinController(), path), (42, 1234.5))
+        assert_raises(snapshot.SnapshotError, snapshot.load, controller, __file__)
+
+        # written in a thread pool from copies; binning on meanwhile doesn't
+        # reach the snapshot
+        class Pool(object):
+            def apply(self, func, args):
+                controller.update('NET_STA_BHZ', 20, range(20), 1)
+                return gevent.get_hub().threadpool.apply(func, args)
+        before = controller.query('NET_STA_BHZ', 2.0)['NET_STA_BHZ']
+        eq_(snapshot.save(controller, path, threadpool=Pool()), 4)
+        restored = BinController()
+        restored.add_pyramid('NET_.*', twin=40.0, tbins=[2.0, 4.0])
+        eq_(snapshot.load(restored, path), (None, None))
+        eq_(restored.query('NET_STA_BHZ', 2.0)['NET_STA_BHZ'].tostring(),
+            before.tostring())
+        ok_(before.tostring() !=
+            controller.query('NET_STA_BHZ', 2.0)['NET_STA_BHZ'].tostring())
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_shared():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'bins')
+        controller = SharedBinController(path, 1 << 20)
+        controller.add_pyramid('NET_.*', twin=40.0, tbins=[2.0, 4.0])
+        reader = SharedBinReader(path)
+        controller.update('NET_STA_BHZ', 0, range(20), 1)
+        eq_(reader.srcnames(), ['NET_STA_BHZ'])
+        for tbin in 2.0, 4.0:
+            eq_(reader.query('NET_STA_BHZ', tbin)['NET_STA_BHZ'].tostring(),
+                controller.query('NET_STA_BHZ', tbin)['NET_STA_BHZ'].tostring())
+        ok_(all(seq == 2 for seq in reader.generations().values()))
+        # snapshots restore into shared memory
+        snapshot_path = os.path.join(tmpdir, 'snapshot')
+        snapshot.save(controller, snapshot_path)
+        restored = SharedBinController(os.path.join(tmpdir, 'bins2'), 1 << 20)
+        restored.add_pyramid('NET_.*', twin=40.0, tbins=[2.0, 4.0])
+        snapshot.load(restored, snapshot_path)
+        eq_(SharedBinReader(os.path.join(tmpdir, 'bins2')).query(
+                'NET_STA_BHZ', 4.0)['NET_STA_BHZ'].tostring(),
+            controller.query('NET_STA_BHZ', 4.0)['NET_STA_BHZ'].tostring())
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_monitor():
+    controller = BinController()
+    controller.add_pyramid('NET_.*', twin=40.0, tbins=[2.0, 4.0])
+    controller.update('NET_STA_BHZ', 0, range(10), 1)
+    monitor = Monitor(2.0, Window(4, 16), accept='NET_STA_.*')
+    controller.monitor(monitor, history=True)
+    srcname, tbin, flags, bins = wire.decode(monitor.get_nowait())
+    eq_(list(bins['timestamp']), [4.0, 6.0, 8.0])
+    controller.update('NET_STA_BHZ', 10, range(20), 1)
+    srcname, tbin, flags, bins = wire.decode(monitor.get_nowait())
+    eq_((srcname, tbin), ('NET_STA_BHZ', 2.0))
+    eq_(list(bins['timestamp']), [10.0, 12.0, 14.0])
+    ok_(monitor.empty())
+    other = Monitor(2.0, Window(duration=60))
+    controller.monitor(other)
+    controller.unmonitor(monitor)
+    controller.update('NET_STA_BHZ', 30, range(4), 1)
+    ok_(monitor.empty())
+    hubs = [b.hub for b in controller.iter_binners('NET_STA_BHZ')]
+    eq_([hub._folding for hub in hubs if hub.key[1] == 2.0], [1])
+    # no monitors left; hubs stop building records for the index
+    controller.unmonitor(other)
+    eq_([hub._folding for hub in hubs], [0, 0])
+
+class FakeReapThr(object):
+    def __init__(self, values, delay=0):
+        self.values = list(values)
+        self.delay = delay
+
+    def get(self):
+        if not self.values:
+            raise brttpkt.Timeout()
+        time.sleep(self.delay)
+        return self.values.pop(0)
+
+def test_batch_reaper():
+    with BatchReaper(FakeReapThr(range(5)), batchsize=2) as reaper:
+        eq_([reaper.get() for n in xrange(4)], [[0, 1], [2, 3], [4], []])
+    # latency caps the wait once a batch has started
+    with BatchReaper(FakeReapThr(range(4), delay=0.02), batchsize=64,
+                     latency=0.01) as reaper:
+        eq_(reaper.get(), [0, 1])
+    with BatchReaper(FakeReapThr([None])) as reaper:
+        assert_raises(Exception, reaper.get)
+
 if __name__ == '__main__':
     test_app()
 
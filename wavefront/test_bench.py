@@ -0,0 +1,46 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from wavefront import bench
+
+
+class Test_Workload(TestCase):
+    def test_repeatable(self):
+        a = bench.Workload(4, 10.0, 1.0, 20.0, gaps=0.1, late=0.1, dups=0.1)
+        b = bench.Workload(4, 10.0, 1.0, 20.0, gaps=0.1, late=0.1, dups=0.1)
+        self.assertEquals([p[:3] for p in a.packets], [p[:3] for p in b.packets])
+
+    def test_disorder(self):
+        workload = bench.Workload(4, 10.0, 1.0, 50.0, gaps=0.1, late=0.1,
+                                  dups=0.1, latency=5)
+        pktids = [p[0] for p in workload.packets]
+        self.assertTrue(len(set(pktids)) < 200)
+        self.assertTrue(len(pktids) > len(set(pktids)))
+        self.assertNotEqual(pktids, sorted(pktids))
+        self.assertEquals(workload.nsamples, len(pktids) * 10)
+
+
+class Test_Bench(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_main(self):
+        path = os.path.join(self.tmpdir, 'results.json')
+        bench.main(['--channels', '2', '--duration', '10', '--late', '0.1',
+                    '--json', path])
+        with open(path) as f:
+            results = json.load(f)
+        self.assertEquals(results['workload']['nchannels'], 2)
+        self.assertEquals([r['layer'] for r in results['results']],
+                          ['timebuf'] * 3 + ['binner'] * 3 + ['orb'])
+        for result in results['results']:
+            self.assertEquals(result['samples'], 800)
+            self.assertTrue(result['samples_per_sec'] > 0)
+            self.assertTrue(result['latency_p50_us'] <=
+                            result['latency_p99_us'])
@@ -0,0 +1,194 @@
+from unittest import TestCase
+
+import gevent
+import numpy as np
+from gevent.server import StreamServer
+
+from wavefront.cache import LRUCache, PacketCache, packet_endtime, \
+        LocalCache, MemcacheCache
+from wavefront.query import BinQuery
+
+
+class Dummy(object): pass
+
+
+class Test_LRUCache(TestCase):
+    def test_evict_by_bytes(self):
+        evicted = []
+        cache = LRUCache(10, on_evict=lambda k, v: evicted.append(k))
+        cache['a'] = 'xxxx'
+        cache['b'] = 'xxxx'
+        self.assertEquals(cache['a'], 'xxxx')
+        cache['c'] = 'xxxx'
+        self.assertEquals(evicted, ['b'])
+        self.assertEquals(cache.nbytes, 8)
+        self.assertFalse('b' in cache)
+        self.assertEquals(cache.get('b'), None)
+        self.assertEquals(cache.stats()['hits'], 1)
+        self.assertEquals(cache.stats()['misses'], 1)
+
+    def test_replace(self):
+        cache = LRUCache(10)
+        cache['a'] = 'xxxx'
+        cache['a'] = 'xx'
+        self.assertEquals(cache.nbytes, 2)
+        self.assertEquals(len(cache), 1)
+
+    def test_too_big(self):
+        cache = LRUCache(10)
+        cache['a'] = 'x' * 11
+        self.assertEquals(len(cache), 0)
+        self.assertEquals(cache.nbytes, 0)
+
+
+class Test_PacketCache(TestCase):
+    def setUp(self):
+        self.cache = PacketCache(100)
+        for time in 0, 10, 20, 30:
+            self.cache.add('STA', time, time + 10, 'x' * 10)
+
+    def test_lookup(self):
+        self.assertEquals([p[0] for p in self.cache.lookup('STA', 15, 25)],
+                          [10, 20])
+        self.assertEquals([p[0] for p in self.cache.lookup('STA', 10, 20)],
+                          [10])
+        self.assertEquals(self.cache.lookup('STA', 40, 50), [])
+        self.assertEquals(self.cache.lookup('NONE', 0, 50), [])
+
+    def test_evict(self):
+        self.cache.lookup('STA', 0, 10)
+        for time in xrange(100, 180, 10):
+            self.cache.add('OTHER', time, time + 10, 'x' * 10)
+        # 0 was touched, so 10 and 20 went first
+        self.assertEquals([p[0] for p in self.cache.lookup('STA', 0, 40)],
+                          [0, 30])
+        self.assertEquals(self.cache.nbytes, 100)
+
+    def test_fetch(self):
+        calls = []
+        def loader(srcname, tstart, tend):
+            calls.append((tstart, tend))
+            return [(time, time + 10, 'y' * 10) for time in xrange(40, 60, 10)]
+        packets = self.cache.fetch('STA', 40, 60, loader)
+        self.assertEquals([p[0] for p in packets], [40, 50])
+        self.assertEquals(len(self.cache.fetch('STA', 45, 55, loader)), 2)
+        self.assertEquals(calls, [(40, 60)])
+        # evicting a loaded packet makes the window go back to the loader
+        for time in xrange(100, 200, 10):
+            self.cache.add('OTHER', time, time + 10, 'x' * 10)
+        self.assertFalse(self.cache.loaded('STA', 40, 60))
+        self.cache.fetch('STA', 40, 60, loader)
+        self.assertEquals(len(calls), 2)
+
+    def test_packet_endtime(self):
+        packet = Dummy()
+        packet.time = 5.0
+        channel = Dummy()
+        channel.time, channel.data, channel.samprate = 10.0, range(40), 20.0
+        packet.channels = [channel]
+        self.assertEquals(packet_endtime(packet), 12.0)
+        packet.channels = []
+        self.assertEquals(packet_endtime(packet), 5.0)
+
+
+class MemcacheStandIn(object):
+    """Just enough of the memcached text protocol: get and set."""
+
+    def __init__(self):
+        self.data = {}
+        self.requests = 0
+        self.server = StreamServer(('127.0.0.1', 0), self.handle)
+        self.server.start()
+        self.address = self.server.address
+
+    def handle(self, sock, address):
+        f = sock.makefile('rb')
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            self.requests += 1
+            parts = line.split()
+            if parts[0] == 'get':
+                for key in parts[1:]:
+                    if key in self.data:
+                        value = self.data[key]
+                        sock.sendall('VALUE %s 0 %d\r\n' % (key, len(value)))
+                        # let responses to other clients interleave
+                        gevent.sleep(0.001)
+                        sock.sendall('%s\r\n' % value)
+                sock.sendall('END\r\n')
+            elif parts[0] == 'set':
+                value = f.read(int(parts[4]) + 2)[:-2]
+                self.data[parts[1]] = value
+                if parts[-1] != 'noreply':
+                    sock.sendall('STORED\r\n')
+
+    def stop(self):
+        self.server.stop()
+
+
+def blocks(srcname, tstart, tend):
+    return [(tstart, np.arange(tstart, tend), 1.0)]
+
+
+class Test_Backends(TestCase):
+    def setUp(self):
+        self.memcached = MemcacheStandIn()
+
+    def tearDown(self):
+        self.memcached.stop()
+
+    def test_local(self):
+        cache = LocalCache(100)
+        cache.set_multi({'a': 'x', 'b': 'y'})
+        self.assertEquals(cache.get_multi(['a', 'b', 'c']), {'a': 'x', 'b': 'y'})
+        self.assertEquals(cache.get('c'), None)
+
+    def test_memcache(self):
+        cache = MemcacheCache(self.memcached.address)
+        value = '\r\nEND\r\n' + ''.join(map(chr, xrange(256)))
+        cache.set_multi({'a': value, 'b': 'y', 'long key' * 50: 'z'})
+        self.assertEquals(cache.get_multi(['a', 'b', 'c', 'long key' * 50]),
+                          {'a': value, 'b': 'y', 'long key' * 50: 'z'})
+        self.assertEquals(cache.stats()['misses'], 1)
+        self.assertTrue(all(key.startswith('wf:') for key in self.memcached.data))
+        # three sets pipelined in one write, one multi-get
+        self.assertEquals(self.memcached.requests, 4)
+
+    def test_memcache_concurrent(self):
+        cache = MemcacheCache(self.memcached.address)
+        cache.set_multi(dict(('%s%d' % (name, n), name * n)
+                             for name in 'ab' for n in xrange(1, 5)))
+        def get(name):
+            keys = ['%s%d' % (name, n) for n in xrange(1, 5)]
+            return [cache.get_multi(keys) for n in xrange(5)]
+        # two greenlets on the one connection at the same time
+        a, b = gevent.spawn(get, 'a'), gevent.spawn(get, 'b')
+        gevent.joinall([a, b], raise_error=True)
+        for greenlet, name in (a, 'a'), (b, 'b'):
+            for result in greenlet.value:
+                self.assertEquals(result, dict(('%s%d' % (name, n), name * n)
+                                               for n in xrange(1, 5)))
+        self.assertEquals(cache.stats()['errors'], 0)
+
+    def test_memcache_down(self):
+        cache = MemcacheCache(self.memcached.address)
+        self.memcached.stop()
+        cache.set('a', 'x')
+        self.assertEquals(cache.get_multi(['a']), {})
+        self.assertTrue(cache.stats()['errors'] > 0)
+
+    def test_shared_binning(self):
+        calls = []
+        def source(srcname, tstart, tend):
+            calls.append((tstart, tend))
+            return blocks(srcname, tstart, tend)
+        queries = [BinQuery(source, MemcacheCache(self.memcached.address),
+                            chunkbins=8, settle=0) for n in xrange(2)]
+        bins = queries[0].query('X', 1.0, 0, 16)
+        self.assertEquals(list(bins['max']), range(16))
+        # the second server reuses the first one's work
+        self.assertEquals(queries[1].query('X', 1.0, 0, 16).tostring(),
+                          bins.tostring())
+        self.assertEquals(calls, [(0, 16)])
@@ -0,0 +1,171 @@
+from wavefront.cbinner import Binner, Bin, DerivedBinner
+from wavefront.ctimebuf import TimeBuffer, BinBuffer
+from unittest import TestCase
+
+
+def scalar_update(binner, root_ts, samples, samprate):
+    """Reference implementation; bins one sample at a time."""
+    store = binner.store
+    binsize = int(binner.tbin * samprate)
+    period = 1.0 / samprate
+    updated = []
+    current = store.get(root_ts)
+    for sampnum, val in enumerate(samples):
+        ts = root_ts + period * sampnum
+        floored = binner.floor(ts)
+        if current is not None and current.timestamp != floored:
+            current = store.get(ts)
+        if current is None:
+            current = Bin(floored, binsize)
+            store.update(ts, current)
+        current.add(ts, val)
+        if binner.previous is None:
+            binner.previous = current
+        if current.nsamples == binsize:
+            updated.append(current)
+        elif (binner.previous.timestamp != current.timestamp and
+              binner.previous.nsamples < binsize):
+            updated.append(binner.previous)
+        binner.previous = current
+    return updated
+
+
+class Collector(object):
+    def __init__(self):
+        self.items = []
+
+    def put(self, obj, block=False):
+        self.items.extend(obj)
+
+
+def make_binner(twin=40.0, tbin=4.0, timebuf_class=TimeBuffer):
+    return Binner('NET_STA_CHAN', twin, tbin,
+                  timebuf_class(int(twin / tbin), 0, tbin))
+
+
+def summarize(bins):
+    return [None if b is None else
+            (b.timestamp, b.max, b.min, round(b.mean, 9), b.nsamples)
+            for b in bins]
+
+
+class Test_Bin(TestCase):
+    def test_add_block(self):
+        a, b = Bin(0, 4), Bin(0, 4)
+        for val in [3, -1, 2, 5]:
+            a.add(0, val)
+        b.add_block(3, -1, 2, 2)
+        b.add_block(5, 2, 7, 2)
+        self.assertEquals(summarize([a]), summarize([b]))
+
+
+class Test_Binner(TestCase):
+    packets = [
+        # (root_ts, samples, samprate); in order, gap, late, unaligned
+        (0.0, range(10), 2.0),
+        (5.0, range(10, 16), 2.0),
+        (11.0, [7, -3, 4, 4, 9, 1], 2.0),
+        (8.0, [2, 2, 2, 2, 2, 2], 2.0),
+        (14.25, range(20), 2.0),
+    ]
+
+    def run_binner(self, update, timebuf_class=TimeBuffer):
+        binner = make_binner(timebuf_class=timebuf_class)
+        collector = Collector()
+        published = []
+        with binner.subscription(collector):
+            for root_ts, samples, samprate in self.packets:
+                published.append(update(binner, root_ts, samples, samprate))
+        return binner, collector, published
+
+    def test_update_matches_scalar(self):
+        block, collector, _ = self.run_binner(Binner.update)
+        scalar, _, published = self.run_binner(scalar_update)
+        self.assertEquals(summarize(block.store.itervalues()),
+                          summarize(scalar.store.itervalues()))
+        # the same up to the late packet, which only republishes its bin
+        self.assertEquals(
+            [b.timestamp for b in collector.items[:3]],
+            [b.timestamp for updated in published[:3] for b in updated])
+        self.assertEquals([b.timestamp for b in collector.items[3:]],
+                          [8.0, 12.0, 16.0, 20.0])
+
+    def test_update_late(self):
+        binner = make_binner(timebuf_class=BinBuffer)
+        collector = Collector()
+        binner.update(0.0, range(24), 2.0)
+        with binner.subscription(collector):
+            binner.update(4.0, [100, -100], 2.0)
+        # merged in place, not superseding the bin being filled
+        self.assertEquals(summarize(collector.items), [(4.0, 100, -100, 11.5, 10)])
+        self.assertEquals(binner.previous.timestamp, 8.0)
+        self.assertEquals(binner.nlate, 1)
+
+    def test_update_stale(self):
+        binner = make_binner(timebuf_class=BinBuffer)
+        binner.update(100.0, range(8), 2.0)
+        before = summarize(binner.store.itervalues())
+        binner.update(10.0, range(8), 2.0)
+        self.assertEquals(binner.nstale, 1)
+        # partly stale; only samples from the tail, 64, on are kept
+        binner.update(62.0, range(8), 2.0)
+        self.assertEquals(binner.nstale, 1)
+        after = summarize(binner.store.itervalues())
+        self.assertEquals(after[1:], before[1:])
+        self.assertEquals(after[0], (64.0, 7, 4, 2.75, 4))
+
+    def test_update_gap_wraps(self):
+        binner = make_binner(timebuf_class=BinBuffer)
+        collector = Collector()
+        with binner.subscription(collector):
+            binner.update(0.0, range(6), 1.0)
+            # gap longer than twin; the unfinished bin at 4 is superseded
+            binner.update(100.0, range(8), 1.0)
+            # and the buffer wraps, reusing every slot
+            binner.update(108.0, range(40), 1.0)
+        self.assertEquals(binner.previous.timestamp, 144.0)
+        # read only now, after the slots were reused
+        self.assertEquals(summarize(collector.items[:4]),
+                          [(0.0, 3, 0, 1.5, 4), (4.0, 5, 4, 2.25, 2),
+                           (100.0, 3, 0, 1.5, 4), (104.0, 7, 4, 5.5, 4)])
+        self.assertEquals([b.timestamp for b in collector.items[4:]],
+                          range(108, 148, 4))
+
+    def test_update_binbuffer(self):
+        objects, _, _ = self.run_binner(Binner.update)
+        columnar, _, _ = self.run_binner(Binner.update, BinBuffer)
+        self.assertEquals(summarize(columnar.store.itervalues()),
+                          summarize(objects.store.itervalues()))
+
+    def test_update_empty(self):
+        binner = make_binner()
+        binner.update(0.0, [], 1.0)
+        self.assertEquals(list(binner.store.itervalues()), [None] * 10)
+
+    def test_update_complete(self):
+        binner = make_binner()
+        collector = Collector()
+        with binner.subscription(collector):
+            binner.update(0.0, [1, 2, 3, 4, 5, 6], 1.0)
+        self.assertEquals(summarize(collector.items), [(0.0, 4, 1, 2.5, 4)])
+
+
+class Test_DerivedBinner(TestCase):
+    def test_matches_raw(self):
+        for timebuf_class in TimeBuffer, BinBuffer:
+            fine = make_binner(40.0, 4.0, timebuf_class)
+            coarse = DerivedBinner(fine, 80.0, 8.0, timebuf_class(10, 0, 8.0))
+            direct = make_binner(80.0, 8.0, timebuf_class)
+            collector = Collector()
+            with coarse.subscription(collector):
+                for root_ts, samples, samprate in Test_Binner.packets:
+                    fine.update(root_ts, samples, samprate)
+                    direct.update(root_ts, samples, samprate)
+            self.assertEquals(summarize(coarse.store.itervalues()),
+                              summarize(direct.store.itervalues()))
+            self.assertEquals(collector.items[-1].timestamp, 16.0)
+
+    def test_bad_levels(self):
+        fine = make_binner(40.0, 4.0)
+        self.assertRaises(ValueError, DerivedBinner, fine, 60.0, 6.0, None)
+        self.assertRaises(ValueError, DerivedBinner, fine, 800.0, 80.0, None)
@@ -0,0 +1,145 @@
+from wavefront.cbinner import Bin, Binner
+from wavefront.ctimebuf import BinBuffer, TimeBuffer
+from unittest import TestCase
+
+
+def makebin(timestamp, val, size=4):
+    bin = Bin(timestamp, size)
+    bin.add(timestamp, val)
+    return bin
+
+
+class Test_BinBuffer(TestCase):
+    def setUp(self):
+        self.bb = BinBuffer(size=4, head_time=1, element_time=0.25)
+
+    def test_bounds(self):
+        self.assertEquals(self.bb.tail_num(), 0)
+        self.assertEquals(self.bb.head_num, 4)
+        self.assertEquals(self.bb.tail_time(), 0)
+        self.assertEquals(self.bb.head_time(), 1)
+
+    def test_empty(self):
+        self.assertEquals(list(self.bb.itervalues()), [None] * 4)
+        self.assertEquals(self.bb.get(0), None)
+        self.assertEquals(self.bb.get(1, 'default'), 'default')
+
+    def test_update(self):
+        self.bb.update(0.5, makebin(0.5, 7))
+        view = self.bb[0.5]
+        self.assertEquals((view.timestamp, view.max, view.min, view.nsamples),
+                          (0.5, 7, 7, 1))
+        self.assertEquals(self.bb.head_num, 4)
+
+    def test_update_advance(self):
+        self.bb.update(0, makebin(0, 1))
+        self.bb.update(1.5, makebin(1.5, 2))
+        self.assertEquals(self.bb.head_num, 7)
+        self.assertEquals([v and v.max for v in self.bb.itervalues()],
+                          [None, None, None, 2])
+
+    def test_update_gap(self):
+        self.bb.update(0.75, makebin(0.75, 1))
+        self.bb.update(10, makebin(10, 2))
+        self.assertEquals(self.bb.tail_time(), 9.25)
+        self.assertEquals([v and v.max for v in self.bb.itervalues()],
+                          [None, None, None, 2])
+
+    def test_update_stale(self):
+        self.bb.update(2, makebin(2, 1))
+        self.bb.update(0, makebin(0, 5))
+        self.assertEquals([v and v.max for v in self.bb.itervalues()],
+                          [None, None, None, 1])
+
+    def test_view_add_block(self):
+        self.bb.update(0.25, makebin(0.25, 1))
+        self.bb[0.25].add_block(3, -2, 1, 2)
+        view = self.bb[0.25]
+        self.assertEquals((view.max, view.min, view.mean, view.nsamples),
+                          (3, -2, 0.5, 3))
+
+    def test_setitem(self):
+        self.bb[0.5] = makebin(0.5, 3)
+        self.assertEquals(self.bb[0.5].max, 3)
+        self.bb[0.5] = None
+        self.assertEquals(self.bb[0.5], None)
+        self.assertRaises(IndexError, self.bb.__setitem__, 1, makebin(1, 1))
+
+    def test_get_range(self):
+        for n in xrange(6):
+            self.bb.update(n * 0.25, makebin(n * 0.25, n))
+        result = self.bb.get_range()
+        self.assertEquals(list(result['timestamp']), [0.5, 0.75, 1.0, 1.25])
+        self.assertEquals(list(result['max']), [2, 3, 4, 5])
+        result = self.bb.get_range(0.75, 10)
+        self.assertEquals(list(result['max']), [3, 4, 5])
+        self.assertEquals(len(self.bb.get_range(5, 6)), 0)
+
+    def test_put_range(self):
+        self.bb.update(0.5, makebin(0.5, 1))
+        bins = [makebin(n * 0.25, n) for n in xrange(4, 7)]
+        self.bb.put_range(1.0, bins, 4)
+        self.assertEquals(self.bb.head_time(), 1.75)
+        result = self.bb.get_range()
+        self.assertEquals(list(result['max'][1:]), [4, 5, 6])
+        self.assertEquals(result['nsamples'][0], 0)
+        self.assertEquals(self.bb[1.25].size, 4)
+        # round trip, across the wrap
+        copy = BinBuffer(size=4, head_time=1, element_time=0.25)
+        copy.put_range(1.0, result, 4)
+        self.assertEquals(copy.get_range().tostring(), result.tostring())
+        # older than the tail
+        self.bb.put_range(0, bins, 4)
+        self.assertEquals(list(self.bb.get_range()['max'][1:]), [4, 5, 6])
+
+    def test_put_range_binning(self):
+        bb = BinBuffer(size=4, head_time=0, element_time=2.0)
+        bins = [makebin(0, 3, 2), makebin(2, 7, 2)]
+        self.assertRaises(ValueError, bb.put_range, 0, bins, [2, 0])
+        bb.put_range(0, bins, 2)
+        # binning carries on into the restored slots
+        binner = Binner('X', 8.0, 2.0, bb)
+        binner.update(1.0, [5, 5], 1.0)
+        self.assertEquals((bb[0].mean, bb[0].nsamples), (4.0, 2))
+        self.assertEquals((bb[2].mean, bb[2].nsamples, bb[2].max), (6.0, 2, 7))
+
+
+class Test_TimeBuffer(TestCase):
+    def setUp(self):
+        self.tb = TimeBuffer(4, 1, 0.25)
+
+    def test_update_gap(self):
+        self.tb.update(0.75, 'a')
+        self.tb.update(10, 'b')
+        self.assertEquals(self.tb.tail_time(), 9.25)
+        self.assertEquals(self.tb.get_range(), [None, None, None, 'b'])
+        self.tb.update(0, 'c')
+        self.assertEquals(self.tb.get_range(), [None, None, None, 'b'])
+
+    def test_setitem(self):
+        for n in xrange(4):
+            self.tb.update(n * 0.25, n)
+        # rewrite inside the window
+        self.tb[0.5] = 'x'
+        self.assertEquals(self.tb[0.5], 'x')
+        self.assertEquals(list(self.tb.itervalues()), [0, 1, 'x', 3])
+        self.assertRaises(IndexError, self.tb.__setitem__, 1, 1)
+        self.assertRaises(IndexError, self.tb.__setitem__, -0.25, 1)
+
+    def test_get_range(self):
+        for n in xrange(6):
+            self.tb.update(n * 0.25, n)
+        self.assertEquals(self.tb.get_range(), [2, 3, 4, 5])
+        self.assertEquals(self.tb.get_range(0.75, 1.25), [3, 4])
+        self.assertEquals(self.tb.get_range(0, 10), [2, 3, 4, 5])
+        self.assertEquals(self.tb.get_range(5, 6), [])
+
+    def test_put_range(self):
+        self.tb.put_range(0.5, ['a', 'b', 'c'])
+        self.assertEquals(self.tb.head_time(), 1.25)
+        self.assertEquals(self.tb.get_range(), [None, 'a', 'b', 'c'])
+        self.tb.put_range(2.0, range(6))
+        self.assertEquals(self.tb.head_time(), 3.5)
+        self.assertEquals(self.tb.get_range(), [2, 3, 4, 5])
+        self.tb.put_range(2.5, ['x', 'y'])
+        self.assertEquals(self.tb.get_range(), ['x', 'y', 4, 5])
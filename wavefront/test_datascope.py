@@ -0,0 +1,153 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+import numpy as np
+
+from wavefront import datascope
+from wavefront.datascope import Datascope, DatascopeError
+from wavefront.query import BinQuery
+
+
+WFDISC = ('%-6s %-8s %17.5f %8d %8d %8d %17.5f %8d %11.7f %16.6f %16.6f %-6s '
+          '%-1s %-2s %-1s %-64s %-32s %10d %8d %17.5f\n')
+
+
+def wfdisc_row(sta, chan, t, nsamp, samprate, datatype, dfile, foff=0):
+    return WFDISC % (sta, chan, t, -1, -1, -1, t + (nsamp - 1) / samprate,
+                     nsamp, samprate, 1, 1, '-', '-', datatype, '-', 'wf',
+                     dfile, foff, -1, 0)
+
+
+class Test_Datascope(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = os.path.join(self.dir, 'db')
+        os.mkdir(os.path.join(self.dir, 'wf'))
+        # two contiguous s4 segments in one file, an i2 and a t4 channel
+        self.write('a.w', np.arange(200, dtype='>i4').tostring())
+        self.write('b.w', np.arange(100, dtype='<i2').tostring())
+        self.write('c.w', (np.arange(100) / 2.0).astype('>f4').tostring())
+        with open(self.db + '.snetsta', 'w') as f:
+            f.write('%-8s %-6s %-6s %17.5f\n' % ('TA', 'PFO', 'PFO', 0))
+        with open(self.db + '.wfdisc', 'w') as f:
+            f.write(wfdisc_row('PFO', 'BHZ', 1000, 100, 10.0, 's4', 'a.w'))
+            f.write(wfdisc_row('PFO', 'BHZ', 1010, 100, 10.0, 's4', 'a.w', 400))
+            f.write(wfdisc_row('PFO', 'BHN', 1000, 100, 1.0, 'i2', 'b.w'))
+            f.write(wfdisc_row('XYZ', 'LHZ_00', 1000, 100, 1.0, 't4', 'c.w'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        with open(os.path.join(self.dir, 'wf', name), 'wb') as f:
+            f.write(data)
+
+    def test_read(self):
+        ds = Datascope(self.db)
+        self.assertEquals(ds.srcnames(),
+                          ['TA_PFO_BHN', 'TA_PFO_BHZ', 'XYZ_LHZ_00'])
+        blocks = ds('TA_PFO_BHZ', 1005, 1015)
+        self.assertEquals([(t, len(samples)) for t, samples, r in blocks],
+                          [(1005.0, 50), (1010.0, 50)])
+        samples = np.concatenate([b[1] for b in blocks])
+        self.assertEquals(list(samples), range(50, 150))
+        result = ds.read(['TA_PFO_BHN', 'XYZ_LHZ_00', 'NONE'], 1010, 1012.5)
+        self.assertEquals(list(result['TA_PFO_BHN'][0][1]), [10, 11, 12])
+        self.assertEquals(list(result['XYZ_LHZ_00'][0][1]), [5, 5.5, 6])
+        self.assertEquals(result['NONE'], [])
+        self.assertEquals(ds('TA_PFO_BHZ', 2000, 3000), [])
+
+    def test_cache(self):
+        ds = Datascope(self.db)
+        ds.read(['TA_PFO_BHZ', 'TA_PFO_BHN'], 1000, 1010)
+        ds.read(['TA_PFO_BHZ', 'TA_PFO_BHN'], 1000, 1010)
+        self.assertEquals(ds.reads, 2)
+        # a new row invalidates everything
+        time.sleep(0.01)
+        with open(self.db + '.wfdisc', 'a') as f:
+            f.write(wfdisc_row('PFO', 'BHE', 1000, 100, 1.0, 'i2', 'b.w'))
+        self.assertEquals(len(ds('TA_PFO_BHE', 1000, 1010)[0][1]), 10)
+        ds.read(['TA_PFO_BHZ'], 1000, 1010)
+        self.assertEquals(ds.reads, 4)
+
+    def test_shifted_window(self):
+        ds = Datascope(self.db)
+        ds('TA_PFO_BHZ', 1000, 1005)
+        blocks = ds('TA_PFO_BHZ', 1002, 1008)
+        self.assertEquals(list(blocks[0][1]), range(20, 80))
+        # overlapping and shifted windows hit the cached chunk
+        self.assertEquals(ds.reads, 1)
+        self.assertEquals(list(ds.cached('TA_PFO_BHZ', 1001, 1002)[0][1]),
+                          range(10, 20))
+        self.assertEquals(ds.cached('TA_PFO_BHZ', 1001, 1012), None)
+
+    def test_chunks(self):
+        ds = Datascope(self.db, chunksamples=30)
+        blocks = ds('TA_PFO_BHZ', 1002, 1018)
+        self.assertEquals([(t, len(samples)) for t, samples, r in blocks],
+                          [(1002.0, 80), (1010.0, 80)])
+        samples = np.concatenate([b[1] for b in blocks])
+        self.assertEquals(list(samples), range(20, 180))
+        # chunks 0 to 3 of the first segment, 0 to 2 of the second, each
+        # read separately
+        self.assertEquals(ds.reads, 7)
+
+    def test_empty_miniseed(self):
+        class Stream(list):
+            def merge(self):
+                pass
+        class Obspy(object):
+            def read(self, path, format, sourcename):
+                return Stream()
+        with open(self.db + '.wfdisc', 'a') as f:
+            f.write(wfdisc_row('PFO', 'BHE', 1000, 100, 1.0, 'sd', 'b.w'))
+        saved, datascope.obspy = datascope.obspy, Obspy()
+        try:
+            self.assertEquals(Datascope(self.db)('TA_PFO_BHE', 1000, 1010), [])
+        finally:
+            datascope.obspy = saved
+
+    def test_late_miniseed(self):
+        # the trace starts 5 s after the wfdisc row; values are times
+        class Trace(object):
+            class stats(object):
+                class starttime(object):
+                    timestamp = 1005.0
+            data = np.arange(1005, 1100, dtype=np.int32)
+        class Stream(list):
+            def merge(self):
+                pass
+        class Obspy(object):
+            def read(self, path, format, sourcename):
+                return Stream([Trace()])
+        with open(self.db + '.wfdisc', 'a') as f:
+            f.write(wfdisc_row('PFO', 'BHE', 1000, 100, 1.0, 'sd', 'b.w'))
+        saved, datascope.obspy = datascope.obspy, Obspy()
+        try:
+            ds = Datascope(self.db)
+            blocks = ds('TA_PFO_BHE', 1000, 1010)
+            self.assertEquals([(t, list(samples)) for t, samples, r in blocks],
+                              [(1005.0, range(1005, 1010))])
+            self.assertEquals(ds('TA_PFO_BHE', 1000, 1003), [])
+            time, samples = ds.segments('TA_PFO_BHE', 1000, 1010)[0].read(
+                    1003, 1008)
+            self.assertEquals((time, list(samples)),
+                              (1005.0, range(1005, 1008)))
+        finally:
+            datascope.obspy = saved
+
+    def test_errors(self):
+        self.assertRaises(DatascopeError, Datascope, self.db + 'x')
+        with open(self.db + '.wfdisc', 'a') as f:
+            f.write(wfdisc_row('PFO', 'BHE', 1000, 100, 1.0, 'zz', 'b.w'))
+        self.assertRaises(DatascopeError, Datascope(self.db), 'TA_PFO_BHE',
+                          1000, 1010)
+
+    def test_binning(self):
+        query = BinQuery(Datascope(self.db), chunkbins=4, settle=0)
+        bins = query.query('TA_PFO_BHZ', 5.0, 1000, 1020)
+        self.assertEquals(list(bins['max']), [49, 99, 149, 199])
+        self.assertEquals(list(bins['nsamples']), [50] * 4)
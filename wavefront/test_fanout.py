@@ -0,0 +1,173 @@
+from Queue import Queue, Empty
+from unittest import TestCase
+
+import gevent
+
+from wavefront.cbinner import Bin
+from wavefront.fanout import Hub, Subscriber, CoalescingSubscriber, \
+        SlowConsumerError, DROP_OLDEST, COALESCE, DISCONNECT
+from wavefront import wire
+
+
+def makebin(timestamp, val, size=4):
+    bin = Bin(timestamp, size)
+    bin.add(timestamp, val)
+    return bin
+
+
+class CountingEncoder(object):
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, bins):
+        self.calls += 1
+        return wire.encode('X', 1.0, bins)
+
+
+class Test_Hub(TestCase):
+    def test_encode_once(self):
+        encoder = CountingEncoder()
+        hub = Hub(('X', 1.0), encoder)
+        subscribers = [Subscriber() for n in xrange(10)]
+        queue = Queue()
+        for subscriber in subscribers:
+            hub.subscribe(subscriber)
+        hub.subscribe(queue)
+        hub.publish([makebin(0, 1)])
+        self.assertEquals(encoder.calls, 1)
+        frames = [s.get_nowait() for s in subscribers] + [queue.get_nowait()]
+        self.assertTrue(all(frame is frames[0] for frame in frames))
+
+    def test_no_subscribers(self):
+        encoder = CountingEncoder()
+        hub = Hub(('X', 1.0), encoder)
+        hub.publish([makebin(0, 1)])
+        self.assertEquals(encoder.calls, 0)
+
+    def test_subscription(self):
+        hub = Hub()
+        with hub.subscription(Subscriber()) as subscriber:
+            hub.publish('a')
+            self.assertEquals(len(hub), 1)
+        self.assertEquals(len(hub), 0)
+        self.assertEquals(subscriber.get_nowait(), 'a')
+
+    def test_queue_overflow(self):
+        hub = Hub()
+        queue = Queue(maxsize=1)
+        hub.subscribe(queue)
+        hub.publish('a')
+        hub.publish('b')
+        self.assertEquals(hub.stats(), [(queue, 1, 1)])
+
+
+class Test_Subscriber(TestCase):
+    def test_drop_oldest(self):
+        hub = Hub()
+        subscriber = Subscriber(maxsize=2, policy=DROP_OLDEST)
+        hub.subscribe(subscriber)
+        for obj in 'abc':
+            hub.publish(obj)
+        self.assertEquals(subscriber.overflows, 1)
+        self.assertEquals(hub.stats(), [(subscriber, 2, 1)])
+        self.assertEquals([subscriber.get_nowait() for n in xrange(2)],
+                          ['b', 'c'])
+        self.assertRaises(Empty, subscriber.get_nowait)
+
+    def test_drop_oldest_delta(self):
+        hub = Hub(('X', 1.0), wire.FrameEncoder('X', 1.0, delta=True))
+        subscriber = Subscriber(maxsize=2, policy=DROP_OLDEST)
+        hub.subscribe(subscriber)
+        a, b, c = makebin(0, 1), makebin(1, 1), makebin(2, 1)
+        hub.publish([a, b])
+        b.add(1, 5)
+        # a unchanged; left out of this and later deltas
+        hub.publish([a, b])
+        hub.publish([c])
+        self.assertEquals(subscriber.overflows, 1)
+        # the dropped delta's bins come first, as a full frame
+        srcname, tbin, flags, bins = wire.decode(subscriber.get_nowait())
+        self.assertEquals(flags, 0)
+        self.assertEquals(list(bins['timestamp']), [0, 1])
+        self.assertEquals(list(bins['max']), [1, 1])
+        for timestamps in [1], [2]:
+            srcname, tbin, flags, bins = wire.decode(subscriber.get_nowait())
+            self.assertEquals(flags, wire.FLAG_DELTA)
+            self.assertEquals(list(bins['timestamp']), timestamps)
+        self.assertRaises(Empty, subscriber.get_nowait)
+
+    def test_disconnect(self):
+        hub = Hub()
+        subscriber = Subscriber(maxsize=1, policy=DISCONNECT)
+        hub.subscribe(subscriber)
+        hub.publish('a')
+        hub.publish('b')
+        self.assertTrue(subscriber.closed)
+        self.assertRaises(SlowConsumerError, subscriber.get_nowait)
+
+    def test_coalesce(self):
+        hub = Hub(('X', 1.0), wire.FrameEncoder('X', 1.0))
+        subscriber = Subscriber(maxsize=2, policy=COALESCE)
+        hub.subscribe(subscriber)
+        a, b = makebin(0, 1), makebin(1, 1)
+        hub.publish([a])
+        a.add(0, 5)
+        hub.publish([a, b])
+        b.add(1, 7)
+        hub.publish([b])
+        self.assertEquals(subscriber.overflows, 1)
+        srcname, tbin, flags, bins = wire.decode(subscriber.get_nowait())
+        self.assertEquals(list(bins['timestamp']), [0, 1])
+        self.assertEquals(list(bins['max']), [5, 1])
+        srcname, tbin, flags, bins = wire.decode(subscriber.get_nowait())
+        self.assertEquals(list(bins['max']), [7])
+        self.assertRaises(Empty, subscriber.get_nowait)
+
+    def test_get_blocks(self):
+        subscriber = Subscriber()
+        message = []
+        greenlet = gevent.spawn(lambda: message.append(subscriber.get()))
+        gevent.sleep(0)
+        self.assertEquals(message, [])
+        hub = Hub()
+        hub.subscribe(subscriber)
+        hub.publish('a')
+        greenlet.join(timeout=1)
+        self.assertEquals(message, ['a'])
+        self.assertRaises(Empty, subscriber.get, timeout=0.01)
+
+
+class Test_CoalescingSubscriber(TestCase):
+    def test_latest_state(self):
+        hub = Hub(('X', 1.0))
+        subscriber = CoalescingSubscriber()
+        hub.subscribe(subscriber)
+        a = makebin(0, 1)
+        for val in xrange(2, 5):
+            a.add(0, val)
+            hub.publish([a])
+        hub.publish([makebin(1, 9)])
+        self.assertEquals(len(subscriber), 2)
+        bins = subscriber.get_nowait()
+        self.assertEquals(list(bins['timestamp']), [0, 1])
+        self.assertEquals(list(bins['max']), [4, 9])
+        self.assertEquals(list(bins['nsamples']), [4, 1])
+        self.assertRaises(Empty, subscriber.get_nowait)
+
+    def test_per_channel(self):
+        subscriber = CoalescingSubscriber()
+        hubs = Hub(('X', 1.0)), Hub(('Y', 1.0))
+        for hub in hubs:
+            hub.subscribe(subscriber)
+            hub.publish([makebin(0, 1)])
+        self.assertEquals(len(subscriber.get_nowait()), 1)
+        self.assertEquals(len(subscriber.get_nowait()), 1)
+
+    def test_maxbins(self):
+        hub = Hub(('X', 1.0), wire.FrameEncoder('X', 1.0))
+        subscriber = CoalescingSubscriber(maxbins=2)
+        hub.subscribe(subscriber)
+        hub.publish([makebin(ts, ts) for ts in xrange(3)])
+        self.assertEquals(subscriber.overflows, 1)
+        srcname, tbin, flags, bins = wire.decode(subscriber.get_nowait())
+        self.assertEquals(list(bins['timestamp']), [1, 2])
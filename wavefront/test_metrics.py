@@ -0,0 +1,62 @@
+import urllib2
+from unittest import TestCase
+
+import gevent
+
+from wavefront.metrics import Registry, serve
+
+
+class Test_Registry(TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter('pkts', "Packets", orb='a')
+        counter.inc()
+        counter.inc(2)
+        self.assertTrue(self.registry.counter('pkts', orb='a') is counter)
+        self.registry.counter('pkts', orb='b').inc()
+        self.assertEquals(sorted(self.registry.stats()['pkts']),
+                          [({'orb': 'a'}, 3), ({'orb': 'b'}, 1)])
+        self.assertRaises(ValueError, self.registry.gauge, 'pkts')
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('wait', bounds=(1, 2, 4))
+        for value in 0.5, 1.5, 1.5, 3, 10:
+            histogram.observe(value)
+        self.assertEquals(histogram.counts, [1, 2, 1, 1])
+        self.assertEquals(histogram.quantile(0.5), 2)
+        self.assertEquals(histogram.quantile(1.0), float('inf'))
+        stats = self.registry.stats()['wait'][0][1]
+        self.assertEquals((stats['count'], stats['sum']), (5, 16.5))
+
+    def test_render(self):
+        self.registry.counter('pkts', "Packets reaped", orb='a').inc(5)
+        self.registry.histogram('wait', bounds=(1, 2)).observe(1.5)
+        self.registry.add_collector(lambda: [
+                ('gauge', 'seen', "", dict(srcname='X"Y'), 12.5)])
+        text = self.registry.render()
+        for line in ['# HELP pkts Packets reaped', '# TYPE pkts counter',
+                     'pkts{orb="a"} 5', '# TYPE wait histogram',
+                     'wait_bucket{le="1"} 0', 'wait_bucket{le="2"} 1',
+                     'wait_bucket{le="+Inf"} 1', 'wait_sum 1.5',
+                     'wait_count 1', 'seen{srcname="X\\"Y"} 12.5']:
+            self.assertTrue(line in text.splitlines(), line)
+
+    def test_collector_failure(self):
+        def collector():
+            raise Exception("broken")
+        self.registry.add_collector(collector)
+        self.registry.counter('pkts').inc()
+        self.assertEquals(self.registry.stats(), {'pkts': [({}, 1)]})
+
+    def test_serve(self):
+        self.registry.counter('pkts').inc()
+        server = serve(self.registry, ('127.0.0.1', 0))
+        try:
+            url = 'http://127.0.0.1:%d/metrics' % server.address[1]
+            text = gevent.get_hub().threadpool.apply(
+                    lambda: urllib2.urlopen(url).read())
+            self.assertTrue('pkts 1' in text.splitlines())
+        finally:
+            server.stop()
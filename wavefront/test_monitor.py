@@ -0,0 +1,110 @@
+from unittest import TestCase
+
+import numpy as np
+
+from wavefront.cbinner import Binner
+from wavefront.ctimebuf import BinBuffer
+from wavefront.monitor import Window, Monitor, MonitorIndex
+from wavefront import wire
+
+
+class Clock(object):
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def binner(srcname, tbin=1.0):
+    return Binner(srcname, 100.0, tbin, BinBuffer(100, 0, tbin))
+
+
+def timestamps(monitor):
+    result = []
+    while not monitor.empty():
+        srcname, tbin, flags, bins = wire.decode(monitor.get_nowait())
+        result.extend(bins['timestamp'])
+    return result
+
+
+class Test_Window(TestCase):
+    def test_bounds(self):
+        self.assertEquals(Window(10, 20).bounds(100), (10, 20))
+        self.assertEquals(Window(10).bounds(100), (10, np.inf))
+        self.assertEquals(Window(duration=30).bounds(100), (70, np.inf))
+        self.assertRaises(ValueError, Window)
+        self.assertRaises(ValueError, Window, 20, 10)
+        self.assertRaises(ValueError, Window, 10, duration=30)
+
+
+class Test_MonitorIndex(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.index = MonitorIndex(bucketbins=8, clock=self.clock)
+
+    def update(self, binner, t0, n):
+        binner.hub.subscribe(self.index)
+        binner.update(t0, np.arange(n, dtype=float), 1.0)
+
+    def test_fixed(self):
+        monitor = Monitor(1.0, Window(5, 12))
+        self.index.add(monitor)
+        self.update(binner('X'), 0, 20)
+        self.assertEquals(timestamps(monitor), range(5, 12))
+
+    def test_accept_reject(self):
+        monitor = Monitor(1.0, Window(0), accept='TA_.*', reject='.*_LHZ')
+        other = Monitor(2.0, Window(0))
+        self.index.add(monitor)
+        self.index.add(other)
+        for srcname in 'TA_A_BHZ', 'TA_A_LHZ', 'AZ_B_BHZ':
+            self.update(binner(srcname), 0, 3)
+        self.assertEquals(len(monitor), 1)
+        self.assertEquals(wire.decode(monitor.get_nowait())[0], 'TA_A_BHZ')
+        self.assertTrue(other.empty())
+
+    def test_advancing(self):
+        monitor = Monitor(1.0, Window(duration=5))
+        self.index.add(monitor)
+        b = binner('X')
+        self.clock.now = 10
+        self.update(b, 0, 10)
+        self.assertEquals(timestamps(monitor), range(5, 10))
+        self.clock.now = 20
+        self.update(b, 10, 10)
+        self.assertEquals(timestamps(monitor), range(15, 20))
+
+    def test_shared_payload(self):
+        monitors = [Monitor(1.0, Window(0, 50)) for n in xrange(3)]
+        monitors.append(Monitor(1.0, Window(2)))
+        for monitor in monitors:
+            self.index.add(monitor)
+        self.update(binner('X'), 0, 10)
+        frames = [m.get_nowait() for m in monitors]
+        self.assertTrue(all(frame is frames[0] for frame in frames[:3]))
+        self.assertNotEqual(frames[3], frames[0])
+
+    def test_only_candidates_tested(self):
+        # many monitors watching other times, or other srcnames
+        for n in xrange(100):
+            self.index.add(Monitor(1.0, Window(1000 + n * 10, 1010 + n * 10)))
+            self.index.add(Monitor(1.0, Window(0, 10), accept='Y'))
+        monitor = Monitor(1.0, Window(0, 10), accept='X')
+        self.index.add(monitor)
+        self.update(binner('X'), 0, 10)
+        self.assertEquals(self.index.ntested, 1)
+        self.assertEquals(timestamps(monitor), range(10))
+
+    def test_remove(self):
+        monitors = [Monitor(1.0, Window(0, 10)), Monitor(1.0, Window(0)),
+                    Monitor(1.0, Window(duration=100)),
+                    Monitor(1.0, Window(0, 1e6))]
+        b = binner('X')
+        self.clock.now = 50
+        for n, monitor in enumerate(monitors):
+            with self.index.monitoring(monitor):
+                self.update(b, n * 2, 1)
+            self.update(b, n * 2 + 1, 1)
+            self.assertEquals(timestamps(monitor), [n * 2])
+        self.assertEquals(len(self.index), 0)
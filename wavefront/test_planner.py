@@ -0,0 +1,198 @@
+from unittest import TestCase
+
+import gevent
+import numpy as np
+
+from wavefront.cache import PacketCache, MemcacheCache
+from wavefront.cbinner import Binner
+from wavefront.ctimebuf import BinBuffer
+from wavefront.planner import QueryPlanner, PacketSource, BUFFERS, BINNED
+from wavefront.query import BinQuery
+from wavefront import wire
+from wavefront.test_cache import MemcacheStandIn
+
+
+def blocks(srcname, tstart, tend):
+    """One sample per second, valued by its time."""
+    t0 = np.floor(tstart)
+    return [(t0, np.arange(t0, np.ceil(tend)), 1.0)]
+
+
+class Controller(object):
+    """Stand-in for a BinController with one buffer."""
+
+    def __init__(self, binner):
+        self.binner = binner
+
+    def find_binner(self, srcname, tbin):
+        if (srcname, tbin) == (self.binner.srcname, self.binner.tbin):
+            return self.binner
+        return None
+
+
+class Source(object):
+    """Raw tier serving windows from tstart on, slowly if asked to."""
+
+    def __init__(self, tstart=None, delay=lambda tstart: 0):
+        self.tstart = tstart
+        self.delay = delay
+        self.windows = []
+
+    def __call__(self, srcname, tstart, tend):
+        if self.tstart is not None and tstart < self.tstart:
+            return None
+        self.windows.append((tstart, tend))
+        gevent.sleep(self.delay(tstart))
+        return blocks(srcname, tstart, tend)
+
+
+def join(pieces, srcname='X'):
+    return np.concatenate([bins for s, bins in pieces if s == srcname])
+
+
+class Test_QueryPlanner(TestCase):
+    def setUp(self):
+        store = BinBuffer(20, 0, 2.0)
+        self.binner = Binner('X', 40.0, 2.0, store)
+        self.binner.update(1000, np.arange(1000, 1040), 1.0)
+        self.recent = Source(tstart=800)
+        self.archive = Source()
+        self.planner = QueryPlanner(Controller(self.binner),
+                                    [('recent', self.recent),
+                                     ('archive', self.archive)],
+                                    chunkbins=8, settle=0)
+
+    def test_same_as_binning(self):
+        pieces = list(self.planner.query(['X', 'Y'], 700, 1040, 2.0))
+        expected = BinQuery(blocks, chunkbins=8, settle=0).query(
+                'X', 2.0, 700, 1040)
+        for srcname in 'X', 'Y':
+            self.assertEquals(join(pieces, srcname).tostring(),
+                              expected.tostring())
+        # the end came from the buffer
+        self.assertEquals(self.planner.stats()[BUFFERS]['hits'], 1)
+        self.assertEquals(self.planner.stats()[BUFFERS]['misses'], 1)
+
+    def test_sparse_buffer(self):
+        # restarted without a snapshot; the buffer has one packet
+        binner = Binner('X', 400.0, 2.0, BinBuffer(200, 0, 2.0))
+        binner.update(990, np.zeros(10), 1.0)
+        archive = Source()
+        planner = QueryPlanner(Controller(binner), [('archive', archive)],
+                               chunkbins=8, settle=0)
+        bins = join(planner.query('X', 700, 1000, 2.0))
+        expected = BinQuery(blocks, chunkbins=8, settle=0).query(
+                'X', 2.0, 700, 1000)
+        self.assertEquals(list(bins['timestamp']), range(700, 1000, 2))
+        # the gap came from the archive, the packet from the buffer
+        recent = bins['timestamp'] >= 990
+        self.assertEquals(bins[~recent].tostring(),
+                          expected[~recent].tostring())
+        self.assertEquals(list(bins['max'][recent]), [0] * 5)
+        self.assertEquals(list(bins['nsamples'][recent]), [2] * 5)
+        self.assertTrue(archive.windows)
+        stats = planner.stats()
+        self.assertEquals(stats['archive']['hits'], len(archive.windows))
+        self.assertEquals(stats[BUFFERS]['hits'], 1)
+        self.assertEquals(stats[BUFFERS]['misses'], 1)
+
+    def test_shared_cache(self):
+        # fetches store chunks while planning looks them up, all through
+        # one memcached connection
+        memcached = MemcacheStandIn()
+        try:
+            cache = MemcacheCache(memcached.address)
+            archive = Source(delay=lambda tstart: 0.001)
+            planner = QueryPlanner(None, [('archive', archive)], cache,
+                                   chunkbins=8, settle=0, concurrency=4,
+                                   maxchunks=1)
+            srcnames = ['S%d' % n for n in xrange(8)]
+            expected = BinQuery(blocks, chunkbins=8, settle=0).query(
+                    'X', 2.0, 700, 900)
+            for n in xrange(2):
+                pieces = list(planner.query(srcnames, 700, 900, 2.0))
+                for srcname in srcnames:
+                    self.assertEquals(join(pieces, srcname).tostring(),
+                                      expected.tostring())
+            self.assertEquals(cache.stats()['errors'], 0)
+            # the second time round, everything came from memcached
+            self.assertEquals(len(archive.windows), 8 * 14)
+        finally:
+            memcached.stop()
+
+    def test_tiers(self):
+        list(self.planner.query('X', 700, 1000, 2.0))
+        self.assertTrue(self.archive.windows[0][0] < 800)
+        self.assertTrue(all(t >= 800 for t, e in self.recent.windows))
+        stats = self.planner.stats()
+        self.assertEquals(stats['archive']['hits'], len(self.archive.windows))
+        self.assertEquals(stats['recent']['misses'], len(self.archive.windows))
+        self.assertEquals(stats[BINNED]['hits'], 0)
+        # now all binned chunks are cached
+        calls = len(self.recent.windows) + len(self.archive.windows)
+        list(self.planner.query('X', 700, 1000, 2.0))
+        self.assertEquals(len(self.recent.windows) + len(self.archive.windows),
+                          calls)
+        self.assertTrue(self.planner.stats()[BINNED]['hits'] > 0)
+
+    def test_streaming(self):
+        # the last historical chunks are slow; the first arrive before them
+        slow = Source(delay=lambda tstart: 0.5 if tstart >= 900 else 0)
+        planner = QueryPlanner(sources=[('slow', slow)], chunkbins=8,
+                               settle=0, maxchunks=1)
+        start = gevent.get_hub().loop.now()
+        query = planner.query('X', 700, 1000, 2.0)
+        srcname, bins = next(query)
+        self.assertEquals(bins['timestamp'][0], 700)
+        self.assertTrue(gevent.get_hub().loop.now() - start < 0.4)
+        rest = list(query)
+        timestamps = np.concatenate([bins['timestamp']] +
+                                    [b['timestamp'] for s, b in rest])
+        self.assertEquals(list(timestamps), range(700, 1000, 2))
+
+    def test_order(self):
+        # the first chunk is the slowest; pieces still come in time order
+        source = Source(delay=lambda tstart: 0.1 if tstart < 720 else 0)
+        planner = QueryPlanner(sources=[('source', source)], chunkbins=8,
+                               settle=0, maxchunks=1)
+        pieces = list(planner.query('X', 700, 800, 2.0))
+        self.assertEquals(list(join(pieces)['timestamp']), range(700, 800, 2))
+
+    def test_stream(self):
+        frames = [wire.decode(frame) for frame in
+                  self.planner.stream(['X', 'Y'], 700, 1040, 2.0, framebins=50)]
+        self.assertEquals([len(bins) for s, t, f, bins in frames],
+                          [50, 50, 50, 20] * 2)
+        self.assertEquals([s for s, t, f, bins in frames], ['X'] * 4 + ['Y'] * 4)
+        expected = BinQuery(blocks, chunkbins=8, settle=0).query(
+                'X', 2.0, 700, 1040)
+        bins = np.concatenate([bins for s, t, f, bins in frames[:4]])
+        self.assertEquals(list(bins['timestamp']), list(expected['timestamp']))
+        self.assertEquals(list(bins['max']), list(expected['max']))
+
+    def test_backpressure(self):
+        source = Source()
+        planner = QueryPlanner(sources=[('source', source)], chunkbins=8,
+                               settle=0, concurrency=2, maxchunks=1)
+        stream = planner.stream(['X%d' % n for n in xrange(100)], 0, 16000,
+                                2.0, framebins=8)
+        next(stream)
+        gevent.sleep(0.01)
+        # production waits for the consumer
+        self.assertTrue(len(source.windows) <= 4)
+        next(stream)
+        stream.close()
+
+    def test_packet_source(self):
+        cache = PacketCache(1 << 20)
+        def loader(pktsrcname, tstart, tend):
+            if tstart < 100:
+                return None
+            return [(t, t + 10, 'x' * 10) for t in xrange(100, 200, 10)]
+        unpack = lambda srcname, pktsrcname, t, raw: [(t, range(t, t + 10), 1.0)]
+        packets = PacketSource(cache, unpack=unpack)
+        orb = PacketSource(cache, loader, unpack)
+        self.assertEquals(packets('X', 100, 120), None)
+        self.assertEquals(orb('X', 0, 20), None)
+        self.assertEquals(len(orb('X', 100, 120)), 2)
+        self.assertEquals(len(packets('X', 100, 120)), 2)
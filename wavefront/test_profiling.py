@@ -0,0 +1,86 @@
+import os
+import pstats
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+import gevent
+import numpy as np
+
+from wavefront.cbinner import Binner
+from wavefront.ctimebuf import BinBuffer
+from wavefront.controller import App
+from wavefront.profiling import Profiler
+
+
+def _update(binner, time, data):
+    binner.update(time, data, 40.0)
+
+
+def _ingest(binner):
+    data = np.arange(40, dtype=np.int32)
+    time = 0.0
+    while True:
+        _update(binner, time, data)
+        time += 1.0
+        gevent.sleep(0)
+
+
+class Test_Profiling(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.profiler = Profiler(self.tmpdir, seconds=0.1)
+
+    def tearDown(self):
+        self.profiler.uninstall()
+        shutil.rmtree(self.tmpdir)
+
+    def test_session(self):
+        binner = Binner('TA_STA_BHZ', 60.0, 1.0, BinBuffer(60, 0, 1.0))
+        ingest = gevent.spawn(_ingest, binner)
+        try:
+            session = self.profiler.start()
+            # one at a time
+            self.assertTrue(self.profiler.start() is session)
+            path = session.get(timeout=5)
+        finally:
+            ingest.kill()
+        self.assertEquals(os.path.dirname(path), self.tmpdir)
+        functions = [name for filename, line, name in pstats.Stats(path).stats]
+        self.assertTrue('_update' in functions)
+        # finished; next start is a new session
+        following = self.profiler.start(0.0)
+        self.assertFalse(following is session)
+        following.join()
+
+    def test_signal(self):
+        self.profiler.install(signal.SIGUSR2)
+        os.kill(os.getpid(), signal.SIGUSR2)
+        gevent.sleep(0.01)
+        self.assertTrue(self.profiler.session is not None)
+        path = self.profiler.session.get(timeout=5)
+        self.assertTrue(os.path.exists(path))
+
+    def test_app(self):
+        app = App(profile_dir=self.tmpdir)
+        path = os.path.join(self.tmpdir, 'app.prof')
+        self.assertEquals(app.profile(0.01, path).get(timeout=5), path)
+        self.assertTrue(os.path.exists(path))
+
+    def test_flavours(self):
+        script = ('import wavefront.controller, wavefront.cbinner as c, '
+                  'wavefront.ctimebuf as t; print c.__name__, t.__name__')
+        def modules(profile):
+            env = dict(os.environ)
+            env.pop('WAVEFRONT_PROFILE', None)
+            if profile:
+                env['WAVEFRONT_PROFILE'] = '1'
+            return subprocess.check_output([sys.executable, '-c', script],
+                                           env=env).split()
+        self.assertEquals(modules(False),
+                          ['wavefront.cbinner', 'wavefront.ctimebuf'])
+        self.assertEquals(modules(True),
+                          ['wavefront.cbinner_prof', 'wavefront.ctimebuf_prof'])
@@ -0,0 +1,74 @@
+from unittest import TestCase
+
+import numpy as np
+
+from wavefront.cbinner import Binner
+from wavefront.ctimebuf import BinBuffer
+from wavefront.query import BinQuery
+
+
+SAMPRATE = 4.0
+
+
+def blocks(tstart, tend):
+    """Blocks of 10 s of samples, with a gap from 200 to 240."""
+    for ts in np.arange(np.floor(tstart / 10) * 10, tend, 10):
+        if 200 <= ts < 240:
+            continue
+        yield ts, np.sin(ts + np.arange(40)), SAMPRATE
+
+
+class Source(object):
+    def __init__(self):
+        self.windows = []
+
+    def __call__(self, srcname, tstart, tend):
+        self.windows.append((tstart, tend))
+        return blocks(tstart, tend)
+
+
+class Test_BinQuery(TestCase):
+    def setUp(self):
+        self.source = Source()
+        self.query = BinQuery(self.source, chunkbins=8, settle=0)
+
+    def test_same_as_binner(self):
+        tbin = 5.0
+        store = BinBuffer(200, 1000, tbin)
+        binner = Binner('X', 1000.0, tbin, store)
+        for ts, samples, samprate in blocks(0, 1000):
+            binner.update(ts, samples, samprate)
+        expected = store.get_range(100, 300)
+        bins = self.query.query('X', tbin, 100, 300)
+        self.assertEquals(len(bins), 40)
+        self.assertEquals(list(bins['nsamples']), list(expected['nsamples']))
+        filled = bins['nsamples'] > 0
+        for field in 'timestamp', 'max', 'min', 'mean':
+            self.assertTrue(np.allclose(bins[field][filled],
+                                        expected[field][filled]), field)
+        self.assertTrue(np.isnan(bins['timestamp'][~filled]).all())
+        self.assertEquals(filled.sum(), 32)
+
+    def test_chunks_reused(self):
+        first = self.query.query('X', 1.0, 0, 40)
+        self.assertEquals(self.source.windows, [(0, 40)])
+        # panned; only the new chunk is read
+        self.query.query('X', 1.0, 20, 48)
+        self.assertEquals(self.source.windows[1:], [(40, 48)])
+        again = self.query.query('X', 1.0, 0, 40)
+        self.assertEquals(len(self.source.windows), 2)
+        self.assertEquals(again.tostring(), first.tostring())
+        # other bin sizes are cached separately
+        self.query.query('X', 2.0, 0, 40)
+        self.assertEquals(self.source.windows[2:], [(0, 48)])
+
+    def test_unaligned(self):
+        bins = self.query.query('X', 1.0, 3.5, 9.2)
+        self.assertEquals(list(bins['timestamp']), range(3, 10))
+        self.assertEquals(len(self.query.query('X', 1.0, 5, 5)), 0)
+
+    def test_unsettled(self):
+        query = BinQuery(self.source, chunkbins=8, settle=1e12)
+        query.query('X', 1.0, 0, 8)
+        query.query('X', 1.0, 0, 8)
+        self.assertEquals(len(self.source.windows), 2)
@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import gevent
+import numpy as np
+
+from wavefront.controller import Orb, ShardedOrb
+from wavefront.reap import Timeout, NoData
+from wavefront.replay import Recorder, ReplaySource, read
+
+
+class Test_Replay(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'capture')
+        with Recorder(self.path) as recorder:
+            for n in xrange(10):
+                recorder.add(n, 'TA_STA/MGENC', n * 10.0,
+                             [('TA', 'STA', 'BHZ', '', n * 10.0, 1.0,
+                               np.arange(10) + n * 10)])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_roundtrip(self):
+        source = ReplaySource(self.path, speed=None)
+        with source.open(0.1, after=45.0) as reaper:
+            pktid, srcname, time, raw = reaper.get()
+            self.assertEquals((pktid, srcname, time), (5, 'TA_STA/MGENC', 50.0))
+            packet = source.unstuff(srcname, time, raw)
+            channel = packet.channels[0]
+            self.assertEquals((channel.net, channel.sta, channel.chan,
+                               channel.loc, channel.time, channel.samprate),
+                              ('TA', 'STA', 'BHZ', '', 50.0, 1.0))
+            self.assertEquals(list(channel.data), range(50, 60))
+            for n in xrange(4):
+                reaper.get()
+            self.assertRaises(NoData, reaper.get)
+            self.assertTrue(reaper.exhausted)
+        self.assertEquals(len(list(read(self.path))), 10)
+
+    def test_speed(self):
+        # 10 s of packet time per packet at 100x; 0.1 s apart
+        source = ReplaySource(self.path, speed=100.0)
+        with source.open(0.05) as reaper:
+            self.assertEquals(reaper.get()[0], 0)
+            self.assertRaises(Timeout, reaper.get)
+            self.assertEquals(reaper.get()[0], 1)
+
+    def test_orb(self):
+        # no Antelope, no orb
+        source = ReplaySource(self.path, speed=None)
+        orb = Orb('capture', source=source, reap_latency=0.01)
+        orb.add_binner('TA_STA_BHZ', twin=100.0, tbin=10.0)
+        orb.start()
+        while source.replay is None or not source.replay.exhausted:
+            gevent.sleep(0.01)
+        orb.kill()
+        self.assertEquals(orb.npkts, 10)
+        bins = orb.binners.query('TA_STA_BHZ', 10.0)['TA_STA_BHZ']
+        self.assertEquals(list(bins['max']), range(9, 100, 10))
+        stats = orb._get_stats()
+        self.assertEquals(stats['npkts'], 10)
+        metrics = stats['metrics']
+        self.assertEquals(metrics['wavefront_packets_total'],
+                          [({'orb': 'capture'}, 10)])
+        self.assertEquals(metrics['wavefront_unstuff_seconds'][0][1]['count'],
+                          10)
+        self.assertEquals(metrics['wavefront_binner_update_seconds'][0][0],
+                          {'srcname': 'TA_STA_BHZ', 'tbin': 10.0})
+        self.assertEquals(metrics['wavefront_bins_published_total'][0][1], 10)
+        self.assertEquals(
+                metrics['wavefront_srcname_last_seen_seconds'][0][0],
+                {'srcname': 'TA_STA_BHZ'})
+        self.assertTrue('wavefront_reap_wait_seconds_count' in
+                        orb.metrics.render())
+
+    def test_snapshotter(self):
+        directory = os.path.join(self.tmpdir, 'snapshots')
+        path = os.path.join(directory, 'snapshot')
+        orb = Orb('capture', source=ReplaySource(self.path, speed=None),
+                  snapshot_path=path, snapshot_interval=0.01)
+        orb.add_binner('TA_STA_BHZ', twin=100.0, tbin=10.0)
+        snapshotter = gevent.spawn(orb._snapshotter)
+        try:
+            # failures, until the directory turns up
+            gevent.sleep(0.05)
+            os.mkdir(directory)
+            with gevent.Timeout(5):
+                while not os.path.exists(path):
+                    gevent.sleep(0.01)
+        finally:
+            snapshotter.kill()
+
+    def test_sharded_orb(self):
+        source = ReplaySource(self.path, speed=None)
+        orb = ShardedOrb('capture', 2, source=source, reap_latency=0.01)
+        orb.add_binner('TA_STA_BHZ', twin=100.0, tbin=10.0)
+        orb.start()
+        try:
+            with gevent.Timeout(10):
+                while orb.pool is None or sum(orb.pool.counts) < 10:
+                    gevent.sleep(0.01)
+            stats = orb._get_stats()
+        finally:
+            orb.kill()
+        # same shape as Orb's
+        self.assertTrue(set(Orb('x', source=source)._get_stats()) <=
+                        set(stats))
+        self.assertEquals(stats['npkts'], 10)
+        self.assertEquals(stats['binned'], 10)
+        self.assertEquals(len(stats['shards']), 2)
+        self.assertEquals(stats['metrics']['wavefront_packets_total'],
+                          [({'orb': 'capture'}, 10)])
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+from functools import partial
+from unittest import TestCase
+
+import gevent
+
+from wavefront.controller import _shard_controller
+from wavefront.shard import ShardPool, shard_of
+from wavefront.shmbuf import SharedBinReader
+
+
+SRCNAMES = ['AZ_PFO_BHZ', 'AZ_PFO_BHN', 'AZ_PFO_BHE', 'TA_109C_BHZ',
+            'TA_109C_BHN', 'TA_109C_BHE']
+
+
+def process(controller, item):
+    srcname, ts, samples = item
+    controller.update(srcname, ts, samples, 1.0)
+
+
+class Test_ShardPool(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_shard_of(self):
+        self.assertEquals(shard_of('AZ_PFO_BHZ', 1), 0)
+        # crc32 based, so the same in every process and on every run
+        self.assertEquals([shard_of(s, 3) for s in SRCNAMES],
+                          [2, 0, 1, 2, 1, 1])
+
+    def test_stop(self):
+        # no workers; the full queue never drains
+        pool = ShardPool(1, None, process, queuesize=1)
+        pool.dispatch('X', ('X', 0, [0]))
+        ticks = []
+        def tick():
+            while True:
+                ticks.append(None)
+                gevent.sleep(0.01)
+        ticker = gevent.spawn(tick)
+        try:
+            pool.stop(timeout=0.2)
+        finally:
+            ticker.kill()
+        # other greenlets ran while stop waited
+        self.assertTrue(len(ticks) > 5)
+
+    def test_dispatch(self):
+        nshards = 2
+        # the shard controllers of a ShardedOrb
+        path = os.path.join(self.dir, 'bins')
+        factory = partial(_shard_controller, [('.*_BH[ZNE]', 100.0, 1.0)],
+                          path, 1 << 20)
+        pool = ShardPool(nshards, factory, process, queuesize=4)
+        pool.start()
+        try:
+            for ts in xrange(0, 50, 5):
+                for srcname in SRCNAMES:
+                    pool.dispatch(srcname, (srcname, ts, range(ts, ts + 5)))
+        finally:
+            pool.stop()
+        self.assertEquals(pool.dead(), [])
+        stats = pool.stats()
+        self.assertEquals([s['shard'] for s in stats], range(nshards))
+        self.assertEquals(sum(s['pkts'] for s in stats), 10 * len(SRCNAMES))
+        for index in xrange(nshards):
+            reader = SharedBinReader('%s.%d' % (path, index))
+            expected = [s for s in SRCNAMES if shard_of(s, nshards) == index]
+            self.assertEquals(reader.srcnames(), sorted(expected))
+            for srcname in expected:
+                bins = reader.get_range(srcname, 1.0, 0, 50)
+                # every sample binned, in order
+                self.assertEquals(list(bins['max']), range(50))
+                self.assertTrue((bins['nsamples'] == 1).all())
@@ -0,0 +1,111 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from wavefront.cbinner import Binner
+from wavefront.shmbuf import SharedBinStore, SharedBinReader, \
+        SharedBufferError
+
+
+def read_remote(path, queue):
+    reader = SharedBinReader(path)
+    queue.put(reader.get_range('X', 1.0).tostring())
+
+
+class Test_Shared(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'bins')
+        self.store = SharedBinStore(self.path, 1 << 20, capacity=16)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def update(self, binner, ts, samples):
+        binner.store.begin()
+        binner.update(ts, samples, 4.0)
+        binner.store.commit()
+
+    def test_read(self):
+        buf = self.store.buffer('X', 10.0, 1.0)
+        binner = Binner('X', 10.0, 1.0, buf)
+        reader = SharedBinReader(self.path)
+        self.assertEquals(reader.get_range('X', 1.0)['nsamples'].sum(), 0)
+        self.update(binner, 100, np.arange(40))
+        bins = reader.get_range('X', 1.0)
+        self.assertEquals(bins.tostring(), buf.get_range().tostring())
+        self.assertEquals(list(bins['timestamp']), range(100, 110))
+        self.assertEquals(list(reader.get_range('X', 1.0, 105, 107)['max']),
+                          [23, 27])
+        self.assertEquals(reader.query(['X', 'Y'], 1.0).keys(), ['X'])
+
+    def test_new_channels(self):
+        reader = SharedBinReader(self.path)
+        self.assertEquals(reader.srcnames(), [])
+        self.store.buffer('X', 10.0, 1.0)
+        self.assertEquals(reader.srcnames(), ['X'])
+        self.assertEquals(reader.get_range('Y', 1.0), None)
+        self.store.buffer('Y', 10.0, 1.0)
+        self.assertNotEqual(reader.get_range('Y', 1.0), None)
+
+    def test_generations(self):
+        buf = self.store.buffer('X', 10.0, 1.0)
+        binner = Binner('X', 10.0, 1.0, buf)
+        self.store.buffer('Y', 10.0, 1.0)
+        reader = SharedBinReader(self.path)
+        before = reader.generations()
+        self.update(binner, 100, np.arange(4))
+        after = reader.generations()
+        self.assertEquals([k for k in after if after[k] != before[k]],
+                          [('X', 1.0)])
+        self.assertEquals(after[('X', 1.0)] % 2, 0)
+
+    def test_bind_copies(self):
+        buf = self.store.buffer('X', 4.0, 1.0)
+        columns = [np.array(getattr(buf, name)) for name in
+                   ('timestamps', 'maxes', 'mins', 'means', 'nsamples', 'sizes')]
+        columns[0][:] = [4, 5, 6, 7]
+        columns[4][:] = 1
+        buf.bind(8, *columns)
+        reader = SharedBinReader(self.path)
+        self.assertEquals(list(reader.get_range('X', 1.0)['timestamp']),
+                          [4, 5, 6, 7])
+
+    def test_stuck_writer(self):
+        buf = self.store.buffer('X', 10.0, 1.0)
+        reader = SharedBinReader(self.path, timeout=0.01)
+        # the writer dies mid-update
+        buf.begin()
+        self.assertRaises(SharedBufferError, reader.get_range, 'X', 1.0)
+        buf.commit()
+        self.assertEquals(len(reader.get_range('X', 1.0)), 10)
+
+    def test_replace(self):
+        buf = self.store.buffer('X', 10.0, 1.0)
+        self.update(Binner('X', 10.0, 1.0, buf), 100, np.arange(40))
+        reader = SharedBinReader(self.path)
+        # a restarted writer leaves the mapped file alone
+        SharedBinStore(self.path, 1 << 20, capacity=16)
+        self.assertEquals(list(reader.get_range('X', 1.0)['timestamp']),
+                          range(100, 110))
+        self.assertEquals(SharedBinReader(self.path).srcnames(), [])
+        self.assertEquals(os.listdir(self.dir), ['bins'])
+
+    def test_full(self):
+        self.assertRaises(SharedBufferError, self.store.buffer, 'X', 1e6, 1.0)
+        self.assertRaises(SharedBufferError, SharedBinReader, __file__)
+
+    def test_other_process(self):
+        buf = self.store.buffer('X', 10.0, 1.0)
+        self.update(Binner('X', 10.0, 1.0, buf), 100, np.arange(40))
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=read_remote,
+                                          args=(self.path, queue))
+        process.start()
+        result = queue.get(timeout=10)
+        process.join()
+        self.assertEquals(result, buf.get_range().tostring())
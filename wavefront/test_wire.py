@@ -0,0 +1,65 @@
+from wavefront.cbinner import Bin, Binner
+from wavefront.ctimebuf import BinBuffer
+from wavefront import wire
+from unittest import TestCase
+
+
+def makebin(timestamp, vals, size=4):
+    bin = Bin(timestamp, size)
+    for val in vals:
+        bin.add(timestamp, val)
+    return bin
+
+
+class Collector(object):
+    def __init__(self):
+        self.items = []
+
+    def put(self, obj, block=False):
+        self.items.append(obj)
+
+
+class Test_Wire(TestCase):
+    def test_roundtrip(self):
+        bins = [makebin(20, [1, 2]), makebin(10, [-1.5, 3, 4, 0])]
+        frame = wire.encode('NET_STA_CHAN', 10.0, bins)
+        self.assertEquals(len(frame), wire.HEADER.size + 12 + 2 * 20)
+        srcname, tbin, flags, decoded = wire.decode(frame)
+        self.assertEquals((srcname, tbin, flags), ('NET_STA_CHAN', 10.0, 0))
+        self.assertEquals(list(decoded['timestamp']), [10.0, 20.0])
+        self.assertEquals(list(decoded['max']), [4, 2])
+        self.assertEquals(list(decoded['min']), [-1.5, 1])
+        self.assertEquals(list(decoded['mean']), [1.375, 0.75])
+        self.assertEquals(list(decoded['nsamples']), [4, 2])
+
+    def test_empty(self):
+        srcname, tbin, flags, decoded = wire.decode(wire.encode('X', 1.0, []))
+        self.assertEquals(len(decoded), 0)
+
+    def test_bad_frame(self):
+        frame = wire.encode('X', 1.0, [makebin(0, [1])])
+        self.assertRaises(wire.FrameError, wire.decode, frame[:-1])
+        self.assertRaises(wire.FrameError, wire.decode, 'XX' + frame[2:])
+        self.assertRaises(wire.FrameError, wire.decode, frame[:4])
+
+    def test_delta(self):
+        encoder = wire.FrameEncoder('X', 10.0, delta=True)
+        a, b = makebin(0, [1]), makebin(10, [2])
+        frame = encoder.encode([a, b])
+        self.assertEquals(len(wire.decode(frame)[3]), 2)
+        self.assertEquals(encoder.encode([a, b]), None)
+        b.add(10, 5)
+        srcname, tbin, flags, decoded = wire.decode(encoder.encode([a, b, b]))
+        self.assertEquals(flags, wire.FLAG_DELTA)
+        self.assertEquals(list(decoded['timestamp']), [10.0])
+        self.assertEquals(list(decoded['max']), [5])
+
+    def test_binner_encoder(self):
+        binner = Binner('X', 40.0, 4.0, BinBuffer(10, 0, 4.0),
+                        wire.FrameEncoder('X', 4.0))
+        collector = Collector()
+        with binner.subscription(collector):
+            binner.update(0.0, range(10), 1.0)
+        self.assertEquals(len(collector.items), 1)
+        srcname, tbin, flags, decoded = wire.decode(collector.items[0])
+        self.assertEquals(list(decoded['timestamp']), [0.0, 4.0])
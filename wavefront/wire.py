@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+Compact binary frames for streaming bin updates to clients.
+
+A frame carries the updated bins of one channel (srcname, tbin). All values
+are little-endian::
+
+    header      '<2sBBHddI'  magic 'WF', version, flags, len(srcname),
+                             tbin, t0, count
+    srcname     len(srcname) bytes of ASCII
+    offsets     uint32[count]   bin timestamp = t0 + offset * tbin
+    max         float32[count]
+    min         float32[count]
+    mean        float32[count]
+    nsamples    int32[count]
+
+Bins are sorted by timestamp and t0 is the timestamp of the first one. That's
+20 bytes per bin, versus around 80 for a JSON dict.
+
+If FLAG_DELTA is set the frame is a delta against the previous frame of the
+same channel; bins which haven't changed since they were last sent are left
+out, so the client must keep the bins it already has. A client joining a
+delta stream late should prefill from a query.
+"""
+
+import struct
+
+import numpy as np
+
+from wavefront.ctimebuf import BIN_DTYPE, bins_to_array
+
+
+MAGIC = 'WF'
+VERSION = 1
+
+FLAG_DELTA = 0x01
+
+HEADER = struct.Struct('<2sBBHddI')
+
+COLUMNS = (
+    ('max', '<f4'),
+    ('min', '<f4'),
+    ('mean', '<f4'),
+    ('nsamples', '<i4'),
+)
+
+
+class FrameError(Exception): pass
+
+
+def _as_array(bins):
+    if not isinstance(bins, np.ndarray):
+        bins = bins_to_array(bins)
+    bins = bins[bins['nsamples'] > 0]
+    # sorted, and each bin once; updates may list the same bin twice
+    timestamps, index = np.unique(bins['timestamp'], return_index=True)
+    return bins[index]
+
+
+def encode(srcname, tbin, bins, flags=0):
+    """Encode bins, a sequence of Bin-like objects or a BIN_DTYPE array, into
+    one frame. Empty bins are dropped."""
+    bins = _as_array(bins)
+    t0 = bins['timestamp'][0] if len(bins) else 0.0
+    offsets = np.rint((bins['timestamp'] - t0) / tbin).astype('<u4')
+    parts = [HEADER.pack(MAGIC, VERSION, flags, len(srcname), tbin, t0,
+                         len(bins)),
+             srcname, offsets.tostring()]
+    for name, dtype in COLUMNS:
+        parts.append(bins[name].astype(dtype).tostring())
+    return ''.join(parts)
+
+
+def decode(frame):
+    """Decode a frame; return (srcname, tbin, flags, bins) where bins is a
+    structured array of BIN_DTYPE."""
+    try:
+        magic, version, flags, namelen, tbin, t0, count = \
+                HEADER.unpack_from(frame)
+    except struct.error, e:
+        raise FrameError("Truncated header: %s" % e)
+    if magic != MAGIC or version != VERSION:
+        raise FrameError("Bad magic or version %r %r" % (magic, version))
+    pos = HEADER.size
+    srcname = frame[pos:pos + namelen]
+    pos += namelen
+    if len(frame) != pos + count * 20:
+        raise FrameError("Bad frame length %d" % len(frame))
+    bins = np.empty(count, BIN_DTYPE)
+    offsets = np.frombuffer(frame, '<u4', count, pos)
+    bins['timestamp'] = t0 + offsets * tbin
+    pos += count * 4
+    for name, dtype in COLUMNS:
+        bins[name] = np.frombuffer(frame, dtype, count, pos)
+        pos += count * 4
+    return srcname, tbin, flags, bins
+
+
+class FrameEncoder(object):
+    """Encodes the updates of one channel, optionally as deltas.
+
+    With delta=True the encoder remembers what it last sent for each bin,
+    in float32 as the client sees it, and only encodes bins that changed.
+    encode() returns None if nothing did.
+    """
+
+    def __init__(self, srcname, tbin, delta=False):
+        self.srcname = srcname
+        self.tbin = tbin
+        self.delta = delta
+        # timestamp -> last sent (max, min, mean, nsamples)
+        self._sent = dict()
+
+    def encode(self, bins):
+        if not self.delta:
+            return encode(self.srcname, self.tbin, bins)
+        bins = _as_array(bins)
+        changed = np.zeros(len(bins), bool)
+        for n, bin in enumerate(bins):
+            state = tuple(np.asarray(bin[name], dtype).item()
+                          for name, dtype in COLUMNS)
+            if self._sent.get(bin['timestamp']) != state:
+                self._sent[bin['timestamp']] = state
+                changed[n] = True
+        if len(bins):
+            self._expire(bins['timestamp'][-1])
+        if not changed.any():
+            return None
+        return encode(self.srcname, self.tbin, bins[changed], FLAG_DELTA)
+
+    def _expire(self, newest, keep=4096):
+        """Forget bins far older than the newest one sent."""
+        if len(self._sent) > keep:
+            horizon = newest - keep * self.tbin
+            for ts in [ts for ts in self._sent if ts < horizon]:
+                del self._sent[ts]